@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+"""
+Asyncio counterpart of the `davinci_crawling.net` helpers.
+
+The requests are sent using per-proxy `httpx.AsyncClient`s that keep the
+connections to every host alive (and use HTTP/2 when the `h2` package is
+installed), so the TCP+TLS handshake is paid once per host instead of once per
+request.
+
+The coroutines can be awaited from any event loop. The threads that don't run
+an event loop (ex. the consumers of the crawl command) can use the `*_sync`
+functions, that run the coroutines on a shared background loop.
+"""
+import asyncio
+import cgi
+import inspect
+import json
+import logging
+import os
+import threading
+import weakref
+
+import httpx
+from bs4 import BeautifulSoup
+
+from davinci_crawling.exceptions import DownloadException
+from davinci_crawling.net import (
+    APPLICATION_FORM,
+    APPLICATION_JSON,
+    USER_AGENT,
+    DEFAULT_TIMEOUT,
+    HTTP_OK,
+    HTTP_BAD_REQUEST,
+    Page,
+    File,
+    get_download_destinations,
+    get_proxy_address,
+)
+from davinci_crawling.storage.storage import TeeWriter, get_storage
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_SUPPORT = True
+except ImportError:
+    HTTP2_SUPPORT = False
+
+logger = logging.getLogger("davinci_crawling")
+
+# Connections kept per client (proxy)
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 60
+
+DOWNLOAD_TIMEOUT = 1800
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# httpx renamed the `proxies` argument to `proxy`
+_PROXY_ARGUMENT = "proxy" if "proxy" in inspect.signature(httpx.AsyncClient.__init__).parameters else "proxies"
+
+
+class AsyncHttpEngine(object):
+    """
+    Keeps one `httpx.AsyncClient` (connection pool) per event loop and proxy
+    address, and a background event loop used by the sync facade.
+
+    The clients of a loop are forgotten when the loop is garbage collected,
+    a client is never used from a loop different than the one it was created
+    on.
+    """
+
+    def __init__(
+        self,
+        max_connections=DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections=DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY,
+        transport=None,
+    ):
+        """
+        Args:
+            max_connections: the maximum connections of every client.
+            max_keepalive_connections: the maximum idle connections kept
+            alive by every client.
+            keepalive_expiry: the seconds an idle connection is kept alive.
+            transport: the httpx transport of the clients, by default the
+            network (ex. an `httpx.MockTransport` in the tests).
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.transport = transport
+        # event loop -> {proxy url -> client}
+        self._clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._loop_thread = None
+
+    def get_client(self, use_proxy=True):
+        """
+        Get the client to use on the running loop.
+        Args:
+            use_proxy: if true the client will send the requests through one
+            of the proxies of the ProxyManager.
+
+        Returns: an httpx.AsyncClient
+        """
+        proxy_url = None
+        if use_proxy:
+            proxy_address = get_proxy_address()
+            proxy_url = proxy_address.get("https", proxy_address.get("http"))
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_clients = self._clients.setdefault(loop, {})
+            client = loop_clients.get(proxy_url)
+            if not client:
+                kwargs = {_PROXY_ARGUMENT: proxy_url} if proxy_url else {}
+                if self.transport:
+                    kwargs["transport"] = self.transport
+                client = httpx.AsyncClient(http2=HTTP2_SUPPORT, verify=False, limits=self.limits, **kwargs)
+                loop_clients[proxy_url] = client
+        return client
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def run_sync(self, coroutine):
+        """
+        Run the coroutine on the background loop of the engine and wait for
+        its result. Used from the threads that don't have an event loop.
+        """
+        with self._lock:
+            if not self._loop:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._run_loop, daemon=True)
+                self._loop_thread.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def aclose(self):
+        """
+        Close the clients created on the running loop.
+        """
+        with self._lock:
+            clients = self._clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.aclose()
+
+
+engine = AsyncHttpEngine()
+
+
+async def delete_json(url, timeout=None):
+    """
+    Async version of `net.delete_json`.
+    """
+    try:
+        timeout = timeout if timeout else DEFAULT_TIMEOUT
+
+        client = engine.get_client()
+        return await client.delete(url, headers={**APPLICATION_JSON, **USER_AGENT}, timeout=timeout)
+    except httpx.HTTPError as ex:
+        logger.exception("Unable to send the DELETE. Cause: %s" % ex)
+        raise ex
+
+
+async def get_json(url, timeout=None, custom_header=None, use_proxy=True):
+    """
+    Async version of `net.get_json`.
+    """
+    try:
+        timeout = timeout if timeout else DEFAULT_TIMEOUT
+
+        header = {**APPLICATION_JSON, **USER_AGENT}
+        if custom_header:
+            header.update(custom_header)
+
+        client = engine.get_client(use_proxy=use_proxy)
+        return await client.get(url, headers=header, timeout=timeout)
+    except httpx.HTTPError as ex:
+        logger.exception("Unable to send the GET. Cause: %s" % ex)
+        raise ex
+
+
+async def post_json(url, json_obj, timeout=None, use_proxy=True, custom_header=None):
+    """
+    Async version of `net.post_json`.
+    """
+    try:
+        json_body = json.dumps(json_obj)
+
+        timeout = timeout if timeout else DEFAULT_TIMEOUT
+
+        header = {**APPLICATION_JSON, **USER_AGENT}
+        if custom_header:
+            header.update(custom_header)
+
+        client = engine.get_client(use_proxy=use_proxy)
+        return await client.post(url, content=json_body, headers=header, timeout=timeout)
+    except httpx.HTTPError as ex:
+        logger.exception("Unable to send the POST. Cause: %s" % ex)
+        raise ex
+
+
+async def post_form(url, json_obj, timeout=None):
+    """
+    Async version of `net.post_form`.
+    """
+    try:
+        timeout = timeout if timeout else DEFAULT_TIMEOUT
+
+        client = engine.get_client()
+        return await client.post(url, data=json_obj, headers={**APPLICATION_FORM, **USER_AGENT}, timeout=timeout)
+    except httpx.HTTPError as ex:
+        logger.exception("Unable to send the POST. Cause: %s" % ex)
+        raise ex
+
+
+async def fetch_page(url, timeout):
+    """
+    Async version of `net.fetch_page`.
+    """
+    logger.info("Fetching page for %s" % url)
+    client = engine.get_client()
+    return await client.get(url, headers=USER_AGENT, timeout=timeout)
+
+
+async def fetch_json(url, timeout=None):
+    """
+    Async version of `net.fetch_json`.
+    """
+    response = await fetch_page(url, timeout if timeout else DEFAULT_TIMEOUT)
+    if response.status_code < HTTP_BAD_REQUEST:
+        return Page(response.status_code, response.json(), response)
+    return Page(response.status_code, response.text, response)
+
+
+async def fetch_html(url, timeout=None):
+    """
+    Async version of `net.fetch_html`.
+    """
+    response = await fetch_page(url, timeout if timeout else DEFAULT_TIMEOUT)
+    if response.status_code < HTTP_BAD_REQUEST:
+        return Page(response.status_code, BeautifulSoup(response.text), response)
+    return Page(response.status_code, response.text, response)
+
+
+async def fetch_file(url, options):
+    """
+    Async version of `net.fetch_file`.
+    """
+    try:
+        client = engine.get_client()
+        async with client.stream("GET", url, timeout=DOWNLOAD_TIMEOUT) as response:
+            params = cgi.parse_header(response.headers.get("Content-Disposition", ""))[-1]
+            if "filename" in params:
+                filename = params["filename"]
+            else:
+                filename = url.rpartition("/")[2]
+
+            filename = os.path.basename(filename)
+
+            status = response.status_code
+            if status != HTTP_OK:
+                raise Exception("Download failed with http status [%d]" % status)
+
+            dest_file, cache_file = get_download_destinations(options, filename)
+            logger.info(
+                "Download from [%s] and store into [%s]" % (url, ", ".join(filter(None, [dest_file, cache_file])))
+            )
+
+            loop = asyncio.get_running_loop()
+            # the writes could be uploads to GS, do not block the loop
+            f = await loop.run_in_executor(None, TeeWriter(filter(None, [dest_file, cache_file]), options).__enter__)
+            try:
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    if chunk:
+                        await loop.run_in_executor(None, f.write, chunk)
+            except BaseException as write_ex:
+                await loop.run_in_executor(None, f.__exit__, type(write_ex), write_ex, write_ex.__traceback__)
+                raise
+            await loop.run_in_executor(None, f.__exit__, None, None, None)
+
+        dest_file = get_storage(dest_file, options).local_path(dest_file) or dest_file
+
+        return File(status, dest_file, filename, response, cache_file=cache_file, checksum=f.checksum)
+    except Exception as ex:
+        logger.exception("Failed to download %s" % url)
+        raise DownloadException(url) from ex
+
+
+def run_sync(coroutine):
+    """
+    Run a coroutine (ex. `asyncio.gather` of several requests) from a thread
+    that doesn't have an event loop.
+    """
+    return engine.run_sync(coroutine)
+
+
+def delete_json_sync(url, timeout=None):
+    return run_sync(delete_json(url, timeout=timeout))
+
+
+def get_json_sync(url, timeout=None, custom_header=None, use_proxy=True):
+    return run_sync(get_json(url, timeout=timeout, custom_header=custom_header, use_proxy=use_proxy))
+
+
+def post_json_sync(url, json_obj, timeout=None, use_proxy=True, custom_header=None):
+    return run_sync(post_json(url, json_obj, timeout=timeout, use_proxy=use_proxy, custom_header=custom_header))
+
+
+def post_form_sync(url, json_obj, timeout=None):
+    return run_sync(post_form(url, json_obj, timeout=timeout))
+
+
+def fetch_page_sync(url, timeout):
+    return run_sync(fetch_page(url, timeout))
+
+
+def fetch_json_sync(url, timeout=None):
+    return run_sync(fetch_json(url, timeout=timeout))
+
+
+def fetch_html_sync(url, timeout=None):
+    return run_sync(fetch_html(url, timeout=timeout))
+
+
+def fetch_file_sync(url, options):
+    return run_sync(fetch_file(url, options))
@@ -2,21 +2,21 @@
 # Copyright (c) 2019 BuildGroup Data Services Inc.
 import json
 
-import os
-
 import django
 from _datetime import datetime
 from abc import ABCMeta
 import abc
+import functools
 import logging
+import threading
 
+from davinci_crawling.driver_pool import WebDriverPool, register_pool
 from davinci_crawling.management.commands.utils.utils import update_task_status
 
 from davinci_crawling.task.models import (
     Task,
     STATUS_FAULTY,
     STATUS_MAINTENANCE,
-    TaskMoreInfo,
     create_davinci_task_batch,
 )
 from davinci_crawling.proxy.proxy import ProxyManager
@@ -27,7 +27,6 @@ from django.core.management.base import DjangoHelpFormatter
 
 from davinci_crawling.time import mk_datetime
 from django.test import RequestFactory
-from django.utils import timezone
 
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -37,12 +36,74 @@ from solrq import Q
 
 _logger = logging.getLogger("davinci_crawling")
 
-CHROME_OPTIONS = Options()
-CHROME_OPTIONS.add_argument("--headless")
-CHROME_OPTIONS.add_argument("--no-sandbox")
-CHROME_OPTIONS.add_argument("--disable-gpu")
-CHROME_OPTIONS.add_argument("--disable-features=NetworkService")
-CHROME_OPTIONS.add_argument("--disable-dev-shm-usage")
+# Arguments used to launch all the browsers
+BASE_CHROME_ARGUMENTS = (
+    "--headless",
+    "--no-sandbox",
+    "--disable-gpu",
+    "--disable-features=NetworkService",
+    "--disable-dev-shm-usage",
+)
+
+# Launch profile used when there is no "chrome-profile" in the
+# architecture-params. The pages are loaded as in a regular browser, the
+# crawlers that only need the html can block the images and the fonts.
+DEFAULT_CHROME_PROFILE = {
+    "disable-images": False,
+    "disable-fonts": False,
+    "disable-extensions": True,
+    # patterns (ex. "*google-analytics.com*") of the urls that the browser
+    # should not request
+    "blocked-urls": [],
+    "arguments": [],
+}
+
+
+@functools.lru_cache(maxsize=1)
+def get_chrome_launch_profile():
+    """
+    The arguments, preferences and blocked urls of the launch profile. It's
+    built once and shared (read-only) by all the browsers.
+
+    Returns: a tuple with the arguments, the items of the preferences and
+    the blocked urls.
+    """
+    profile = dict(DEFAULT_CHROME_PROFILE)
+    if hasattr(settings, "DAVINCI_CONF") and "chrome-profile" in settings.DAVINCI_CONF.get("architecture-params", {}):
+        profile.update(settings.DAVINCI_CONF["architecture-params"]["chrome-profile"])
+
+    arguments = list(BASE_CHROME_ARGUMENTS)
+    prefs = {}
+    if profile["disable-images"]:
+        arguments.append("--blink-settings=imagesEnabled=false")
+        prefs["profile.managed_default_content_settings.images"] = 2
+    if profile["disable-fonts"]:
+        arguments.append("--disable-remote-fonts")
+    if profile["disable-extensions"]:
+        arguments.append("--disable-extensions")
+    arguments.extend(profile["arguments"])
+
+    return tuple(arguments), tuple(prefs.items()), tuple(profile["blocked-urls"])
+
+
+def get_chrome_options(chromium_file, proxy_address=None):
+    """
+    Build the options to launch a new browser, every browser has its own
+    options object.
+    """
+    arguments, prefs, _ = get_chrome_launch_profile()
+
+    chrome_options = Options()
+    for argument in arguments:
+        chrome_options.add_argument(argument)
+    if prefs:
+        chrome_options.add_experimental_option("prefs", dict(prefs))
+    if proxy_address:
+        chrome_options.add_argument("--proxy-server=%s" % proxy_address)
+
+    chrome_options.binary_location = chromium_file
+
+    return chrome_options
 
 
 def get_configuration(crawler_name):
@@ -62,6 +123,10 @@ class Crawler(metaclass=ABCMeta):
 
     proxy_manager = ProxyManager()
 
+    # The browsers shared by all the crawlers of the process
+    web_driver_pool = None
+    _web_driver_pool_lock = threading.Lock()
+
     # The unique name of the crawler to be identified in the system
     __crawler_name__ = None
 
@@ -93,11 +158,35 @@ class Crawler(metaclass=ABCMeta):
         if self.__serializer_class__:
             self.serializer = self.__serializer_class__(context={"request": self._get_fake_request()})
 
+    @classmethod
+    def _get_proxy_for_driver(cls):
+        proxy_address = cls.proxy_manager.get_proxy_address()
+        if proxy_address:
+            return proxy_address["http"].replace("http://", "")
+        return None
+
+    @classmethod
+    def _get_driver_proxy_address(cls, options):
+        if not options.pop("use_proxy", True):
+            return None
+        return cls._get_proxy_for_driver()
+
     @classmethod
     def get_web_driver(cls, **options):
         """
         Initialized the Web Driver to allow dynamic web processing
 
+        :param options:
+        :return: the driver informed in the options (chromium has preference)
+        """
+        return cls.create_web_driver(cls._get_driver_proxy_address(options), **options)
+
+    @classmethod
+    def create_web_driver(cls, proxy_address=None, **options):
+        """
+        Launch a new Web Driver that uses the proxy informed.
+
+        :param proxy_address: the proxy (host:port) used by the driver.
         :param options:
         :return: the driver informed in the options (chromium has preference)
         """
@@ -106,18 +195,10 @@ class Crawler(metaclass=ABCMeta):
 
         # Chromium folder
         chromium_file = options.get("chromium_bin_file", None)
-        use_proxy = options.pop("use_proxy", True)
-        path = os.path.dirname(os.path.abspath(__file__))
         if chromium_file:
-            if use_proxy:
-                proxy_address = cls.proxy_manager.get_proxy_address()
-                if proxy_address:
-                    proxy_address = proxy_address["http"].replace("http://", "")
-                    CHROME_OPTIONS.add_argument("--proxy-server=%s" % proxy_address)
-
-            CHROME_OPTIONS.binary_location = chromium_file
+            chrome_options = get_chrome_options(chromium_file, proxy_address)
 
-            capabilities = DesiredCapabilities.CHROME
+            capabilities = DesiredCapabilities.CHROME.copy()
 
             if Crawler.CHROME_DESIREDCAPABILITIES in options:
                 for key, value in options[Crawler.CHROME_DESIREDCAPABILITIES].items():
@@ -127,7 +208,14 @@ class Crawler(metaclass=ABCMeta):
             # reference: https://stackoverflow.com/questions/27644615/getting-chrome-performance-and-tracing-logs
             capabilities["goog:loggingPrefs"] = {"performance": "ALL"}
 
-            driver = webdriver.Chrome(chrome_options=CHROME_OPTIONS, desired_capabilities=capabilities)
+            driver = webdriver.Chrome(chrome_options=chrome_options, desired_capabilities=capabilities)
+
+            blocked_urls = get_chrome_launch_profile()[2]
+            if blocked_urls and hasattr(driver, "execute_cdp_cmd"):
+                # the requests are blocked by the browser, it works also when
+                # the hosts are resolved by the proxy
+                driver.execute_cdp_cmd("Network.enable", {})
+                driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(blocked_urls)})
 
             _logger.info("Using CHROMIUM as Dynamic Web Driver. Driver {}".format(repr(driver)))
         else:
@@ -142,6 +230,39 @@ class Crawler(metaclass=ABCMeta):
 
         return driver
 
+    @classmethod
+    def get_web_driver_pool(cls):
+        with Crawler._web_driver_pool_lock:
+            if not Crawler.web_driver_pool:
+                Crawler.web_driver_pool = register_pool(WebDriverPool(Crawler.create_web_driver))
+        return Crawler.web_driver_pool
+
+    @classmethod
+    def checkout_web_driver(cls, **options):
+        """
+        Get a Web Driver from the pool of drivers of the process. An idle
+        driver of any proxy is reused, the proxy is only chosen when there is
+        no one idle and a new driver is launched.
+        It should be given back with `checkin_web_driver` instead of quit.
+
+        :param options:
+        :return: the driver informed in the options (chromium has preference)
+        """
+        if not options.pop("use_proxy", True):
+            return cls.get_web_driver_pool().checkout(None, **options)
+        return cls.get_web_driver_pool().checkout_any(cls._get_proxy_for_driver, **options)
+
+    @classmethod
+    def checkin_web_driver(cls, driver, discard=False):
+        """
+        Give back to the pool a driver obtained with `checkout_web_driver`.
+
+        :param driver: the driver to give back.
+        :param discard: quit the driver instead of reusing it, use it when the
+            session of the driver is in a wrong state.
+        """
+        cls.get_web_driver_pool().checkin(driver, discard=discard)
+
     def __get_version(self):
         """
         Return the Django version, which should be correct for all built-in
@@ -338,12 +459,9 @@ class Crawler(metaclass=ABCMeta):
             "params": task.params,
             "type": task.type,
             "user": task.user,
-            "more_info": [
-                TaskMoreInfo(**{"source": self.__crawler_name__, "created_at": timezone.now(), "details": more_info})
-            ],
         }
 
-        create_davinci_task_batch(task_data)
+        create_davinci_task_batch(task_data, events=[(self.__crawler_name__, more_info)])
 
     @staticmethod
     def _get_fake_request():
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+"""
+Pool of dynamic web drivers (headless browsers).
+
+Launching a browser takes several seconds, the pool keeps the browsers alive
+between tasks and gives them back with a clean session (no cookies, no local
+or session storage of any origin). The browsers are bound to the proxy they
+were launched with, so a checkout for a proxy reuses a browser of the same
+proxy, and a checkout for any proxy reuses any idle browser.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+_logger = logging.getLogger("davinci_crawling")
+
+# Maximum quantity of browsers alive at the same time
+DEFAULT_MAX_SIZE = 10
+
+# Quit the browser after using it this quantity of times, long-lived browsers
+# leak memory
+DEFAULT_MAX_USES = 50
+
+# Seconds that a checkout waits for a free browser
+DEFAULT_CHECKOUT_TIMEOUT = 300
+
+
+def _get_pool_settings():
+    if hasattr(settings, "DAVINCI_CONF") and "web-driver-pool" in settings.DAVINCI_CONF.get("architecture-params", {}):
+        return settings.DAVINCI_CONF["architecture-params"]["web-driver-pool"]
+    return {}
+
+
+class _PooledDriver(object):
+    __slots__ = ("driver", "key", "uses")
+
+    def __init__(self, driver, key):
+        self.driver = driver
+        self.key = key
+        self.uses = 0
+
+
+class WebDriverPool(object):
+    """
+    Bounded and thread safe pool of web drivers.
+
+    The drivers are created by the `factory` function, that receives the
+    proxy address (or None) and the options of the crawler. The idle drivers
+    are grouped by proxy and driver options, every group is an LRU queue.
+    """
+
+    def __init__(self, factory, max_size=None, max_uses=None, checkout_timeout=None):
+        """
+        Args:
+            factory: function(proxy_address, **options) that launches a new
+            driver.
+            max_size: maximum quantity of drivers alive (idle or in use).
+            max_uses: quantity of checkouts after which a driver is recycled.
+            checkout_timeout: seconds to wait for a free driver.
+        """
+        pool_settings = _get_pool_settings()
+        self.factory = factory
+        self.max_size = max_size or pool_settings.get("max-size", DEFAULT_MAX_SIZE)
+        self.max_uses = max_uses or pool_settings.get("max-uses", DEFAULT_MAX_USES)
+        self.checkout_timeout = checkout_timeout or pool_settings.get("checkout-timeout", DEFAULT_CHECKOUT_TIMEOUT)
+
+        # key -> OrderedDict(id(driver) -> _PooledDriver)
+        self._idle = {}
+        # id(driver) -> _PooledDriver
+        self._in_use = {}
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def _get_key(proxy_address, options):
+        return (
+            proxy_address,
+            options.get("chromium_bin_file", None),
+            options.get("phantomjs_path", None),
+        )
+
+    @staticmethod
+    def _is_alive(driver):
+        try:
+            # any command sent to a dead browser raises an exception
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset_session(driver):
+        """
+        Remove all the state left by the previous user of the driver, the
+        cookies and the storages of all the origins are cleared with the
+        DevTools protocol of Chrome.
+
+        Returns: False if the driver cannot clear the state of all the origins
+        (ex. PhantomJS), it should be recycled.
+        """
+        if not hasattr(driver, "execute_cdp_cmd"):
+            # the WebDriver API only clears the state of the current origin
+            return False
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": "*", "storageTypes": "all"})
+        driver.get("about:blank")
+        return True
+
+    @staticmethod
+    def _quit(pooled):
+        try:
+            pooled.driver.quit()
+        except Exception:
+            _logger.debug("Unable to quit the driver {}".format(repr(pooled.driver)), exc_info=True)
+
+    def _pop_idle(self, key):
+        idle = self._idle.get(key)
+        if idle:
+            return idle.popitem(last=False)[1]
+        return None
+
+    def _pop_oldest_idle(self):
+        for key, idle in self._idle.items():
+            if idle:
+                return idle.popitem(last=False)[1]
+        return None
+
+    def _pop_idle_any_proxy(self, options):
+        # the groups with the same driver options and a proxy
+        driver_key = self._get_key(None, options)[1:]
+        for key, idle in self._idle.items():
+            if idle and key[0] and key[1:] == driver_key:
+                return idle.popitem(last=False)[1]
+        return None
+
+    def checkout_any(self, get_proxy_address, **options):
+        """
+        Get an idle driver of any proxy, the proxy is only chosen when a new
+        driver should be launched, so the launch of a browser is not paid
+        just because the proxy chosen has no idle drivers.
+        Args:
+            get_proxy_address: function that returns the proxy address for a
+            new driver.
+            options: the options of the crawler.
+
+        Returns: the driver, with a clean session.
+        """
+        while True:
+            with self._condition:
+                pooled = self._pop_idle_any_proxy(options)
+            if not pooled:
+                return self.checkout(get_proxy_address(), **options)
+
+            if self._is_alive(pooled.driver):
+                pooled.uses += 1
+                with self._condition:
+                    self._in_use[id(pooled.driver)] = pooled
+                return pooled.driver
+
+            _logger.debug("Discarding the dead driver {}".format(repr(pooled.driver)))
+            self._quit(pooled)
+            self._release_slot()
+
+    def checkout(self, proxy_address=None, **options):
+        """
+        Get a driver from the pool, launching a new one if there are none idle
+        for the proxy and the pool is not full.
+        Args:
+            proxy_address: the address of the proxy that the driver should use.
+            options: the options of the crawler.
+
+        Returns: the driver, with a clean session.
+        """
+        key = self._get_key(proxy_address, options)
+        deadline = time.time() + self.checkout_timeout
+
+        while True:
+            to_quit = None
+            create = False
+            with self._condition:
+                pooled = self._pop_idle(key)
+                if not pooled:
+                    if self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                    else:
+                        # make room for the new proxy quitting the driver that
+                        # has been idle for longer
+                        to_quit = self._pop_oldest_idle()
+                        if to_quit:
+                            create = True
+                        else:
+                            remaining = deadline - time.time()
+                            if remaining <= 0 or not self._condition.wait(remaining):
+                                raise TimeoutError(
+                                    "No web driver available after {} seconds".format(self.checkout_timeout)
+                                )
+                            continue
+
+            if to_quit:
+                self._quit(to_quit)
+
+            if create:
+                try:
+                    pooled = _PooledDriver(self.factory(proxy_address, **options), key)
+                except Exception:
+                    self._release_slot()
+                    raise
+                if not pooled.driver:
+                    self._release_slot()
+                    return None
+            elif not self._is_alive(pooled.driver):
+                _logger.debug("Discarding the dead driver {}".format(repr(pooled.driver)))
+                self._quit(pooled)
+                self._release_slot()
+                continue
+
+            pooled.uses += 1
+            with self._condition:
+                self._in_use[id(pooled.driver)] = pooled
+            return pooled.driver
+
+    def _release_slot(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def checkin(self, driver, discard=False):
+        """
+        Give back a driver to the pool.
+        Args:
+            driver: the driver obtained with `checkout`.
+            discard: if true the driver is quit instead of being reused, use
+            it when the session of the driver is broken.
+        """
+        if not driver:
+            return
+
+        with self._condition:
+            pooled = self._in_use.pop(id(driver), None)
+
+        if not pooled:
+            # not created by the pool
+            driver.quit()
+            return
+
+        if not discard and not self._closed and pooled.uses < self.max_uses:
+            try:
+                discard = not self._reset_session(driver)
+            except Exception:
+                _logger.debug("Unable to reset the session of the driver {}".format(repr(driver)), exc_info=True)
+                discard = True
+        else:
+            discard = True
+
+        if discard:
+            self._quit(pooled)
+            self._release_slot()
+            return
+
+        with self._condition:
+            self._idle.setdefault(pooled.key, OrderedDict())[id(driver)] = pooled
+            self._condition.notify()
+
+    def close(self):
+        """
+        Quit all the idle drivers, the drivers in use are quit when they are
+        given back.
+        """
+        with self._condition:
+            idle = [pooled for drivers in self._idle.values() for pooled in drivers.values()]
+            self._idle = {}
+            self._size -= len(idle)
+            self._closed = True
+
+        for pooled in idle:
+            self._quit(pooled)
+
+
+_pools = []
+
+
+def register_pool(pool):
+    _pools.append(pool)
+    return pool
+
+
+@atexit.register
+def _close_pools():
+    for pool in _pools:
+        pool.close()
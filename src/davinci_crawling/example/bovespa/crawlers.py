@@ -321,9 +321,8 @@ class BovespaCrawler(Crawler):
         try:
             # Download the files from the source and save them into the local
             # and permanent storage for further processing.
-            # It extract the files into a working folder and return the list of
-            # files that can be processed
-            local_file, working_local_file, files_to_process = download_file(options, **crawling_params)
+            # It reads the files that can be processed from the zip files
+            local_file, files_to_process = download_file(options, **crawling_params)
 
             # Open the files and process the content to generate the
             # BovespaCompanyNumbers with all the financial data of the company
@@ -331,7 +330,6 @@ class BovespaCrawler(Crawler):
 
             # Remove cached files
             delete_all(options, local_file)
-            delete_all(options, working_local_file)
         except Exception:
             _logger.exception(f"Unable to process crawling task {task_id}" f" with params {crawling_params}")
 
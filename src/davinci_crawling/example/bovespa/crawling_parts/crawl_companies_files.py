@@ -2,18 +2,20 @@
 # Copyright (c) 2019 BuildGroup Data Services Inc.
 
 import logging
-import re
 import traceback
+from datetime import date, datetime
 
 from caravaggio_rest_api.haystack.backends.utils import CaravaggioSearchPaginator
+from caravaggio_rest_api.haystack.query import CaravaggioSearchQuerySet
+from haystack import connections
 from davinci_crawling.net import wait_tenaciously
 from multiprocessing.pool import ThreadPool as Pool
 from urllib.parse import urlencode
 
 import pytz
 from bs4 import BeautifulSoup
-from dateutil.parser import parse as date_parse
 from davinci_crawling.example.bovespa import BOVESPA_CRAWLER
+from davinci_crawling.example.bovespa.crawling_parts.enet_listing import EnetListingPage
 from davinci_crawling.example.bovespa.models import (
     BovespaCompany,
     BovespaCompanyFile,
@@ -30,31 +32,18 @@ from selenium.common.exceptions import WebDriverException
 from solrq import Range, ANY, Q
 
 try:
-    from dse.cqlengine.query import LWTException
+    from dse.cqlengine.query import BatchQuery, BatchType
 except ImportError:
-    from cassandra.cqlengine.query import LWTException
+    from cassandra.cqlengine.query import BatchQuery, BatchType
 
 
-RE_DOWNLOAD_FILE = r"javascript:fVisualizaArquivo_ENET\('([\d]+)','DOWNLOAD'\)"
-RE_FISCAL_DATE = r"Data Encerramento.*[\s].*(\d{2}/\d{2}/\d{4})"
-RE_DELIVERY_DATE = r"Data Entrega.*[\s].*(\d{2}/\d{2}/\d{4}) \d{2}:\d{2}"
-RE_VERSION = r"Versão.*[\s].*(\d+.\d+)"
-RE_DELIVERY_TYPE = r"Tipo Apresentação.*[\s].*<td.*>([\w\s]*)</td>"
-RE_COMPANY_NAME = r"Razão Social.*:(.*)<br/>"
-RE_CNPJ = r"CNPJ.*:(.*)\s"
-RE_TOTAL_FILES = r"(\d*) documento\(s\) encontrado\(s\)"
-RE_LAST_FILE_IN_PAGE = r"Exibindo (\d*) a (\d*)"
-
 NEXT_PAGE_LINK_TEXT = "Próximos >>"
 
 COMPANY_DOCUMENTS_URL = "http://siteempresas.bovespa.com.br/" "consbov/ExibeTodosDocumentosCVM.asp?{}"
 
+# Maximum quantity of company files written on each batch
+DEFAULT_FILES_BATCH_SIZE = 50
 
-DOWNLOAD_URL = (
-    "http://www.rad.cvm.gov.br/enetconsulta/"
-    "frmDownloadDocumento.aspx?CodigoInstituicao=1&"
-    "NumeroSequencialDocumento={protocol}"
-)
 
 _logger = logging.getLogger("davinci_crawler_{}.crawling_part.company_files".format(BOVESPA_CRAWLER))
 
@@ -89,9 +78,35 @@ def compare_dates(date_a, date_b):
         return 0
 
 
+def _files_to_be_processed_filter():
+    return ~Q(file_url=Range(ANY, ANY)) | Q(status=FILE_STATUS_NOT_PROCESSED)
+
+
+def get_companies_with_files_to_be_processed():
+    """
+    Get in a single faceted query the companies that have files pending to
+    be processed.
+
+    Returns: a set with the ccvm codes of the companies.
+    """
+    _logger.debug("Loading from database the companies with files to be crawled...")
+    facets = (
+        CaravaggioSearchQuerySet()
+        .models(BovespaCompanyFile)
+        .raw_search(str(_files_to_be_processed_filter()))
+        .facet("ccvm", limit=-1, mincount=1)
+        .facet_counts()
+    )
+
+    facet_field = connections["default"].get_unified_index().get_facet_fieldname("ccvm")
+    ccvm_counts = facets.get("fields", {}).get(facet_field, [])
+
+    _logger.debug("{0} companies HAVE FILES PENDING to be processed...".format(len(ccvm_counts)))
+    return {ccvm for ccvm, count in ccvm_counts if count > 0}
+
+
 def has_files_to_be_processed(ccvm):
-    filter = ~Q(file_url=Range(ANY, ANY)) | Q(status=FILE_STATUS_NOT_PROCESSED)
-    filter = Q(ccvm=ccvm) & (filter)
+    filter = Q(ccvm=ccvm) & (_files_to_be_processed_filter())
 
     _logger.debug("Loading from database the files to be crawled...")
     paginator = (
@@ -110,6 +125,76 @@ def has_files_to_be_processed(ccvm):
     return False
 
 
+def _get_file_key(fiscal_date, version):
+    # the listing gives us datetimes and the database dates (or the driver
+    # Date when it's out of the python range)
+    if isinstance(fiscal_date, datetime) or not isinstance(fiscal_date, date):
+        fiscal_date = fiscal_date.date()
+    return fiscal_date, version
+
+
+def get_company_files_status(ccvm, doc_type):
+    """
+    Read in a single query the status of all the files of a company for a
+    doc type.
+
+    Returns: a dict with the status of every (fiscal_date, version).
+    """
+    return {
+        _get_file_key(file.fiscal_date, file.version): file.status
+        for file in BovespaCompanyFile.objects.filter(ccvm=ccvm, doc_type=doc_type)
+        .only(["fiscal_date", "version", "status"])
+        .all()
+    }
+
+
+def save_company_files(producer, options, new_files, reactivated_files, batch_size=DEFAULT_FILES_BATCH_SIZE):
+    """
+    Write the files of a company found in a listing page and add the crawl
+    params to download them. All the files share the partition of the
+    company, they are sent in unlogged batches.
+    Args:
+        producer: the producer of the crawl params.
+        options: the options that was specified on the command run.
+        new_files: the data of the files that are not in the database.
+        reactivated_files: the data of the files that were in error and
+        should be processed again.
+        batch_size: the maximum quantity of files per batch.
+    """
+    all_files = [(company_file_data, False) for company_file_data in new_files] + [
+        (company_file_data, True) for company_file_data in reactivated_files
+    ]
+    if not all_files:
+        return
+
+    for start in range(0, len(all_files), batch_size):
+        batch = BatchQuery(batch_type=BatchType.Unlogged)
+        for company_file_data, reactivated in all_files[start : start + batch_size]:
+            if reactivated:
+                BovespaCompanyFile.objects.filter(
+                    ccvm=company_file_data["ccvm"],
+                    doc_type=company_file_data["doc_type"],
+                    fiscal_date=company_file_data["fiscal_date"],
+                    version=company_file_data["version"],
+                ).batch(batch).update(status=FILE_STATUS_NOT_PROCESSED, updated_at=datetime.utcnow())
+            else:
+                BovespaCompanyFile(**company_file_data).batch(batch).save()
+        batch.execute()
+
+    producer.add_crawl_params_bulk(
+        [
+            {
+                "ccvm": company_file_data["ccvm"],
+                "doc_type": company_file_data["doc_type"],
+                "fiscal_date": company_file_data["fiscal_date"],
+                "version": company_file_data["version"],
+            }
+            for company_file_data, _ in all_files
+        ],
+        options,
+    )
+
+
 def extract_ENET_files_from_page(producer, options, ccvm, driver, bs, doc_type, from_date=None, to_date=None):
     """
     Extract all the files to download from the listing HTML page
@@ -127,121 +212,88 @@ def extract_ENET_files_from_page(producer, options, ccvm, driver, bs, doc_type,
     """
     files = []
 
-    # Extract the company name from the content
-    company_name = re.search(RE_COMPANY_NAME, str(bs))[1].strip()
+    page = EnetListingPage(bs, doc_type)
 
-    # Extract the CNPJ from the content
-    company_cnpj = re.search(RE_CNPJ, str(bs))[1].strip().lower()
+    company_name = page.company_name
+    company_cnpj = page.company_cnpj
 
     _logger.debug("Extracting files from {0} - {1}".format(company_name, company_cnpj))
 
     # Get the number of files we should expect to find for the company
-    try:
-        num_of_docs = int(re.search(RE_TOTAL_FILES, str(bs))[1])
-        _logger.debug("Total files {0}".format(num_of_docs))
-    except Exception as ex:
+    num_of_docs = page.num_of_docs
+    if num_of_docs is None:
         _logger.warning(
             "There is no files information in the companies "
             "files page for [{ccvm} - {doc_type}] ".format(ccvm=ccvm, doc_type=doc_type)
         )
         return files
+    _logger.debug("Total files {0}".format(num_of_docs))
+
+    # The status of the files of the company that we already know
+    existing_files = get_company_files_status(ccvm, doc_type)
 
     while True:
+        new_files = []
+        reactivated_files = []
+
         # Get the number of files we can really get from the current page
-        last_file_in_page = int(re.search(RE_LAST_FILE_IN_PAGE, str(bs))[2])
+        last_file_in_page = page.last_file_in_page
         _logger.debug("Last file in page: {0}".format(last_file_in_page))
 
-        # Obtain the table elements that contains information about the
-        # financial statements of the company we are interested in
-        # ITR or DFP
-        all_tables = [
-            tag.findParent("table")
-            for tag in bs.find_all(text=re.compile("{} - ENET.*".format(doc_type)))
-            if tag.findParent("table")
-        ]
+        # The files of the financial statements of the company we are
+        # interested in (ITR or DFP)
+        page_files, not_available = page.get_files()
+        if not_available:
+            _logger.debug("{0} files are not available in ENET format".format(not_available))
 
-        # For each table we extract the files information of all the files
-        # that belongs to a fiscal period after the from_date argument.
-        if len(all_tables) > 0:
-            for table in all_tables:
-                link_tag = table.find("a", href=re.compile(RE_DOWNLOAD_FILE))
-                if link_tag:
-                    fiscal_date = re.search(RE_FISCAL_DATE, str(table))[1]
-                    fiscal_date = date_parse(fiscal_date)
-
-                    delivery_date = re.search(RE_DELIVERY_DATE, str(table))[1]
-                    delivery_date = date_parse(delivery_date)
-
-                    # We only continue processing files from the HTML page
-                    # if are newer (deliver after) than the from_date argument.
-                    # We look for newer delivery files
-                    if from_date is not None and (
-                        compare_dates(delivery_date, from_date) <= 0 or compare_dates(delivery_date, to_date) >= 0
-                    ):
-                        continue
-
-                    version = re.search(RE_VERSION, str(table))[1]
-
-                    delivery_type = re.search(RE_DELIVERY_TYPE, str(table))[1]
-
-                    protocol = re.match(RE_DOWNLOAD_FILE, link_tag.attrs["href"])[1]
-
-                    source_url = DOWNLOAD_URL.format(protocol=protocol)
-
-                    company_file_data = {
-                        "ccvm": ccvm,
-                        "doc_type": doc_type,
-                        "fiscal_date": fiscal_date,
-                        "version": version,
-                        "company_name": company_name,
-                        "company_cnpj": company_cnpj,
-                        "delivery_date": delivery_date,
-                        "delivery_type": delivery_type,
-                        "protocol": protocol,
-                        "source_url": source_url,
-                    }
-
-                    # We only create the company files if the file is not
-                    # already present in the system
-                    try:
-                        task_params = {
-                            "ccvm": ccvm,
-                            "doc_type": doc_type,
-                            "fiscal_date": fiscal_date,
-                            "version": version,
-                        }
-
-                        try:
-                            file = BovespaCompanyFile.objects.get(
-                                ccvm=ccvm, doc_type=doc_type, fiscal_date=fiscal_date, version=version
-                            )
-                            # Reactivate the task and change the file status
-                            if file.status == FILE_STATUS_ERROR:
-                                file.update(status=FILE_STATUS_NOT_PROCESSED)
-                                producer.add_crawl_params(task_params, options)
-                        except BovespaCompanyFile.DoesNotExist:
-                            BovespaCompanyFile.create(**company_file_data)
-                            producer.add_crawl_params(task_params, options)
-                    except LWTException as e:
-                        _logger.warning(
-                            "The company file [{ccvm} - '{name}' - {doc_type}"
-                            " - {fiscal_date:%Y-%m-%d} - {version}]"
-                            " cannot be created. The file already exists.".format(
-                                ccvm=ccvm,
-                                name=company_name,
-                                doc_type=doc_type,
-                                fiscal_date=fiscal_date,
-                                version=version,
-                            )
-                        )
-                        pass
-
-                    files.append(company_file_data)
-                else:
-                    _logger.debug("The file is not available in ENET format")
-        else:
+        if not page_files and not not_available:
             _logger.debug(f"No {doc_type} - ENET files available " f"for company: {ccvm}")
 
+        # For each file we extract the files information of all the files
+        # that belongs to a fiscal period after the from_date argument.
+        for enet_file in page_files:
+            fiscal_date = enet_file.fiscal_date
+            delivery_date = enet_file.delivery_date
+
+            # We only continue processing files from the HTML page
+            # if are newer (deliver after) than the from_date argument.
+            # We look for newer delivery files
+            if from_date is not None and (
+                compare_dates(delivery_date, from_date) <= 0 or compare_dates(delivery_date, to_date) >= 0
+            ):
+                continue
+
+            version = enet_file.version
+
+            company_file_data = {
+                "ccvm": ccvm,
+                "doc_type": doc_type,
+                "fiscal_date": fiscal_date,
+                "version": version,
+                "company_name": company_name,
+                "company_cnpj": company_cnpj,
+                "delivery_date": delivery_date,
+                "delivery_type": enet_file.delivery_type,
+                "protocol": enet_file.protocol,
+                "source_url": enet_file.source_url,
+            }
+
+            # We only create the company files if the file is not
+            # already present in the system
+            file_key = _get_file_key(fiscal_date, version)
+            status = existing_files.get(file_key)
+            if status is None:
+                new_files.append(company_file_data)
+                existing_files[file_key] = FILE_STATUS_NOT_PROCESSED
+            elif status == FILE_STATUS_ERROR:
+                # Reactivate the task and change the file status
+                reactivated_files.append(company_file_data)
+                existing_files[file_key] = FILE_STATUS_NOT_PROCESSED
+
+            files.append(company_file_data)
+
+        save_company_files(producer, options, new_files, reactivated_files)
+
         if last_file_in_page == num_of_docs:
             # We loaded all the files
             break
@@ -264,7 +316,8 @@ def extract_ENET_files_from_page(producer, options, ccvm, driver, bs, doc_type,
                         "and {doc_type}. Showing 'Error de Aplicacao'".format(ccvm=ccvm, doc_type=doc_type)
                     )
                     raise
-            bs = BeautifulSoup(driver.page_source, "html.parser")
+            # the python parser is used when lxml is not installed
+            page = EnetListingPage.from_page_source(driver.page_source, doc_type, use_lxml=True)
 
     return files
 
@@ -289,8 +342,9 @@ def obtain_company_files(producer, ccvm, options, doc_type, from_date=None, to_d
     files = []
     driver = None
 
+    crawler = CrawlersRegistry().get_crawler(BOVESPA_CRAWLER)
     try:
-        driver = CrawlersRegistry().get_crawler(BOVESPA_CRAWLER).get_web_driver(**options)
+        driver = crawler.checkout_web_driver(**options)
 
         encoded_args = urlencode({"CCVM": ccvm, "TipoDoc": "C", "QtLinks": "1000"})
         url = COMPANY_DOCUMENTS_URL.format(encoded_args)
@@ -312,9 +366,10 @@ def obtain_company_files(producer, ccvm, options, doc_type, from_date=None, to_d
                         "Closing the Selenium Driver for company "
                         "[{ccvm} - {doc_type}]".format(ccvm=ccvm, doc_type=doc_type)
                     )
-                    driver.quit()
+                    crawler.checkin_web_driver(driver, discard=True)
+                    driver = None
 
-                driver = CrawlersRegistry().get_crawler(BOVESPA_CRAWLER).get_web_driver(**options)
+                driver = crawler.checkout_web_driver(**options)
                 driver.get(url)
                 conditions = [EC.presence_of_element_located((By.NAME, "AIR"))]
                 wait_tenaciously(driver, 10, conditions, 10, 5)
@@ -421,9 +476,10 @@ def obtain_company_files(producer, ccvm, options, doc_type, from_date=None, to_d
         )
         if driver:
             _logger.debug(
-                "Closing the Selenium Driver for company " "[{ccvm} - {doc_type}]".format(ccvm=ccvm, doc_type=doc_type)
+                "Giving back the Selenium Driver for company "
+                "[{ccvm} - {doc_type}]".format(ccvm=ccvm, doc_type=doc_type)
             )
-            driver.quit()
+            crawler.checkin_web_driver(driver)
 
 
 def crawl_companies_files(options, producer, workers_num=10, include_companies=None, from_date=None, to_date=None):
@@ -446,8 +502,9 @@ def crawl_companies_files(options, producer, workers_num=10, include_companies=N
 
     try:
         # Obtain the ccvm codes of all the listed companies
+        companies_with_pending_files = get_companies_with_files_to_be_processed()
         ccvm_codes = [
-            r.ccvm for r in BovespaCompany.objects.only(["ccvm"]).all() if not has_files_to_be_processed(r.ccvm)
+            r.ccvm for r in BovespaCompany.objects.only(["ccvm"]).all() if r.ccvm not in companies_with_pending_files
         ]
 
         ccvm_codes = sorted(ccvm_codes)
@@ -43,7 +43,7 @@ def update_listed_companies(letter, options):
 
     driver = None
     try:
-        driver = CrawlersRegistry().get_crawler(BOVESPA_CRAWLER).get_web_driver(**options)
+        driver = CrawlersRegistry().get_crawler(BOVESPA_CRAWLER).checkout_web_driver(**options)
 
         _logger.debug("Crawling companies listing for letter: {}".format(letter))
 
@@ -121,8 +121,8 @@ def update_listed_companies(letter, options):
     finally:
         _logger.debug("Finishing to crawl listed companies for letter {}".format(letter))
         if driver:
-            _logger.debug("Closing the Selenium Driver for letter {}".format(letter))
-            driver.quit()
+            _logger.debug("Giving back the Selenium Driver for letter {}".format(letter))
+            CrawlersRegistry().get_crawler(BOVESPA_CRAWLER).checkin_web_driver(driver)
 
 
 def crawl_listed_companies(options, workers_num=10):
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+"""
+Parser of the pages that list the ENET files of a company.
+
+The page is serialized only once and every table of files only once, all
+the patterns are compiled when the module is loaded.
+"""
+import re
+from collections import namedtuple
+
+from bs4 import BeautifulSoup
+from dateutil.parser import parse as date_parse
+
+try:
+    import lxml  # noqa: F401
+
+    LXML_SUPPORT = True
+except ImportError:
+    LXML_SUPPORT = False
+
+RE_DOWNLOAD_FILE = r"javascript:fVisualizaArquivo_ENET\('([\d]+)','DOWNLOAD'\)"
+RE_FISCAL_DATE = r"Data Encerramento.*[\s].*(\d{2}/\d{2}/\d{4})"
+RE_DELIVERY_DATE = r"Data Entrega.*[\s].*(\d{2}/\d{2}/\d{4}) \d{2}:\d{2}"
+RE_VERSION = r"Versão.*[\s].*(\d+.\d+)"
+RE_DELIVERY_TYPE = r"Tipo Apresentação.*[\s].*<td.*>([\w\s]*)</td>"
+RE_COMPANY_NAME = r"Razão Social.*:(.*)<br/>"
+RE_CNPJ = r"CNPJ.*:(.*)\s"
+RE_TOTAL_FILES = r"(\d*) documento\(s\) encontrado\(s\)"
+RE_LAST_FILE_IN_PAGE = r"Exibindo (\d*) a (\d*)"
+
+_DOWNLOAD_FILE = re.compile(RE_DOWNLOAD_FILE)
+_FISCAL_DATE = re.compile(RE_FISCAL_DATE)
+_DELIVERY_DATE = re.compile(RE_DELIVERY_DATE)
+_VERSION = re.compile(RE_VERSION)
+_DELIVERY_TYPE = re.compile(RE_DELIVERY_TYPE)
+_COMPANY_NAME = re.compile(RE_COMPANY_NAME)
+_CNPJ = re.compile(RE_CNPJ)
+_TOTAL_FILES = re.compile(RE_TOTAL_FILES)
+_LAST_FILE_IN_PAGE = re.compile(RE_LAST_FILE_IN_PAGE)
+
+_ENET_TABLE_TITLES = {}
+
+DOWNLOAD_URL = (
+    "http://www.rad.cvm.gov.br/enetconsulta/"
+    "frmDownloadDocumento.aspx?CodigoInstituicao=1&"
+    "NumeroSequencialDocumento={protocol}"
+)
+
+# A file listed in the page
+EnetFile = namedtuple(
+    "EnetFile", ["fiscal_date", "delivery_date", "version", "delivery_type", "protocol", "source_url"]
+)
+
+
+def _get_enet_table_title(doc_type):
+    title = _ENET_TABLE_TITLES.get(doc_type)
+    if not title:
+        title = _ENET_TABLE_TITLES[doc_type] = re.compile("{} - ENET.*".format(doc_type))
+    return title
+
+
+class EnetListingPage(object):
+    """
+    One page of the listing of the ENET files of a company for a doc type.
+    """
+
+    def __init__(self, bs, doc_type):
+        """
+        Args:
+            bs: a BeautifulSoup object with the content of the listing page.
+            doc_type: the doc type of the files listed.
+        """
+        self.bs = bs
+        self.doc_type = doc_type
+        self.content = str(bs)
+
+    @classmethod
+    def from_page_source(cls, page_source, doc_type, use_lxml=False):
+        """
+        Args:
+            page_source: the html of the listing page.
+            doc_type: the doc type of the files listed.
+            use_lxml: use the lxml parser (faster) instead of the python one,
+            if it's installed.
+        """
+        features = "lxml" if use_lxml and LXML_SUPPORT else "html.parser"
+        return cls(BeautifulSoup(page_source, features), doc_type)
+
+    @property
+    def company_name(self):
+        return _COMPANY_NAME.search(self.content)[1].strip()
+
+    @property
+    def company_cnpj(self):
+        return _CNPJ.search(self.content)[1].strip().lower()
+
+    @property
+    def num_of_docs(self):
+        """
+        The number of files we should expect to find for the company, None
+        if the page has no files information.
+        """
+        match = _TOTAL_FILES.search(self.content)
+        return int(match[1]) if match and match[1] else None
+
+    @property
+    def last_file_in_page(self):
+        return int(_LAST_FILE_IN_PAGE.search(self.content)[2])
+
+    def get_files(self):
+        """
+        Extract all the files listed in the page.
+
+        Returns: a tuple with the list of EnetFile and the quantity of files
+        that are not available in ENET format.
+        """
+        files = []
+        not_available = 0
+
+        title = _get_enet_table_title(self.doc_type)
+        for tag in self.bs.find_all(text=title):
+            table = tag.findParent("table")
+            if not table:
+                continue
+
+            link_tag = table.find("a", href=_DOWNLOAD_FILE)
+            if not link_tag:
+                not_available += 1
+                continue
+
+            table_content = str(table)
+            protocol = _DOWNLOAD_FILE.match(link_tag.attrs["href"])[1]
+            files.append(
+                EnetFile(
+                    fiscal_date=date_parse(_FISCAL_DATE.search(table_content)[1]),
+                    delivery_date=date_parse(_DELIVERY_DATE.search(table_content)[1]),
+                    version=_VERSION.search(table_content)[1],
+                    delivery_type=_DELIVERY_TYPE.search(table_content)[1],
+                    protocol=protocol,
+                    source_url=DOWNLOAD_URL.format(protocol=protocol),
+                )
+            )
+
+        return files, not_available
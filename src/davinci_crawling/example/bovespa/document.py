@@ -3,9 +3,13 @@
 
 import logging
 import json
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 
 import xmljson
-from xml.etree.ElementTree import fromstring
+from xml.etree.ElementTree import fromstring, iterparse
 
 from caravaggio_rest_api.utils import quarter
 
@@ -24,7 +28,14 @@ from davinci_crawling.example.bovespa.models import (
     DFP_BALANCE_DFC_MI,
     DFP_BALANCE_DVA,
     BovespaAccount,
+    BovespaCompanyFile,
 )
+from davinci_crawling.management.commands.utils.execution import run_cpu_bound
+
+try:
+    from dse.cqlengine.query import BatchQuery, BatchType
+except ImportError:
+    from cassandra.cqlengine.query import BatchQuery, BatchType
 
 RE_FILE_BY_ITR = r"^.*\.ITR"
 RE_FILE_BY_XML = r"^.*\.XML"
@@ -42,60 +53,160 @@ SHARES_NUMBER_ACCOUNTS = [
     ("1.89.06", "QuantidadeTotalAcaoTesouraria"),
 ]
 
+# Maximum quantity of accounts written on each batch
+DEFAULT_ACCOUNTS_BATCH_SIZE = 50
+
 _logger = logging.getLogger("davinci_crawler_{}.document".format(BOVESPA_CRAWLER))
 
 
 def convert_xml_into_json(file):
-    with open(file) as f:
-        xml_content = f.read().replace("\n", "")
-        return xmljson.badgerfish.data(fromstring(xml_content))
+    """
+    :param file: the path of the XML file, or its content
+    """
+    if isinstance(file, bytes):
+        xml_content = re.sub(rb"\r\n?|\n", b"", file)
+    else:
+        with open(file) as f:
+            xml_content = f.read().replace("\n", "")
+    return xmljson.badgerfish.data(fromstring(xml_content))
 
 
-def get_scales(available_files, company_file):
+def iter_xml_records(file, tag):
+    """
+    Read the records (children of the root element with the given tag) of a
+    XML file one at a time. Every record is converted with the same format
+    than `convert_xml_into_json` and the elements already read are released,
+    so the memory used does not depend on the size of the file.
+
+    :param file: the path of the XML file, or its content
+    :param tag: the tag of the records
+    :return: a generator of the records as dicts
+    """
+    if isinstance(file, bytes):
+        file = BytesIO(file)
+
+    root = None
+    depth = 0
+    for event, element in iterparse(file, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 1 and element.tag == tag:
+            # the same content that we get removing the new lines of the
+            # whole file before parsing it
+            for child in element.iter():
+                if child.text:
+                    child.text = child.text.replace("\n", "")
+                if child.tail:
+                    child.tail = child.tail.replace("\n", "")
+
+            yield xmljson.badgerfish.data(element)[tag]
+
+            # the root keeps a reference to all its children
+            root.clear()
+
+
+class CompanyFileDocuments(object):
+    """
+    The XML documents of a company file (filing). Every document is read and
+    parsed at most once, no matter how many values we take from it.
     """
-    Obtain the Metric Scale and Quantity of Shares from the Document.xml file
-
-    Where to find the values:
-        xmldoc.child("Documento").child_value("CodigoEscalaMoeda")
-        xmldoc.child("Documento").child_value("CodigoEscalaQuantidade")
 
-    :param available_files: list of available files per name
+    def __init__(self, available_files, company_file):
+        """
+        :param available_files: the available files (paths or contents) per
+            name
+        :param company_file: the BovespaCompanyFile the documents belong to
+        """
+        self.available_files = available_files
+        self.company_file = company_file
+        self._documents = {}
+        self._scales = None
+
+    def _get_document(self, file_pattern):
+        file_name = file_pattern.format(doc_type=self.company_file.doc_type.lower())
+        document = self._documents.get(file_name)
+        if document is None:
+            document = self._documents[file_name] = convert_xml_into_json(self.available_files[file_name])
+        return document
+
+    @property
+    def document(self):
+        return self._get_document(FILE_DOCUMENT)
+
+    @property
+    def capital_composition(self):
+        return self._get_document(FILE_CAPITAL_COMPOSITION)
+
+    def iter_financial_info(self):
+        """
+        The financial info records, read one at a time from the file.
+        """
+        file_name = FILE_FINANCIAL_INFO.format(doc_type=self.company_file.doc_type.lower())
+        return iter_xml_records(self.available_files[file_name], "InfoFinaDFin")
+
+    @property
+    def scales(self):
+        """
+        Obtain the Metric Scale and Quantity of Shares from the Document.xml file
+
+        Where to find the values:
+            xmldoc.child("Documento").child_value("CodigoEscalaMoeda")
+            xmldoc.child("Documento").child_value("CodigoEscalaQuantidade")
+
+        :return: the money scale and quantity of shares
+        """
+        if not self._scales:
+            data = self.document
+
+            money_scale = int(data["Documento"]["CodigoEscalaMoeda"]["$"])
+            quant_scale = int(data["Documento"]["CodigoEscalaQuantidade"]["$"])
+            money_scale = 1999 - money_scale * 999
+            quant_scale = 1999 - quant_scale * 999
+
+            self._scales = (money_scale, quant_scale)
+
+        return self._scales
+
+    @property
+    def sector(self):
+        """
+        Obtain the Sector Code from the Document.xml file
+
+        Where to find the values:
+            xmldoc.child("Documento").child_value(
+                "CompanhiaAberta/CodigoSetorAtividadeEmpresa")
+
+        :return: the code of the sector of the company
+        """
+        return int(self.document["Documento"]["CompanhiaAberta"]["CodigoSetorAtividadeEmpresa"]["$"])
+
+
+def get_scales(documents):
+    """
+    :param documents: the CompanyFileDocuments of the company file
     :return: the money scale and quantity of shares
     """
-    data = convert_xml_into_json(available_files[FILE_DOCUMENT.format(doc_type=company_file.doc_type.lower())])
-
-    money_scale = int(data["Documento"]["CodigoEscalaMoeda"]["$"])
-    quant_scale = int(data["Documento"]["CodigoEscalaQuantidade"]["$"])
-    money_scale = 1999 - money_scale * 999
-    quant_scale = 1999 - quant_scale * 999
-
-    return money_scale, quant_scale
+    return documents.scales
 
 
-def get_sector(available_files, company_file):
+def get_sector(documents):
     """
-    Obtain the Sector Code from the Document.xml file
-
-    Where to find the values:
-        xmldoc.child("Documento").child_value(
-            "CompanhiaAberta/CodigoSetorAtividadeEmpresa")
-
-    :param available_files: list of available files per name
+    :param documents: the CompanyFileDocuments of the company file
     :return: the code of the sector of the company
     """
-    data = convert_xml_into_json(available_files[FILE_DOCUMENT.format(doc_type=company_file.doc_type.lower())])
-
-    sector = int(data["Documento"]["CompanhiaAberta"]["CodigoSetorAtividadeEmpresa"]["$"])
+    return documents.sector
 
-    return sector
 
+def get_cap_composition_accounts(sector, documents):
+    company_file = documents.company_file
+    money_scale, quant_scale = get_scales(documents)
 
-def get_cap_composition_accounts(sector, available_files, company_file):
-    money_scale, quant_scale = get_scales(available_files, company_file)
-
-    data = convert_xml_into_json(
-        available_files[FILE_CAPITAL_COMPOSITION.format(doc_type=company_file.doc_type.lower())]
-    )
+    data = documents.capital_composition
 
     accounts = []
     for acc_number, acc_name in SHARES_NUMBER_ACCOUNTS:
@@ -120,20 +231,21 @@ def get_cap_composition_accounts(sector, available_files, company_file):
             value = int(equity[acc_name]["$"])
 
         account["amount"] = int(value / quant_scale)
-        account = BovespaAccount.create(**account)
+        account = BovespaAccount(**account)
         accounts.append(account)
 
     return accounts
 
 
-def get_financial_info_accounts(sector, available_files, company_file):
-    accounts = []
-
-    money_scale, quant_scale = get_scales(available_files, company_file)
-
-    data = convert_xml_into_json(available_files[FILE_FINANCIAL_INFO.format(doc_type=company_file.doc_type.lower())])
+def iter_financial_info_accounts(sector, documents):
+    """
+    The accounts of the financial info, built as the records are read from
+    the file.
+    """
+    company_file = documents.company_file
+    money_scale, quant_scale = get_scales(documents)
 
-    for account_info in data["ArrayOfInfoFinaDFin"]["InfoFinaDFin"]:
+    for account_info in documents.iter_financial_info():
         acc_version = account_info["PlanoConta"]["VersaoPlanoConta"]
         try:
             account = {
@@ -165,43 +277,43 @@ def get_financial_info_accounts(sector, available_files, company_file):
             dmpl_account = dict(account)
             dmpl_account["comments"] = "Capital social integralizado"
             dmpl_account["amount"] = float(account_info["ValorConta1"]["$"])
-            dmpl_account = BovespaAccount.create(**dmpl_account)
-            accounts.append(dmpl_account)
+            dmpl_account = BovespaAccount(**dmpl_account)
+            yield dmpl_account
 
             # Reserves
             dmpl_account = dict(account)
             dmpl_account["comments"] = "Reservas de capital"
             dmpl_account["amount"] = float(account_info["ValorConta2"]["$"] / money_scale)
-            dmpl_account = BovespaAccount.create(**dmpl_account)
-            accounts.append(dmpl_account)
+            dmpl_account = BovespaAccount(**dmpl_account)
+            yield dmpl_account
 
             # Revenue reserves
             dmpl_account = dict(account)
             dmpl_account["comments"] = "Reservas de lucro"
             dmpl_account["amount"] = float(account_info["ValorConta3"]["$"] / money_scale)
-            dmpl_account = BovespaAccount.create(**dmpl_account)
-            accounts.append(dmpl_account)
+            dmpl_account = BovespaAccount(**dmpl_account)
+            yield dmpl_account
 
             # Accrued Profit/Loss
             dmpl_account = dict(account)
             dmpl_account["comments"] = "Lucros/Prejuízos acumulados"
             dmpl_account["amount"] = float(account_info["ValorConta4"]["$"] / money_scale)
-            dmpl_account = BovespaAccount.create(**dmpl_account)
-            accounts.append(dmpl_account)
+            dmpl_account = BovespaAccount(**dmpl_account)
+            yield dmpl_account
 
             # Accumulated other comprehensive income
             dmpl_account = dict(account)
             dmpl_account["comments"] = "Outros resultados abrangentes"
             dmpl_account["amount"] = float(account_info["ValorConta5"]["$"] / money_scale)
-            dmpl_account = BovespaAccount.create(**dmpl_account)
-            accounts.append(dmpl_account)
+            dmpl_account = BovespaAccount(**dmpl_account)
+            yield dmpl_account
 
             # Stockholder's equity
             dmpl_account = dict(account)
             dmpl_account["comments"] = "Patrimônio Líquido"
             dmpl_account["amount"] = float(account_info["ValorConta6"]["$"] / money_scale)
-            dmpl_account = BovespaAccount.create(**dmpl_account)
-            accounts.append(dmpl_account)
+            dmpl_account = BovespaAccount(**dmpl_account)
+            yield dmpl_account
         else:
             if company_file.doc_type == DOC_TYPE_DFP:
                 account["amount"] = float(account_info["ValorConta1"]["$"]) / money_scale
@@ -219,16 +331,103 @@ def get_financial_info_accounts(sector, available_files, company_file):
                         account["amount"] = float(account_info["ValorConta4"]["$"]) / money_scale
                     else:
                         account["amount"] = float(account_info["ValorConta2"]["$"]) / money_scale
-            account = BovespaAccount.create(**account)
-            accounts.append(account)
+            account = BovespaAccount(**account)
+            yield account
 
-    return accounts
 
+def save_accounts(accounts, batch_size=DEFAULT_ACCOUNTS_BATCH_SIZE):
+    """
+    Write the accounts of a company file. All of them belong to the same
+    company partition and are sent in unlogged batches.
 
-def load_account_details(options, available_files, company_file):
+    :param accounts: the BovespaAccount objects to write
+    :param batch_size: the maximum quantity of accounts per batch
+    """
+    # All the statements of a batch have the same timestamp, if two accounts
+    # have the same primary key the last one would not always win. We keep
+    # only the last one, as the sequential inserts did.
+    unique_accounts = OrderedDict()
+    for account in accounts:
+        key = tuple(getattr(account, name) for name in BovespaAccount._primary_keys)
+        unique_accounts.pop(key, None)
+        unique_accounts[key] = account
+
+    unique_accounts = list(unique_accounts.values())
+    for start in range(0, len(unique_accounts), batch_size):
+        batch = BatchQuery(batch_type=BatchType.Unlogged)
+        for account in unique_accounts[start : start + batch_size]:
+            account.batch(batch).save()
+        batch.execute()
+
+    _logger.debug("Written {} accounts".format(len(unique_accounts)))
+
+
+def save_accounts_in_chunks(accounts, batch_size=DEFAULT_ACCOUNTS_BATCH_SIZE):
+    """
+    Write the accounts as they are built, in chunks of `batch_size`. A chunk
+    is written in background while the next one is built, so at most two
+    chunks are in memory.
 
-    sector = get_sector(available_files, company_file)
-    accounts = get_cap_composition_accounts(sector, available_files, company_file)
-    accounts.extend(get_financial_info_accounts(sector, available_files, company_file))
+    :param accounts: an iterable of BovespaAccount objects
+    :param batch_size: the quantity of accounts per chunk (and batch)
+    :return: the quantity of accounts built
+    """
+    count = 0
+    chunk = []
+    pending = None
+    with ThreadPoolExecutor(1) as writer:
+        for account in accounts:
+            chunk.append(account)
+            count += 1
+            if len(chunk) >= batch_size:
+                if pending:
+                    pending.result()
+                pending = writer.submit(save_accounts, chunk, batch_size)
+                chunk = []
+
+        if pending:
+            pending.result()
+        if chunk:
+            save_accounts(chunk, batch_size)
+
+    return count
+
+
+def iter_account_details(available_files, company_file):
+    """
+    The accounts of a company file, built from its documents as they are
+    read.
+    """
+    documents = CompanyFileDocuments(available_files, company_file)
 
-    return accounts
+    sector = get_sector(documents)
+    yield from get_cap_composition_accounts(sector, documents)
+    yield from iter_financial_info_accounts(sector, documents)
+
+
+def parse_account_details(
+    available_files, ccvm, doc_type, fiscal_date, version, batch_size=DEFAULT_ACCOUNTS_BATCH_SIZE
+):
+    """
+    Build the accounts of a company file from its documents and write them in
+    chunks while they are built. It's the CPU bound stage of the processing,
+    it can run in another process (that opens its own database session).
+
+    :return: the quantity of accounts written
+    """
+    company_file = BovespaCompanyFile(ccvm=ccvm, doc_type=doc_type, fiscal_date=fiscal_date, version=version)
+    return save_accounts_in_chunks(iter_account_details(available_files, company_file), batch_size)
+
+
+def load_account_details(options, available_files, company_file):
+    """
+    :return: the quantity of accounts written
+    """
+    return run_cpu_bound(
+        parse_account_details,
+        available_files,
+        company_file.ccvm,
+        company_file.doc_type,
+        company_file.fiscal_date,
+        company_file.version,
+    )
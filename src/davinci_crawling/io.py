@@ -7,29 +7,28 @@ import datetime
 import os
 import re
 import shutil
-import tempfile
 import zipfile
-from time import sleep
-
-from spitslurp import spit, slurp
+from contextlib import contextmanager
+from io import BytesIO
 
 try:
     from dse.cqlengine.query import DoesNotExist
 except ImportError:
     from cassandra.cqlengine.query import DoesNotExist
 
-from requests.exceptions import ReadTimeout, Timeout
-
-from google.cloud import storage
-
-# Imports the Google Cloud client libraries
-from google.api_core.exceptions import GoogleAPIError
-
 from davinci_crawling.models import Checkpoint
+from davinci_crawling.storage.gs_storage import (  # noqa: F401
+    BUCKET_NAME_RE,
+    BUCKET_PATH_RE,
+    GSStorage,
+    get_gs_bucket,
+    get_gs_bucket_name,
+    get_gs_client,
+    get_gs_path,
+)
+from davinci_crawling.storage.storage import COPY_CHUNK_SIZE, get_storage, split_uri
 
 BACKEND_RE = r"(.*)://.*"
-BUCKET_NAME_RE = r"gs:\/\/(\w+)\/?.*$"
-BUCKET_PATH_RE = r"gs:\/\/\w+\/?(.*)$"
 FILE_EXTENSION_RE = r"^.*\.(.*)$"
 FILE_PATH_RE = r"fs://(.*)"
 
@@ -45,69 +44,15 @@ def get_backend(path):
         raise Exception(msg)
 
 
-def get_gs_bucket_name(options):
-    cache_dir = options.get("cache_dir", None)
-    try:
-        return re.match(BUCKET_NAME_RE, cache_dir)[1]
-    except TypeError as ex:
-        msg = "Unable to get the bucket name " "from the cache_dir OPTION: {}".format(cache_dir)
-        _logger.exception(msg)
-        raise Exception(msg)
-
-
-def get_gs_path(path):
-    try:
-        return re.match(BUCKET_PATH_RE, path)[1]
-    except TypeError as ex:
-        msg = "Unable to get the path from the GSPath: {}".format(path)
-        _logger.exception(msg)
-        raise Exception(msg)
-
-
-def get_gs_client(options):
-    io_gs_project = options.get("io_gs_project", None)
-    if io_gs_project:
-        storage_client = storage.Client(project=io_gs_project)
-    else:
-        storage_client = storage.Client()
-
-    return storage_client
-
-
 def create_gs_folder(options, path):
-    storage_client = get_gs_client(options)
-
-    bucket_name = get_gs_bucket_name(options)
-    bucket = storage_client.get_bucket(bucket_name)
+    bucket = get_gs_bucket(options)
 
     blob = bucket.blob("%s_$folder$" % path)
     return blob.path
 
 
 def upload_gs_file(options, source_file, dest_file, chunk_size=None, n=3, s=5):
-    storage_client = get_gs_client(options)
-
-    bucket_name = get_gs_bucket_name(options)
-    bucket = storage_client.get_bucket(bucket_name)
-
-    dest_file = get_gs_path(dest_file)
-
-    _logger.debug(("Upload file [%s] into [gs://%s/%s]" % (source_file, bucket.name, dest_file)))
-
-    blob = bucket.blob(dest_file, chunk_size=chunk_size)
-
-    while n > 0:
-        try:
-            blob.upload_from_filename(source_file)
-            return blob.path
-        except (Timeout, ReadTimeout) as ex:
-            _logger.exception("Error uploading file to GS.")
-            _logger.warning(f"Trying {n} times more in {s} seconds.")
-            n -= 1
-            sleep(s)
-            pass
-
-    return None
+    return GSStorage(options).put_file(source_file, dest_file, chunk_size=chunk_size, retries=n, retry_wait=s)
 
 
 def download_gs_file(options, source_file, dest_file):
@@ -125,26 +70,7 @@ def download_gs_file(options, source_file, dest_file):
         "gs://vanggogh2_harvest/bovespa/ccvm_9512/ITR/00951220110331301.zip",
         "/data/00951220110331301.zip")
     """
-    storage_client = get_gs_client(options)
-
-    bucket_name = get_gs_bucket_name(options)
-    bucket = storage_client.get_bucket(bucket_name)
-
-    source_file_path = get_gs_path(source_file)
-
-    blob = bucket.blob(source_file_path)
-
-    os.makedirs(os.path.dirname(dest_file), exist_ok=True)
-
-    try:
-        file_path = re.match(FILE_PATH_RE, dest_file)[1]
-    except Exception as ex:
-        file_path = dest_file
-
-    blob.download_to_filename(file_path)
-
-    _logger.debug("Blob {} downloaded to {}.".format(source_file, dest_file))
-
+    GSStorage(options).get_file(source_file, split_uri(dest_file)[1])
     return dest_file
 
 
@@ -172,22 +98,12 @@ def get_base_dir(options):
         output_dir = str(local_path.absolute())
         _logger.debug("Output dir: {}".format(output_dir))
         return "fs://%s" % output_dir
-    elif backend == "gs":
-        storage_client = get_gs_client(options)
-        bucket_name = re.match(BUCKET_NAME_RE, cache_dir)[1]
-        _logger.debug("Bucket name: {}".format(bucket_name))
-        try:
-            bucket = storage_client.get_bucket(bucket_name)
-        except GoogleAPIError:
-            _logger.info("Bucket {} not found. Creating it...".format(bucket_name))
-            bucket = storage_client.create_bucket(bucket_name)
-            _logger.info("Bucket {} successfully created.".format(bucket_name))
 
-        output_dir = "{0}/{1}".format(cache_dir, crawler_name)
-        _logger.debug("Output dir: {}".format(output_dir))
-        return output_dir
-    else:
-        raise NotImplemented("Unsupported backend")
+    output_dir = "{0}/{1}".format(cache_dir, crawler_name)
+    # in GS it makes sure that the bucket exists
+    get_storage(output_dir, options).makedirs(output_dir)
+    _logger.debug("Output dir: {}".format(output_dir))
+    return output_dir
 
 
 def get_local_base_dir(options):
@@ -199,15 +115,7 @@ def get_extension(file):
 
 
 def mkdirs(options, dest_file):
-    backend = get_backend(dest_file)
-
-    if backend == "fs":
-        file_path = re.match(FILE_PATH_RE, dest_file)[1]
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    elif backend == "gs":
-        # In GS the paths are created automatically when we
-        # copy/upload the file
-        create_gs_folder(options, dest_file)
+    get_storage(dest_file, options).makedirs(os.path.dirname(dest_file))
 
 
 def get_backend_and_path(options, file, raise_exceptions=False):
@@ -237,136 +145,146 @@ def get_backend_and_path(options, file, raise_exceptions=False):
         return backend, "{0}/{1}".format(bucket_name, get_gs_path(file))
 
 
-def extract_zip(options, source_file, dest_folder, force=False):
-    _logger.debug("EXTRACT ZIP: Source file: {}".format(source_file))
-    _logger.debug("EXTRACT ZIP: Dest folder: {}".format(dest_folder))
+@contextmanager
+def _open_zip(storage, source_file):
+    local_path = storage.local_path(source_file)
+    if local_path:
+        with zipfile.ZipFile(local_path, "r") as zip_ref:
+            yield zip_ref
+        return
 
-    # Extract the content of the file in the cache into the working folder
-    src_backend, file_to_export = get_backend_and_path(options, source_file)
-    backend, clean_dest_folder = get_backend_and_path(options, dest_folder)
+    with storage.open(source_file, "rb") as f, zipfile.ZipFile(f, "r") as zip_ref:
+        yield zip_ref
 
-    _logger.debug("EXTRACT ZIP: Source backend: {}".format(src_backend))
-    _logger.debug("EXTRACT ZIP: Source file to export: {}".format(file_to_export))
-    _logger.debug("EXTRACT ZIP: Destination backend: {}".format(backend))
-    _logger.debug("EXTRACT ZIP: Destination folder: {}".format(clean_dest_folder))
 
-    files_ref = []
+def _has_files(storage, folder):
+    try:
+        return bool(storage.list(folder))
+    except FileNotFoundError:
+        return False
 
-    if backend == "fs":
-        # Only extract if we are force to do it or if there is not files
-        # already exported before
-        if force or not pathlib.Path(clean_dest_folder).exists() or not os.listdir(clean_dest_folder):
-            with zipfile.ZipFile(file_to_export, "r") as zip_ref:
-                zip_ref.extractall(clean_dest_folder)
 
-        for the_file in os.listdir(clean_dest_folder):
-            files_ref.append(os.path.join(clean_dest_folder, the_file))
+def extract_zip(options, source_file, dest_folder, force=False, select=None):
+    """
+    Extract the files of a zip into a folder.
+    Args:
+        options: the options of the crawler.
+        source_file: the URI of the zip.
+        dest_folder: the URI of the folder.
+        force: extract the files even if the folder already has files.
+        select: a function that receives the path of a member and returns
+        if it should be extracted, by default all the files are extracted.
+
+    Returns: the URIs of the content of the folder.
+    """
+    _logger.debug("EXTRACT ZIP: Source file: {}".format(source_file))
+    _logger.debug("EXTRACT ZIP: Dest folder: {}".format(dest_folder))
 
-    return files_ref
+    source_storage = get_storage(source_file, options)
+    dest_storage = get_storage(dest_folder, options)
+
+    # Only extract if we are force to do it or if there is not files
+    # already exported before
+    if force or not _has_files(dest_storage, dest_folder):
+        with _open_zip(source_storage, source_file) as zip_ref:
+            members = [
+                member
+                for member in zip_ref.infolist()
+                if not member.filename.endswith("/") and (select is None or select(member.filename))
+            ]
+            local_dest_folder = dest_storage.local_path(dest_folder)
+            if local_dest_folder:
+                zip_ref.extractall(local_dest_folder, members)
+            else:
+                for member in members:
+                    dest_file = "{0}/{1}".format(dest_folder.rstrip("/"), member.filename)
+                    with zip_ref.open(member) as source, dest_storage.open(dest_file, "wb") as dest:
+                        shutil.copyfileobj(source, dest, COPY_CHUNK_SIZE)
+
+    return dest_storage.list(dest_folder)
+
+
+def _iter_zip_members(zip_ref, prefix, select, nested):
+    for member in zip_ref.infolist():
+        if member.filename.endswith("/"):
+            continue
+        path = prefix + member.filename
+        if nested and nested(path):
+            # the nested zips are read into memory, a zip can only be opened
+            # from a stream that allows random access
+            with zipfile.ZipFile(BytesIO(zip_ref.read(member)), "r") as nested_ref:
+                yield from _iter_zip_members(nested_ref, path + "/", select, nested)
+        elif select is None or select(path):
+            with zip_ref.open(member) as f:
+                yield path, f
+
+
+def iter_zip(options, source_file, select=None, nested=None):
+    """
+    Read the files of a zip, and of the zips inside of it, without extracting
+    them to disk.
+
+    Example, the XML files of the zip and of the .ITR zips inside of it:
+
+    for path, f in iter_zip(options, "fs:///data/file.zip",
+                            select=lambda path: path.endswith(".xml"),
+                            nested=lambda path: path.endswith(".ITR")):
+        content = f.read()
+
+    Args:
+        options: the options of the crawler.
+        source_file: the URI of the zip.
+        select: a function that receives the path of a member and returns
+        if it should be read, by default all the files are read. Only the
+        members selected are decompressed.
+        nested: a function that receives the path of a member and returns
+        if it is a zip to open, the paths of its members are
+        "<path of the nested zip>/<path of the member>".
+
+    Returns: a generator of tuples with the path of the member and a file
+    object that decompresses its content as it's read, the file is closed
+    when the next member is requested.
+    """
+    with _open_zip(get_storage(source_file, options), source_file) as zip_ref:
+        yield from _iter_zip_members(zip_ref, "", select, nested)
 
 
 def listdir(options, source_folder):
-    # Extract the content of the file in the cache into the working folder
     _logger.debug("Source Folder: {}".format(source_folder))
-    backend, clean_source_folder = get_backend_and_path(options, source_folder)
-
-    _logger.debug("Backend: {}".format(backend))
-
-    files_ref = []
-
-    if backend == "fs":
-        for the_file in os.listdir(clean_source_folder):
-            files_ref.append(os.path.join(clean_source_folder, the_file))
-    elif backend == "gs":
-        storage_client = get_gs_client(options)
-        bucket_name = get_gs_bucket_name(options)
-        dest_file = get_gs_path(source_folder)
-        for blob in storage_client.list_blobs(bucket_name, prefix=dest_file):
-            files_ref.append(f"gs://{bucket_name}/{blob.name}")
-
-    return files_ref
+    return get_storage(source_folder, options).list(source_folder)
 
 
 def exists(options, dest_file):
-    backend = get_backend(dest_file)
-
-    if backend == "fs":
-        file_path = re.match(FILE_PATH_RE, dest_file)[1]
-        return pathlib.Path(file_path).exists()
-    elif backend == "gs":
-        # In GS the paths are created automatically when we
-        # copy/upload the file
-        storage_client = get_gs_client(options)
-
-        bucket_name = get_gs_bucket_name(options)
-        bucket = storage_client.get_bucket(bucket_name)
-
-        dest_file = get_gs_path(dest_file)
-        _logger.debug(("Checking existence of file [%s] into [gs://%s]" % (dest_file, bucket.name)))
-
-        blob = bucket.blob(dest_file)
-        return blob.exists()
+    return get_storage(dest_file, options).exists(dest_file)
 
 
 def delete_all(options, path):
-    try:
-        backend = get_backend(path)
-    except Exception as ex:
-        _logger.exception("Unable to determine the backend" " of the folder. Using FS by default.")
-        backend = "fs"
+    get_storage(path, options).delete(path)
 
-    if backend == "fs":
-        try:
-            clean_path = re.match(FILE_PATH_RE, path)[1]
-        except TypeError:
-            clean_path = path
 
-        if os.path.isfile(clean_path):
-            try:
-                os.unlink(clean_path)
-            except Exception as e:
-                raise Exception("Unable to delete the file [{0}]. " "Clean version: [{1}]".format(path, clean_path))
-        else:
-            for the_file in os.listdir(clean_path):
-                file_path = os.path.join(clean_path, the_file)
-                try:
-                    if os.path.isfile(file_path):
-                        os.unlink(file_path)
-                    else:
-                        shutil.rmtree(file_path)
-                except Exception as e:
-                    raise Exception(
-                        "Unable to delete the files in folder [{0}]. " "Clean version: [{1}]".format(path, clean_path)
-                    )
+def copy_file(options, source_file, dest_file, chunk_size=None):
+    """
+    Copy a file between any two backends.
 
+    Returns: the path of the copy if it's a local file, its URI otherwise.
+    """
+    source_storage = get_storage(source_file, options)
+    dest_storage = get_storage(dest_file, options)
+
+    local_source = source_storage.local_path(source_file)
+    local_dest = dest_storage.local_path(dest_file)
+
+    if source_storage.scheme == dest_storage.scheme:
+        dest_storage.copy(source_file, dest_file)
+    elif local_source:
+        dest_storage.put_file(local_source, dest_file, chunk_size=chunk_size)
+    elif local_dest:
+        source_storage.get_file(source_file, local_dest)
+    else:
+        with source_storage.open(source_file, "rb") as source, dest_storage.open(dest_file, "wb") as dest:
+            shutil.copyfileobj(source, dest, COPY_CHUNK_SIZE)
 
-def copy_file(options, source_file, dest_file, chunk_size=None):
-    with tempfile.TemporaryDirectory() as temp_path:
-        # If the backend if FS in source_file we have the reference to the
-        # local FS file
-        source_backend, source_file = get_backend_and_path(options, source_file)
-        if source_backend == "gs":
-            source_file = download_gs_file(
-                options, "gs://{}".format(source_file), "fs://{0}/{1}".format(temp_path, "test.zip")
-            )
-            try:
-                source_file = re.match(FILE_PATH_RE, source_file)[1]
-            except TypeError:
-                raise Exception("Invalid file path: {}".format(source_file))
-
-        # If the backend if FS in file_path we have the reference to the
-        # local FS file
-        dest_backend, file_path = get_backend_and_path(options, dest_file)
-        if dest_backend == "fs":
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            shutil.copyfile(source_file, file_path)
-            return file_path
-        elif dest_backend == "gs":
-            # In GS the paths are created automatically when we
-            # copy/upload the file
-            upload_gs_file(options, source_file, dest_file, chunk_size=chunk_size)
-
-            return dest_file
+    return local_dest or dest_file
 
 
 def get_control_dir(options):
@@ -378,25 +296,18 @@ def put_control_timestamp(
 ):
     control_dir = get_control_dir(config)
 
-    backend = get_backend(control_dir)
-
-    if backend == "fs":
-        filename = "{}/{}".format(control_dir, control_file_name)
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        spit(filename, custom_timestamp)
+    filename = "{}/{}".format(control_dir, control_file_name)
+    get_storage(filename, config).write(filename, custom_timestamp)
 
 
 def get_control_timestamp(options, control_file_name="crawl-timestamp.txt"):
     control_dir = get_control_dir(options)
 
-    backend = get_backend(control_dir)
-
-    if backend == "fs":
-        try:
-            filename = "{}/{}".format(control_dir, control_file_name)
-            return slurp(filename)
-        except FileNotFoundError as ex:
-            return None
+    filename = "{}/{}".format(control_dir, control_file_name)
+    try:
+        return get_storage(filename, options).read(filename).decode("utf-8")
+    except FileNotFoundError:
+        return None
 
 
 def get_checkpoint_data(source, key, default=None):
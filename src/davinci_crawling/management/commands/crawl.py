@@ -11,12 +11,25 @@ import time
 import traceback
 from datetime import datetime
 from threading import Thread
-from persistqueue import SQLiteAckQueue
 
-from davinci_crawling.management.commands.utils.utils import update_task_status
+from davinci_crawling.management.commands.utils.status_buffer import TaskStatusBuffer
+from davinci_crawling.management.commands.utils.task_feed import TaskFeed
 from django.conf import settings
-from davinci_crawling.task.models import Task, STATUS_CREATED, STATUS_FAULTY, STATUS_QUEUED
-from davinci_crawling.management.commands.utils.consumer import CrawlConsumer, QUEUE_LOCATION
+from davinci_crawling.task.models import STATUS_FAULTY, STATUS_QUEUED
+from davinci_crawling.management.commands.utils.consumer import CrawlConsumer
+from davinci_crawling.management.commands.utils.lanes import (
+    LANE_OPTION,
+    get_lane,
+    get_lane_name,
+    get_lanes,
+    migrate_legacy_queue,
+)
+from davinci_crawling.management.commands.utils.tasks_queue import get_queue_clazz
+from davinci_crawling.management.commands.utils.execution import (
+    EXECUTION_MODES,
+    EXECUTION_MODE_PROCESSES,
+    EXECUTION_MODE_THREADS,
+)
 from django.core.exceptions import ImproperlyConfigured
 from django.core.management import BaseCommand, CommandError, handle_default_options
 from django.core.management.base import SystemCheckError, CommandParser, DjangoHelpFormatter
@@ -31,24 +44,32 @@ def _add_default_options(options_obj, default_values):
             options_obj[key] = value
 
 
-def _pool_tasks(interval, times_to_run):
+def _pool_tasks(interval, times_to_run, status_buffer):
     """
     A while that runs forever and check for new tasks on the cassandra DB,
-    every new Task on DB has a 'created' state, so this method looks for all
-    the tasks that have this status.
+    every new Task on DB has a 'created' state, so this method looks for the
+    tasks that have this status. The tasks are read incrementally from the
+    TaskTimeSeries buckets (see `TaskFeed`), so every pool only touches the
+    tasks written since the previous one. Every task is put in the lane of
+    its crawler (see `lanes`).
     Args:
         interval: the interval that we should pool cassandra, on every pool;
         times_to_run: used on tests to determine that the threads will not run
         forever. [ONLY FOR TESTING]
+        status_buffer: the TaskStatusBuffer used to write the status of the
+        tasks, it's flushed before putting the tasks in the lanes and at the
+        end of every pool.
     """
     times_run = 0
-    tasks_queue = SQLiteAckQueue(QUEUE_LOCATION)
+    task_feed = TaskFeed()
     # this while condition will only be checked on testing, otherwise this loop
     # should run forever.
     while not times_to_run or times_run < times_to_run:
         _logger.debug("Calling pool tasks")
-        all_tasks = Task.objects.filter(status=STATUS_CREATED).all()
+        all_tasks = task_feed.poll()
         _logger.debug("Found %d tasks to process", len(all_tasks))
+        # (task, queue item) of the tasks to put in their lanes
+        to_queue = []
         for task in all_tasks:
             try:
                 crawler_name = task.kind
@@ -65,6 +86,9 @@ def _pool_tasks(interval, times_to_run):
                 default_settings = settings.DAVINCI_CONF["crawler-params"].get("default", {})
                 crawler_settings = settings.DAVINCI_CONF["crawler-params"].get(crawler_name, {})
 
+                # the lane settings are not options of the crawler
+                crawler_settings = {key: value for key, value in crawler_settings.items() if key != LANE_OPTION}
+
                 _add_default_options(options, crawler_settings)
                 _add_default_options(options, default_settings)
 
@@ -73,17 +97,43 @@ def _pool_tasks(interval, times_to_run):
 
                 params = json.loads(task.params)
 
-                tasks_queue.put([params, options])
-                update_task_status(task, STATUS_QUEUED)
+                # a task created again (re-run or reset) starts its attempts
+                # from the start
+                status_buffer.reset_attempts(task)
+                status_buffer.add(task, STATUS_QUEUED)
+                to_queue.append((task, [params, options]))
+            except Exception as e:
+                status_buffer.add(task, STATUS_FAULTY, source="crawl command", more_info=traceback.format_exc())
+                _logger.error("Error while adding params to queue", e)
+
+        # the QUEUED status is written before the consumers can take the
+        # tasks, they could be in other processes or hosts and a later write
+        # would overwrite their IN_PROGRESS or FINISHED
+        status_buffer.flush()
+        for task, object_queue in to_queue:
+            try:
+                get_lane(get_lane_name(task.kind)).put(object_queue, task.type)
             except Exception as e:
-                update_task_status(task, STATUS_FAULTY, source="crawl command", more_info=traceback.format_exc())
+                status_buffer.add(task, STATUS_FAULTY, source="crawl command", more_info=traceback.format_exc())
                 _logger.error("Error while adding params to queue", e)
+
+        # the faulty tasks should be written before moving the feed,
+        # otherwise the next pool could find them still CREATED.
+        status_buffer.flush()
+        task_feed.commit()
         time.sleep(interval)
         if times_to_run:
             times_run += 1
 
 
-def start_crawl(workers_num, interval, times_to_run=None, initialize_consumer=True):
+def start_crawl(
+    workers_num,
+    interval,
+    times_to_run=None,
+    initialize_consumer=True,
+    execution_mode=EXECUTION_MODE_THREADS,
+    processes_num=None,
+):
     """
     Run the necessary methods to start crawling data. This method will start a
     tasks pool that will constantly get lines from DB and if anything is new
@@ -95,13 +145,37 @@ def start_crawl(workers_num, interval, times_to_run=None, initialize_consumer=Tr
         forever.
         initialize_consumer: if true the consumer will be initialized, if not
         the consumer will not start and only the tasks will be queued
+        execution_mode: how the consumers run: threads, processes or hybrid.
+        processes_num: the quantity of processes of the processes and hybrid
+        execution modes.
     """
+    if execution_mode == EXECUTION_MODE_PROCESSES and not get_queue_clazz().multiprocess:
+        raise ImproperlyConfigured(
+            "The queue {} cannot be shared by the consumer processes".format(get_queue_clazz().__name__)
+        )
+
+    # the tasks taken by the consumers of the previous run, and the ones
+    # queued before the lanes
+    for lane in get_lanes():
+        lane.resume_abandoned()
+    migrate_legacy_queue()
+
     crawl_consumer = None
+    # the poller and the consumers share the buffer, this way the consumers
+    # already know the keys of the tasks queued by the poller.
+    status_buffer = TaskStatusBuffer()
+    status_buffer.start()
     if initialize_consumer:
-        crawl_consumer = CrawlConsumer(workers_num, times_to_run)
-        _logger.info("Starting a consumer of %d processes" % workers_num)
+        crawl_consumer = CrawlConsumer(
+            workers_num,
+            times_to_run,
+            status_buffer=status_buffer,
+            execution_mode=execution_mode,
+            processes_num=processes_num,
+        )
+        _logger.info("Starting a consumer of %d workers in %s mode" % (workers_num, execution_mode))
         crawl_consumer.start()
-    task_thread = Thread(target=_pool_tasks, args=(interval, times_to_run))
+    task_thread = Thread(target=_pool_tasks, args=(interval, times_to_run, status_buffer))
 
     try:
         task_thread.start()
@@ -111,6 +185,7 @@ def start_crawl(workers_num, interval, times_to_run=None, initialize_consumer=Tr
         task_thread.join()
         if crawl_consumer:
             crawl_consumer.join()
+        status_buffer.stop()
 
 
 class Command(BaseCommand):
@@ -132,7 +207,8 @@ class Command(BaseCommand):
             dest="workers_num",
             default=10,
             type=int,
-            help="The number of workers (threads) to launch in parallel",
+            help="The number of workers (threads) to launch in parallel, the crawlers with a lane use the workers_num"
+            " of their lane",
         )
         self._parser.add_argument(
             "--interval",
@@ -143,6 +219,26 @@ class Command(BaseCommand):
             type=int,
             help="Interval to wait between pool the tasks",
         )
+        self._parser.add_argument(
+            "--execution-mode",
+            required=False,
+            action="store",
+            dest="execution_mode",
+            default=EXECUTION_MODE_THREADS,
+            choices=EXECUTION_MODES,
+            help="How the workers run: threads, processes (every process with"
+            " --workers-num threads) or hybrid (threads, and a pool of processes"
+            " for the CPU bound stages)",
+        )
+        self._parser.add_argument(
+            "--processes-num",
+            required=False,
+            action="store",
+            dest="processes_num",
+            default=None,
+            type=int,
+            help="The number of processes of the processes and hybrid modes, by default the number of CPUs",
+        )
         self._parser.add_argument(
             "--settings",
             help=(
@@ -194,4 +290,9 @@ class Command(BaseCommand):
         workers_num = options.get("workers_num")
         interval = options.get("interval")
 
-        start_crawl(workers_num, interval)
+        start_crawl(
+            workers_num,
+            interval,
+            execution_mode=options.get("execution_mode"),
+            processes_num=options.get("processes_num"),
+        )
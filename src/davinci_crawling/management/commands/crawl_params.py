@@ -14,7 +14,7 @@ from django.core.management.base import SystemCheckError
 from django.db import connections
 
 from davinci_crawling.utils import CrawlersRegistry
-from davinci_crawling.task.models import BATCH_TASK, create_davinci_task_batch
+from davinci_crawling.task.models import BATCH_TASK, create_davinci_task_batch, create_davinci_tasks_batch
 
 _logger = logging.getLogger("davinci_crawling.commands")
 
@@ -36,6 +36,23 @@ class CrawlParamsProducer(Producer):
         data = {"user": "batchuser", "kind": crawler_name, "params": param, "options": options, "type": BATCH_TASK}
         create_davinci_task_batch(data)
 
+    def add_crawl_params_bulk(self, params, options):
+        _logger.debug("Adding %d params to queue", len(params))
+
+        crawler_name = options.get("crawler")
+        create_davinci_tasks_batch(
+            [
+                {
+                    "user": "batchuser",
+                    "kind": crawler_name,
+                    "params": param,
+                    "options": dict(options),
+                    "type": BATCH_TASK,
+                }
+                for param in params
+            ]
+        )
+
 
 def crawl_command_to_task(**options):
     """
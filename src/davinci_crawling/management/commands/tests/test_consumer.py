@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 BuildGroup Data Services Inc.
+import threading
+import time
+from collections import Counter
+from unittest import mock
+
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+from davinci_crawling.management.commands.utils.consumer import CrawlConsumer
+from davinci_crawling.management.commands.utils.memory_tasks_queue import MemoryTasksQueue
+from davinci_crawling.task.models import STATUS_FAULTY, STATUS_FINISHED
+
+
+class TestCrawlConsumer(CaravaggioBaseTest):
+    """
+    Test the attempts of the tasks delivered again after their consumer hung.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pass
+
+    def setUp(self):
+        attempts = Counter()
+
+        def add_attempt(task_id):
+            attempts[task_id] += 1
+            return attempts[task_id]
+
+        self.status_buffer = mock.Mock()
+        self.status_buffer.add_attempt.side_effect = add_attempt
+        self.consumer = CrawlConsumer(status_buffer=self.status_buffer, max_attempts=2)
+        # the tasks don't get heartbeats, the consumer is not started
+        self.tasks_queue = MemoryTasksQueue(visibility_timeout=0.2)
+        self.tasks_queue.put([{"param": 1}, {"crawler": "test_crawler", "task_id": "task1"}])
+
+        self.unblock = threading.Event()
+
+    def tearDown(self):
+        # the hung consumers finish before the cleanups join them
+        self.unblock.set()
+
+    def _hang(self, *args):
+        self.unblock.wait(5)
+
+    def _crawl_hung(self):
+        """
+        Take the task and hang while crawling it until its lease expires.
+        """
+        object_queue = self.tasks_queue.get_batch(timeout=0)[0]
+        thread = threading.Thread(target=self.consumer._crawl_object_queue, args=(self.tasks_queue, object_queue))
+        thread.start()
+        self.addCleanup(thread.join)
+        time.sleep(0.3)
+
+    def _statuses(self):
+        return [add_call[0][1] for add_call in self.status_buffer.add.call_args_list]
+
+    def test_redelivered(self):
+        with mock.patch.object(self.consumer, "_crawl", side_effect=self._hang) as crawl:
+            self._crawl_hung()
+
+            crawl.side_effect = None
+            object_queue = self.tasks_queue.get_batch(timeout=0)[0]
+            self.consumer._crawl_object_queue(self.tasks_queue, object_queue)
+
+        self.assertEqual(2, crawl.call_count)
+        self.assertEqual(STATUS_FINISHED, self._statuses()[-1])
+        self.assertEqual(0, self.tasks_queue.unacked_count())
+        self.assertEqual([], self.tasks_queue.failed)
+
+    def test_max_attempts(self):
+        with mock.patch.object(self.consumer, "_crawl", side_effect=self._hang) as crawl:
+            self._crawl_hung()
+            self._crawl_hung()
+
+            # the third delivery exceeds the attempts
+            object_queue = self.tasks_queue.get_batch(timeout=0)[0]
+            self.consumer._crawl_object_queue(self.tasks_queue, object_queue)
+
+        self.assertEqual(2, crawl.call_count)
+        self.assertEqual(STATUS_FAULTY, self._statuses()[-1])
+        self.assertEqual([object_queue], self.tasks_queue.failed)
+        self.assertEqual(0, self.tasks_queue.unacked_count())
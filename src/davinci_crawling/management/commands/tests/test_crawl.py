@@ -15,6 +15,7 @@ from django.conf import settings
 from davinci_crawling.task.models import (
     ON_DEMAND_TASK,
     Task,
+    create_davinci_task_batch,
     STATUS_FINISHED,
     STATUS_CREATED,
     STATUS_IN_PROGRESS,
@@ -103,7 +104,9 @@ class TestCrawl(CaravaggioBaseTest):
 
             if should_fail:
                 task["kind"] = "something_else"
-            Task.create(**task)
+            # the crawl command reads the new tasks from the time series table
+            # so we need to create them the same way the API does.
+            create_davinci_task_batch(task)
 
     def test_pool(self):
         """
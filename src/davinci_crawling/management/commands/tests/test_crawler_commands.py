@@ -74,16 +74,17 @@ class TestCrawl(CaravaggioBaseTest):
         crawler.error(task_id, more_info=status_2)
 
         task_error = Task.objects.get(task_id=task_id)
+        more_info = task_error.get_more_info()
 
         self.assertEquals(STATUS_FAULTY, task_error.status)
-        self.assertEquals(2, len(task_error.more_info))
-        self.assertEquals(status_, task_error.more_info[0].details)
-        self.assertEquals("bovespa", task_error.more_info[0].source)
-        self.assertIsNotNone(task_error.more_info[0].created_at)
+        self.assertEquals(2, len(more_info))
+        self.assertEquals(status_, more_info[0].details)
+        self.assertEquals("bovespa", more_info[0].source)
+        self.assertIsNotNone(more_info[0].created_at)
 
-        self.assertEquals(status_2, task_error.more_info[1].details)
-        self.assertEquals("bovespa", task_error.more_info[1].source)
-        self.assertIsNotNone(task_error.more_info[1].created_at)
+        self.assertEquals(status_2, more_info[1].details)
+        self.assertEquals("bovespa", more_info[1].source)
+        self.assertIsNotNone(more_info[1].created_at)
 
     def test_maintenance_task(self):
         """
@@ -107,7 +108,8 @@ class TestCrawl(CaravaggioBaseTest):
         task = task.first()
 
         self.assertIsNotNone(task)
+        more_info = task.get_more_info()
         self.assertEquals(STATUS_MAINTENANCE, task.status)
-        self.assertEquals(status_, task.more_info[0].details)
-        self.assertEquals("bovespa", task.more_info[0].source)
-        self.assertIsNotNone(task.more_info[0].created_at)
+        self.assertEquals(status_, more_info[0].details)
+        self.assertEquals("bovespa", more_info[0].source)
+        self.assertIsNotNone(more_info[0].created_at)
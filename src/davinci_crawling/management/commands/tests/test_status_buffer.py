@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 BuildGroup Data Services Inc.
+from unittest import mock
+
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+from davinci_crawling.management.commands.utils.status_buffer import TaskStatusBuffer
+from davinci_crawling.task.models import STATUS_FINISHED, STATUS_IN_PROGRESS, STATUS_QUEUED, Task
+
+
+class TestTaskStatusBuffer(CaravaggioBaseTest):
+    """
+    Test the coalescing and the flushes of the status transitions.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pass
+
+    def setUp(self):
+        patch = mock.patch("davinci_crawling.management.commands.utils.status_buffer.write_task_transitions")
+        self.write_task_transitions = patch.start()
+        self.addCleanup(patch.stop)
+
+    @staticmethod
+    def _new_task():
+        return Task(kind="bovespa", params="{}")
+
+    def _written(self, call_index=-1):
+        """
+        The transitions of a call to `write_task_transitions` as a dict of
+        task id -> (status, times_performed, more_info).
+        """
+        transitions = self.write_task_transitions.call_args_list[call_index][0][0]
+        return {
+            keys.task_id: (transition.status, transition.times_performed, transition.more_info)
+            for keys, transition in transitions
+        }
+
+    def test_coalesce(self):
+        status_buffer = TaskStatusBuffer(max_size=10)
+        task = self._new_task()
+
+        status_buffer.add(task, STATUS_QUEUED)
+        self.assertEqual(1, status_buffer.add_attempt(task.task_id))
+        status_buffer.add(task.task_id, STATUS_IN_PROGRESS)
+        status_buffer.add(task.task_id, STATUS_FINISHED, source="crawl consumer", more_info="done")
+        self.write_task_transitions.assert_not_called()
+
+        status_buffer.flush()
+        self.assertEqual({task.task_id: (STATUS_FINISHED, 1, [("crawl consumer", "done")])}, self._written())
+
+        # nothing pending
+        status_buffer.flush()
+        self.assertEqual(1, self.write_task_transitions.call_count)
+
+    def test_flush_on_size(self):
+        status_buffer = TaskStatusBuffer(max_size=2)
+        tasks = [self._new_task() for _ in range(3)]
+
+        status_buffer.add(tasks[0], STATUS_QUEUED)
+        status_buffer.add(tasks[0], STATUS_IN_PROGRESS)
+        self.write_task_transitions.assert_not_called()
+
+        status_buffer.add(tasks[1], STATUS_QUEUED)
+        self.assertEqual([tasks[0].task_id, tasks[1].task_id], list(self._written()))
+
+        status_buffer.add(tasks[2], STATUS_QUEUED)
+        self.assertEqual(1, self.write_task_transitions.call_count)
+
+    def test_flush_failed(self):
+        status_buffer = TaskStatusBuffer(max_size=10)
+        task = self._new_task()
+        status_buffer.add_attempt(task)
+        status_buffer.add(task, STATUS_IN_PROGRESS, source="crawl consumer", more_info="first")
+
+        def fail(transitions, batch_size):
+            # a newer transition arrives while the flush is writing
+            status_buffer.add(task, STATUS_FINISHED, source="crawl consumer", more_info="second")
+            raise Exception("Cassandra is not available")
+
+        self.write_task_transitions.side_effect = fail
+        with self.assertRaises(Exception):
+            status_buffer.flush()
+
+        self.write_task_transitions.side_effect = None
+        status_buffer.flush()
+        self.assertEqual(
+            {task.task_id: (STATUS_FINISHED, 1, [("crawl consumer", "first"), ("crawl consumer", "second")])},
+            self._written(),
+        )
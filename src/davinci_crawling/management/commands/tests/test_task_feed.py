@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 BuildGroup Data Services Inc.
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+from davinci_crawling.management.commands.utils.task_feed import TaskFeed
+from davinci_crawling.task.models import STATUS_CREATED, STATUS_QUEUED
+from django.utils import timezone
+
+
+class TestTaskFeed(CaravaggioBaseTest):
+    """
+    Test the checkpoint and the overlap of the feed of created tasks.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pass
+
+    def setUp(self):
+        checkpoints = {}
+        for patch in (
+            mock.patch(
+                "davinci_crawling.management.commands.utils.task_feed.get_checkpoint_data",
+                side_effect=lambda source, key, default=None: checkpoints.get((source, key), default),
+            ),
+            mock.patch(
+                "davinci_crawling.management.commands.utils.task_feed.put_checkpoint_data",
+                side_effect=lambda source, key, json_data: checkpoints.__setitem__((source, key), json_data),
+            ),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _patch_reads(self):
+        """
+        Replace the reads of the tasks, returns the mocks of the full scan and
+        the read of the buckets.
+        """
+        reads = []
+        for method in ("_full_scan", "_read_buckets"):
+            patch = mock.patch.object(TaskFeed, method, return_value=[])
+            reads.append(patch.start())
+            self.addCleanup(patch.stop)
+        return reads
+
+    def test_checkpoint(self):
+        full_scan, read_buckets = self._patch_reads()
+        task_feed = TaskFeed(overlap_seconds=60)
+        # no checkpoint yet
+        task_feed.poll()
+        full_scan.assert_called_once_with()
+
+        # the position is only persisted when the tasks were queued
+        self.assertIsNone(TaskFeed().high_water_mark)
+        task_feed.commit()
+        high_water_mark = task_feed.high_water_mark
+        self.assertIsNotNone(high_water_mark)
+
+        # a restarted feed reads the buckets since the checkpoint, with
+        # overlap
+        task_feed = TaskFeed(overlap_seconds=60)
+        self.assertEqual(high_water_mark, task_feed.high_water_mark)
+        task_feed.poll()
+        since, until = read_buckets.call_args[0]
+        self.assertEqual(high_water_mark - timedelta(seconds=60), since)
+        self.assertEqual(1, full_scan.call_count)
+
+    def test_catch_up(self):
+        full_scan, read_buckets = self._patch_reads()
+        task_feed = TaskFeed(max_catch_up_minutes=10)
+        task_feed.high_water_mark = timezone.now() - timedelta(minutes=11)
+
+        # walking the buckets is more expensive than a full scan
+        task_feed.poll()
+        full_scan.assert_called_once_with()
+        read_buckets.assert_not_called()
+
+    def test_overlap(self):
+        task_ids = [uuid.uuid4() for _ in range(3)]
+        # the first task was queued after its creation, the second was read
+        # again in the next bucket
+        rows = {
+            "bucket1": [(task_ids[0], STATUS_CREATED), (task_ids[1], STATUS_CREATED)],
+            "bucket2": [(task_ids[1], STATUS_CREATED), (task_ids[2], STATUS_CREATED), (task_ids[0], STATUS_QUEUED)],
+        }
+        statuses = {task_ids[0]: STATUS_QUEUED, task_ids[1]: STATUS_CREATED, task_ids[2]: STATUS_CREATED}
+
+        def time_series(bucket, ts__gte):
+            rows_ts = [SimpleNamespace(task_id=task_id, status=status) for task_id, status in rows[bucket]]
+            return mock.Mock(all=mock.Mock(return_value=rows_ts))
+
+        def tasks(task_id):
+            task = SimpleNamespace(task_id=task_id, status=statuses[task_id])
+            return mock.Mock(first=mock.Mock(return_value=task))
+
+        with mock.patch("davinci_crawling.management.commands.utils.task_feed.TaskTimeSeries") as task_ts_model:
+            with mock.patch("davinci_crawling.management.commands.utils.task_feed.Task") as task_model:
+                with mock.patch.object(TaskFeed, "_buckets", return_value=["bucket1", "bucket2"]):
+                    task_ts_model.objects.filter.side_effect = time_series
+                    task_model.objects.filter.side_effect = tasks
+                    now = timezone.now()
+                    new_tasks = TaskFeed()._read_buckets(now - timedelta(minutes=1), now)
+
+        # the tasks re-read are discarded because they are not CREATED anymore
+        self.assertEqual([task_ids[1], task_ids[2]], [task.task_id for task in new_tasks])
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 BuildGroup Data Services Inc.
+import copy
+import pickle
+import tempfile
+import threading
+import time
+from unittest import mock, skipIf
+
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+from davinci_crawling.management.commands.utils.lanes import DEFAULT_LANE, TasksLane, get_lane, migrate_legacy_queue
+from davinci_crawling.management.commands.utils.memory_tasks_queue import MemoryTasksQueue
+from davinci_crawling.management.commands.utils.redis_tasks_queue import RedisTasksQueue, _next_message_id
+from davinci_crawling.management.commands.utils.tasks_queue import SQLiteTasksQueue, get_tasks_queue
+from davinci_crawling.task.models import BATCH_TASK, ON_DEMAND_TASK
+from django.conf import settings
+from django.test import override_settings
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class TasksQueueTest(CaravaggioBaseTest):
+    """
+    Base of the tests that put their queues in a temporary location.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pass
+
+    def setUp(self):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+
+        davinci_conf = copy.deepcopy(settings.DAVINCI_CONF)
+        davinci_conf["architecture-params"].setdefault("queue", {})["location"] = location.name
+        override = override_settings(DAVINCI_CONF=davinci_conf)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        # the handles of the queues and the lanes are shared by the process
+        for patch in (
+            mock.patch.dict("davinci_crawling.management.commands.utils.tasks_queue._tasks_queues", clear=True),
+            mock.patch.dict("davinci_crawling.management.commands.utils.lanes._lanes", clear=True),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+
+class TestMemoryTasksQueue(CaravaggioBaseTest):
+    """
+    Test the acknowledgements of the in-memory tasks queue.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pass
+
+    def test_ack(self):
+        tasks_queue = MemoryTasksQueue()
+        for i in range(3):
+            tasks_queue.put([{"param": i}, {}])
+
+        first, second = tasks_queue.get_batch(2)
+        self.assertEqual(1, tasks_queue.qsize())
+        self.assertEqual(2, tasks_queue.unacked_count())
+
+        tasks_queue.ack(first)
+        tasks_queue.ack_failed(second)
+        self.assertEqual(0, tasks_queue.unacked_count())
+        self.assertEqual([second], tasks_queue.failed)
+
+    def test_nack(self):
+        tasks_queue = MemoryTasksQueue()
+        tasks_queue.put([{"param": 1}, {}])
+        tasks_queue.put([{"param": 2}, {}])
+
+        item = tasks_queue.get_batch()[0]
+        tasks_queue.nack(item)
+
+        # the nacked item is delivered again before the rest
+        self.assertIs(item, tasks_queue.get_batch()[0])
+
+    def test_lease_expired(self):
+        tasks_queue = MemoryTasksQueue(visibility_timeout=0.5)
+        tasks_queue.put([{"param": 1}, {}])
+        tasks_queue.put([{"param": 2}, {}])
+        live, hung = tasks_queue.get_batch(2)
+
+        time.sleep(0.3)
+        self.assertTrue(tasks_queue.heartbeat(live))
+        time.sleep(0.3)
+
+        # only the item without heartbeats is delivered again
+        self.assertEqual([hung], tasks_queue.get_batch(2, timeout=0))
+        self.assertEqual(2, tasks_queue.unacked_count())
+
+    def test_blocking_get(self):
+        tasks_queue = MemoryTasksQueue()
+        self.assertEqual([], tasks_queue.get_batch(timeout=0.1))
+
+        threading.Timer(0.2, tasks_queue.put, args=([{}, {}],)).start()
+        start = time.time()
+        self.assertEqual(1, len(tasks_queue.get_batch(timeout=5)))
+        self.assertLess(time.time() - start, 5)
+
+
+class TestSQLiteTasksQueue(TasksQueueTest):
+    """
+    Test the SQLite queue shared by several processes.
+    """
+
+    def test_lease_expired(self):
+        with tempfile.TemporaryDirectory() as location:
+            # the handles of two processes, one of them hangs
+            live_process = SQLiteTasksQueue(location, visibility_timeout=1)
+            hung_process = SQLiteTasksQueue(location, visibility_timeout=1)
+            live_process.put([{"param": 1}, {}])
+            live_process.put([{"param": 2}, {}])
+            live_item = live_process.get_batch(timeout=0)[0]
+            hung_item = hung_process.get_batch(timeout=0)[0]
+
+            time.sleep(0.6)
+            self.assertTrue(live_process.heartbeat(live_item))
+            time.sleep(0.6)
+
+            # only the item without heartbeats is delivered again
+            redelivered = live_process.get_batch(2, timeout=0)
+            self.assertEqual([hung_item], redelivered)
+
+            # the hung process lost the lease, its acknowledgements are ignored
+            self.assertFalse(hung_process.heartbeat(hung_item))
+            hung_process.ack(hung_item)
+            self.assertTrue(live_process.heartbeat(redelivered[0]))
+
+            live_process.ack(live_item)
+            live_process.ack(redelivered[0])
+            time.sleep(1.1)
+            self.assertEqual([], live_process.get_batch(timeout=0))
+
+    def test_resume_abandoned(self):
+        with tempfile.TemporaryDirectory() as location:
+            # the handles of two processes
+            dead_process = SQLiteTasksQueue(location)
+            crawl_process = SQLiteTasksQueue(location)
+            dead_process.put([{"param": 1}, {}])
+            self.assertEqual(1, len(dead_process.get_batch(timeout=0)))
+
+            # opening the queue doesn't take the tasks of the live processes
+            self.assertEqual([], SQLiteTasksQueue(location).get_batch(timeout=0))
+
+            # the crawl process starts again after a crash
+            crawl_process.resume_abandoned()
+            items = crawl_process.get_batch(timeout=0)
+            self.assertEqual([[{"param": 1}, {}]], items)
+            crawl_process.ack(items[0])
+
+
+class TestTasksLane(TasksQueueTest):
+    """
+    Test the priorities and the acknowledgements of the lanes.
+    """
+
+    def test_priorities(self):
+        lane = TasksLane("test_lane")
+
+        lane.put([{"param": 1}, {}], BATCH_TASK)
+        lane.put([{"param": 2}, {}], ON_DEMAND_TASK)
+
+        on_demand = lane.get_batch(2)
+        self.assertEqual([[{"param": 2}, {}]], on_demand)
+        batch = lane.get_batch(2)
+        self.assertEqual([[{"param": 1}, {}]], batch)
+
+        lane.nack(batch[0])
+        redelivered = lane.get_batch()
+        self.assertEqual(batch, redelivered)
+        for item in on_demand + redelivered:
+            lane.ack(item)
+        self.assertEqual([], lane.get_batch(timeout=0))
+
+    def test_lost_lease(self):
+        lane = TasksLane("test_lost_lease")
+
+        lane.put([{"param": 1}, {}])
+        item = lane.get_batch()[0]
+        lane.ack(item)
+
+        # the item is not owned by the lane anymore, like after a lost lease
+        self.assertFalse(lane.heartbeat(item))
+        lane.ack(item)
+        lane.ack_failed(item)
+        lane.nack(item)
+        self.assertEqual([], lane.get_batch(timeout=0))
+
+    def test_migrate_legacy_queue(self):
+        lane = get_lane(DEFAULT_LANE)
+
+        legacy_queue = get_tasks_queue()
+        legacy_queue.put([{"param": 1}, {"crawler": "legacy_crawler"}])
+
+        self.assertEqual(1, migrate_legacy_queue())
+        self.assertEqual([], legacy_queue.get_batch(timeout=0))
+        items = lane.get_batch(timeout=0)
+        self.assertEqual([[{"param": 1}, {"crawler": "legacy_crawler"}]], items)
+        lane.ack(items[0])
+
+
+@skipIf(fakeredis is None, "fakeredis is not installed")
+class TestRedisTasksQueue(TasksQueueTest):
+    """
+    Test the Redis Streams queue against a fake Redis server.
+    """
+
+    def setUp(self):
+        super().setUp()
+        server = fakeredis.FakeServer()
+        patch = mock.patch("redis.Redis", side_effect=lambda **kwargs: fakeredis.FakeRedis(server=server))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _get_queue(self, location, consumer):
+        tasks_queue = RedisTasksQueue(location, visibility_timeout=0.2)
+        # the consumers of different processes
+        tasks_queue.consumer = consumer
+        tasks_queue.claim_interval = 0
+        return tasks_queue
+
+    def test_next_message_id(self):
+        self.assertEqual("1526919030474-56", _next_message_id(b"1526919030474-55"))
+        self.assertEqual("1526919030474-1", _next_message_id("1526919030474-0"))
+
+    def test_claim_abandoned(self):
+        live_process = self._get_queue("test_claim", "live")
+        other_process = self._get_queue("test_claim", "other")
+        for i in range(5):
+            live_process.put([{"param": i}, {}])
+        items = live_process.get_batch(5, timeout=0)
+
+        time.sleep(0.3)
+        # the live items are in front of the abandoned ones in the pending
+        # list, that is read in several pages
+        for item in items[:3]:
+            self.assertTrue(live_process.heartbeat(item))
+        with mock.patch("davinci_crawling.management.commands.utils.redis_tasks_queue.PENDING_PAGE_SIZE", 2):
+            claimed = other_process.get_batch(5, timeout=0)
+        self.assertEqual(items[3:], claimed)
+
+        # the claimed items are not owned by the live process anymore
+        self.assertFalse(live_process.heartbeat(items[3]))
+        live_process.ack(items[3])
+        pending = live_process.client.xpending_range(live_process.stream, live_process.group, "-", "+", 10)
+        self.assertEqual([b"live"] * 3 + [b"other"] * 2, [message["consumer"] for message in pending])
+
+    def test_get_batch_any(self):
+        on_demand = self._get_queue("test_any/on_demand", "consumer")
+        batch = self._get_queue("test_any/batch", "consumer")
+        for i in range(2):
+            batch.put([{"batch": i}, {}])
+            on_demand.put([{"on_demand": i}, {}])
+
+        items = RedisTasksQueue.get_batch_any([on_demand, batch], max_items=3, timeout=0)
+        self.assertEqual(
+            [(on_demand, [{"on_demand": 0}, {}]), (on_demand, [{"on_demand": 1}, {}]), (batch, [{"batch": 0}, {}])],
+            items,
+        )
+
+        # the item read over the count is added again to its stream
+        self.assertEqual([(batch, [{"batch": 1}, {}])], RedisTasksQueue.get_batch_any([on_demand, batch], timeout=0))
+
+    def test_ack(self):
+        tasks_queue = self._get_queue("test_ack", "consumer")
+        for i in range(3):
+            tasks_queue.put([{"param": i}, {}])
+        acked, failed, nacked = tasks_queue.get_batch(3, timeout=0)
+
+        tasks_queue.ack(acked)
+        tasks_queue.ack_failed(failed)
+        tasks_queue.nack(nacked)
+
+        # the nacked item is the only one left in the stream
+        self.assertEqual(1, tasks_queue.client.xlen(tasks_queue.stream))
+        self.assertEqual(0, tasks_queue.client.xpending(tasks_queue.stream, tasks_queue.group)["pending"])
+        failed_messages = tasks_queue.client.xrange(tasks_queue.failed_stream)
+        self.assertEqual([failed], [pickle.loads(fields[b"item"]) for _, fields in failed_messages])
+        self.assertEqual([nacked], tasks_queue.get_batch(timeout=0))
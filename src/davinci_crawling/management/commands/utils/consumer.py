@@ -1,21 +1,44 @@
 # -*- coding: utf-8 -*
 # Copyright (c) 2019 BuildGroup Data Services Inc.
+import threading
 import traceback
 
 import logging
-import time
+from collections import deque
 from datetime import datetime
-from davinci_crawling.management.commands.utils.utils import update_task_status, get_crawler_by_name
+from davinci_crawling.management.commands.utils.execution import (
+    EXECUTION_MODE_THREADS,
+    EXECUTION_MODE_PROCESSES,
+    EXECUTION_MODE_HYBRID,
+    get_default_processes_num,
+    get_mp_context,
+    run_consumer_process,
+    start_process_pool,
+    stop_process_pool,
+)
+from davinci_crawling.management.commands.utils.lanes import DEFAULT_LANE, get_lane, get_lanes
+from davinci_crawling.management.commands.utils.status_buffer import TaskStatusBuffer
+from davinci_crawling.management.commands.utils.utils import get_crawler_by_name
 from davinci_crawling.task.models import STATUS_IN_PROGRESS, STATUS_FAULTY, STATUS_FINISHED
-from persistqueue import SQLiteAckQueue
-from persistqueue.exceptions import Empty
+from davinci_crawling.management.commands.utils.tasks_queue import QUEUE_LOCATION, get_tasks_queue  # noqa: F401
+from django.conf import settings
 from threading import Thread
 
 _logger = logging.getLogger("davinci_crawling.queue")
 
-QUEUE_LOCATION = "tasks_queue"
-# create the queue for the first time
-SQLiteAckQueue(QUEUE_LOCATION)
+# Quantity of tasks that every consumer takes from the queue at once
+DEFAULT_PREFETCH_SIZE = 1
+
+# Quantity of times that a task is delivered to the consumers before
+# considering it faulty, the task is delivered again when its lease expires
+# (ex. the consumer died or hung while it was performing it)
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def _get_consumer_settings():
+    if hasattr(settings, "DAVINCI_CONF") and "consumer" in settings.DAVINCI_CONF.get("architecture-params", {}):
+        return settings.DAVINCI_CONF["architecture-params"]["consumer"]
+    return {}
 
 
 class CrawlConsumer(object):
@@ -28,30 +51,97 @@ class CrawlConsumer(object):
 
     consumers = []
 
-    def __init__(self, qty_workers=2, times_to_run=None):
+    def __init__(
+        self,
+        qty_workers=2,
+        times_to_run=None,
+        status_buffer=None,
+        execution_mode=EXECUTION_MODE_THREADS,
+        processes_num=None,
+        prefetch_size=None,
+        max_attempts=None,
+    ):
         """
         Args:
-            qty_workers: The quantity of consumers that we want to start.
+            qty_workers: The quantity of consumers that we want to start, in
+            the processes mode the quantity of consumers of every process.
             times_to_run: how many time to run on the thread. [ONLY FOR
              TESTING]
+            status_buffer: the TaskStatusBuffer used to write the status of
+            the tasks, if None the consumer creates (and flushes) its own.
+            execution_mode: threads, processes or hybrid (see the
+            `execution` module).
+            processes_num: the quantity of processes of the processes and
+            hybrid modes, by default the quantity of CPUs.
+            prefetch_size: the quantity of tasks that every consumer takes
+            from the queue at once.
+            max_attempts: the quantity of times that a task can be delivered
+            before considering it faulty.
         """
         self.consumers = []
         self.qty_workers = qty_workers
+        self.execution_mode = execution_mode
+        self.processes_num = processes_num or get_default_processes_num()
+        self.prefetch_size = prefetch_size or _get_consumer_settings().get("prefetch-size", DEFAULT_PREFETCH_SIZE)
+        self.max_attempts = max_attempts or _get_consumer_settings().get("max-attempts", DEFAULT_MAX_ATTEMPTS)
         self.cached_crawlers = {}
         self.times_to_run = times_to_run
+        self._owns_status_buffer = status_buffer is None
+        self.status_buffer = status_buffer if status_buffer else TaskStatusBuffer()
+        # consumer thread -> (lane, the tasks taken from the lane and not
+        # acked yet)
+        self._leased = {}
+        self._stopped = threading.Event()
 
     def start(self):
         """
         Start all the consumers that we need and store them on the
         consumers list.
         """
-        for i in range(self.qty_workers):
-            p = Thread(target=self._crawl_params)
-            self.consumers.append(p)
+        if self.execution_mode == EXECUTION_MODE_PROCESSES:
+            # the consumer processes write the status of their tasks
+            for i in range(self.processes_num):
+                p = get_mp_context().Process(target=run_consumer_process, args=(self.qty_workers, self.times_to_run))
+                self.consumers.append(p)
+
+            for consumer in self.consumers:
+                consumer.start()
+            return
+
+        if self.execution_mode == EXECUTION_MODE_HYBRID:
+            start_process_pool(self.processes_num)
+
+        if self._owns_status_buffer:
+            self.status_buffer.start()
+
+        for lane in get_lanes():
+            workers_num = lane.workers_num or self.qty_workers
+            _logger.debug("Starting %d workers for the %s lane", workers_num, lane.name)
+            for i in range(workers_num):
+                p = Thread(target=self._crawl_params, args=(lane,))
+                self.consumers.append(p)
 
         for consumer in self.consumers:
             consumer.start()
 
+        Thread(target=self._keep_leases, daemon=True).start()
+
+    def _keep_leases(self):
+        """
+        Heartbeat the leases of the tasks held by the consumer threads that
+        are alive, the tasks of a dead process (or a dead thread that didn't
+        give them back) are delivered again when their lease expires.
+        """
+        visibility_timeout = get_lane(DEFAULT_LANE).visibility_timeout
+        while not self._stopped.wait(visibility_timeout / 3):
+            try:
+                for thread, (lane, leased) in list(self._leased.items()):
+                    if thread.is_alive():
+                        for object_queue in list(leased):
+                            lane.heartbeat(object_queue)
+            except Exception as e:
+                _logger.error("Error while extending the leases of the tasks", e)
+
     def _crawl(self, crawler_name, task_id, crawler_param, options):
         """
         Calls the crawl method inside the crawler being used.
@@ -73,47 +163,85 @@ class CrawlConsumer(object):
         _logger.debug("Joining consumers")
         for consumer in self.consumers:
             consumer.join()
+        self._stopped.set()
+
+        if self.execution_mode == EXECUTION_MODE_PROCESSES:
+            return
+
+        if self.execution_mode == EXECUTION_MODE_HYBRID:
+            stop_process_pool()
 
-    def _crawl_params(self):
+        if self._owns_status_buffer:
+            self.status_buffer.stop()
+
+    def _crawl_params(self, tasks_queue=None):
         """
-        Read the multiprocessing queue and call the crawl method to execute the
+        Read the tasks queue and call the crawl method to execute the
         crawling logic.
 
         Will run forever than we need to Ctrl+C to finish this.
+        Args:
+            tasks_queue: the lane (or queue) to read, by default the default
+            lane.
         """
         times_run = 0
-        tasks_queue = SQLiteAckQueue(QUEUE_LOCATION)
-        while True:
-            if self.times_to_run and times_run > self.times_to_run:
+        tasks_queue = tasks_queue or get_lane(DEFAULT_LANE)
+        # the task being performed stays at the left until it's acked
+        prefetched = deque()
+        self._leased[threading.current_thread()] = (tasks_queue, prefetched)
+        try:
+            while True:
+                if self.times_to_run and times_run > self.times_to_run:
+                    return
+
+                if not prefetched:
+                    # blocks until the poller puts new tasks
+                    prefetched.extend(tasks_queue.get_batch(self.prefetch_size))
+                    if not prefetched:
+                        _logger.debug("No objects found on queue")
+                        times_run += 1
+                        continue
+
+                self._crawl_object_queue(tasks_queue, prefetched[0])
+                prefetched.popleft()
+                times_run += 1
+        finally:
+            # give back the tasks that we will not process
+            for object_queue in prefetched:
+                tasks_queue.nack(object_queue)
+
+    def _crawl_object_queue(self, tasks_queue, object_queue):
+        task_id = None
+        try:
+            crawl_param, options = object_queue
+            crawler_name = options.get("crawler")
+            task_id = options.get("task_id")
+
+            attempt = self.status_buffer.add_attempt(task_id) if task_id else 1
+            if attempt > self.max_attempts:
+                self.status_buffer.add(
+                    task_id,
+                    STATUS_FAULTY,
+                    source="crawl consumer",
+                    more_info="The task was delivered {} times without being finished".format(self.max_attempts),
+                )
+                tasks_queue.ack_failed(object_queue)
                 return
-            task_id = None
-            object_queue = None
-            try:
-                object_queue = tasks_queue.get(block=False)
-                crawl_param, options = object_queue
-                crawler_name = options.get("crawler")
-                task_id = options.get("task_id")
-                update_task_status(task_id, STATUS_IN_PROGRESS)
-                _logger.debug("Reading a queue value %s", crawl_param)
-
-                if "current_execution_date" not in options:
-                    options["current_execution_date"] = datetime.utcnow()
-
-                self._crawl(crawler_name, task_id, crawl_param, options)
-                update_task_status(task_id, STATUS_FINISHED)
-                tasks_queue.ack(object_queue)
-            except Empty:
-                # Means that the queue is empty and we need to count many times
-                # that the occurs to the close logic, we just start counting
-                # when at least the queue received one
-                _logger.debug("No objects found on queue, waiting for 1 " "second and try again")
-                time.sleep(1)
-            except Exception as e:
-                if task_id and object_queue:
-                    update_task_status(
-                        task_id, STATUS_FAULTY, source="crawl consumer", more_info=traceback.format_exc()
-                    )
-                    tasks_queue.ack_failed(object_queue)
-
-                _logger.error("Error while crawling params from queue", e)
-            times_run += 1
+
+            self.status_buffer.add(task_id, STATUS_IN_PROGRESS)
+            _logger.debug("Reading a queue value %s", crawl_param)
+
+            if "current_execution_date" not in options:
+                options["current_execution_date"] = datetime.utcnow()
+
+            self._crawl(crawler_name, task_id, crawl_param, options)
+            self.status_buffer.add(task_id, STATUS_FINISHED)
+            tasks_queue.ack(object_queue)
+        except Exception as e:
+            if task_id:
+                self.status_buffer.add(
+                    task_id, STATUS_FAULTY, source="crawl consumer", more_info=traceback.format_exc()
+                )
+            tasks_queue.ack_failed(object_queue)
+
+            _logger.error("Error while crawling params from queue", e)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+"""
+Execution modes of the crawl consumers.
+
+- threads: all the consumers are threads of the crawl process (default).
+- processes: the consumers run in several processes, every one of them with
+  its own threads, Cassandra session and crawler instances.
+- hybrid: the consumers are threads (the I/O stages) and the CPU bound stages
+  of the crawlers (ex. parsing files) are sent to a pool of processes using
+  `run_cpu_bound`.
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+_logger = logging.getLogger("davinci_crawling.queue")
+
+EXECUTION_MODE_THREADS = "threads"
+EXECUTION_MODE_PROCESSES = "processes"
+EXECUTION_MODE_HYBRID = "hybrid"
+
+EXECUTION_MODES = [EXECUTION_MODE_THREADS, EXECUTION_MODE_PROCESSES, EXECUTION_MODE_HYBRID]
+
+# The processes are spawned, not forked, the Cassandra driver connections
+# (and their threads) cannot be shared with a forked child.
+_mp_context = multiprocessing.get_context("spawn")
+
+_process_pool = None
+
+
+def get_default_processes_num():
+    return os.cpu_count() or 1
+
+
+def get_mp_context():
+    return _mp_context
+
+
+def initialize_process():
+    """
+    Prepare a new process to run crawling code, Django is set up again (with
+    the configuration of django-configurations) so the process opens its own
+    Cassandra session the first time it's used.
+    """
+    import configurations
+
+    configurations.setup()
+    _logger.debug("Initialized crawling process %d", os.getpid())
+
+
+def run_consumer_process(qty_workers, times_to_run):
+    """
+    Entry point of the consumer processes (processes execution mode), every
+    process runs its own threaded consumer.
+
+    The crawling code is imported after the setup of Django, this module
+    doesn't import any model and it's the only one imported when the target
+    of the process is unpickled.
+    """
+    initialize_process()
+
+    from davinci_crawling.management.commands.utils.consumer import CrawlConsumer
+    from davinci_crawling.throttle.throttle import Throttle
+
+    # the tokens of the throttles are shared by all the consumer processes
+    Throttle.share_between_processes()
+
+    crawl_consumer = CrawlConsumer(qty_workers, times_to_run)
+    crawl_consumer.start()
+    crawl_consumer.join()
+
+
+def start_process_pool(processes_num=None):
+    """
+    Start the pool of processes used by `run_cpu_bound` (hybrid mode).
+    """
+    global _process_pool
+    if not _process_pool:
+        processes_num = processes_num or get_default_processes_num()
+        _logger.info("Starting a pool of %d processes for the CPU bound stages", processes_num)
+        _process_pool = ProcessPoolExecutor(
+            max_workers=processes_num, mp_context=_mp_context, initializer=initialize_process
+        )
+    return _process_pool
+
+
+def stop_process_pool():
+    global _process_pool
+    if _process_pool:
+        _process_pool.shutdown(wait=True)
+        _process_pool = None
+
+
+def run_cpu_bound(func, *args, **kwargs):
+    """
+    Run a CPU bound function. In hybrid mode it's executed in the pool of
+    processes and the calling thread waits for the result, otherwise it's
+    called directly. The function, the arguments and the result should be
+    picklable.
+    """
+    if _process_pool:
+        return _process_pool.submit(func, *args, **kwargs).result()
+    return func(*args, **kwargs)
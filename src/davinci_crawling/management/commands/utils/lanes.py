@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+"""
+Lanes of the crawl pipeline.
+
+A lane has its own tasks queues and its own consumer threads, so the tasks of
+a crawler with a lane don't wait behind the tasks of other crawlers. The
+crawlers get their lane with the "lane" key of their crawler-params:
+
+    "crawler-params": {
+        "bovespa": {
+            "lane": {"workers_num": 2, "priorities": [ON_DEMAND_TASK, BATCH_TASK]},
+        },
+    }
+
+The crawlers without a lane share the default lane, its workers are the
+`--workers-num` of the crawl command.
+
+Every lane has a queue for every task type, the tasks of a type are only
+delivered when the queues of the types before it in `priorities` are empty,
+by default the on demand tasks go ahead of the batch tasks.
+
+The queues of the lanes are in "<location>/<lane>/<task type>", the tasks
+left in the single queue of the versions without lanes (in "<location>") are
+moved to their lane when the crawl starts (see `migrate_legacy_queue`).
+"""
+import logging
+import threading
+
+from davinci_crawling.management.commands.utils.tasks_queue import (
+    DEFAULT_IDLE_TIMEOUT,
+    QUEUE_LOCATION,
+    get_queue_settings,
+    get_tasks_queue,
+)
+from davinci_crawling.task.models import BATCH_TASK, ON_DEMAND_TASK
+from django.conf import settings
+
+_logger = logging.getLogger("davinci_crawling.queue")
+
+DEFAULT_LANE = "default"
+
+# The key of the lane settings in the crawler-params
+LANE_OPTION = "lane"
+
+DEFAULT_PRIORITIES = [ON_DEMAND_TASK, BATCH_TASK]
+
+
+def get_lanes_settings():
+    """
+    The settings of the lanes by name, one for every crawler with a lane.
+    """
+    if not hasattr(settings, "DAVINCI_CONF"):
+        return {}
+    return {
+        kind: crawler_params[LANE_OPTION]
+        for kind, crawler_params in settings.DAVINCI_CONF.get("crawler-params", {}).items()
+        if kind != "default" and LANE_OPTION in crawler_params
+    }
+
+
+def get_lane_name(kind):
+    """
+    The name of the lane of the tasks of a crawler.
+    """
+    return kind if kind in get_lanes_settings() else DEFAULT_LANE
+
+
+class TasksLane(object):
+    """
+    A group of tasks queues read by priority. It has the same interface of
+    the TasksQueue, the items are acked through the lane.
+    """
+
+    def __init__(self, name, workers_num=None, priorities=None):
+        """
+        Args:
+            name: the name of the lane, the kind of the crawler or
+            `DEFAULT_LANE`.
+            workers_num: the quantity of consumer threads of the lane, None to
+            use the workers of the crawl command.
+            priorities: the task types in the order they are delivered.
+        """
+        lane_settings = get_lanes_settings().get(name, {})
+        self.name = name
+        self.workers_num = workers_num or lane_settings.get("workers_num", None)
+        self.priorities = list(priorities or lane_settings.get("priorities", DEFAULT_PRIORITIES))
+        self.queues = [get_tasks_queue(self._get_location(task_type)) for task_type in self.priorities]
+        self.visibility_timeout = self.queues[0].visibility_timeout
+
+        self._condition = threading.Condition()
+        self._lock = threading.Lock()
+        # id(item) -> the queue of the item
+        self._owners = {}
+
+    def _get_location(self, task_type):
+        return "{}/{}/{}".format(get_queue_settings().get("location", QUEUE_LOCATION), self.name, task_type)
+
+    def _notify(self):
+        with self._condition:
+            self._condition.notify()
+
+    def put(self, item, task_type=ON_DEMAND_TASK):
+        """
+        Put an item in the queue of its task type, the types without priority
+        go to the last queue.
+        """
+        if task_type in self.priorities:
+            self.queues[self.priorities.index(task_type)].put(item)
+        else:
+            self.queues[-1].put(item)
+        self._notify()
+
+    def _set_owner(self, queue, item):
+        with self._lock:
+            self._owners[id(item)] = queue
+        return item
+
+    def _pop(self, max_items):
+        for queue in self.queues:
+            items = queue.get_batch(max_items, timeout=0)
+            if items:
+                return [self._set_owner(queue, item) for item in items]
+        return []
+
+    def get_batch(self, max_items=1, timeout=DEFAULT_IDLE_TIMEOUT):
+        """
+        Get up to `max_items` items of the queue with the highest priority
+        that has items, blocking until there is at least one.
+        Args:
+            max_items: the maximum quantity of items to get.
+            timeout: the maximum seconds to wait for an item.
+
+        Returns: a list with the items, empty if the timeout expired.
+        """
+        if self.queues[0].blocking_reads:
+            # a single read of all the queues that blocks in the server, it's
+            # woken up by the puts of all the hosts
+            batch = type(self.queues[0]).get_batch_any(self.queues, max_items, timeout)
+            return [self._set_owner(queue, item) for queue, item in batch]
+
+        items = self._pop(max_items)
+        if items or not timeout:
+            return items
+
+        with self._condition:
+            # a put could have happened between the pop and the wait
+            items = self._pop(max_items)
+            if not items:
+                self._condition.wait(timeout)
+
+        return items or self._pop(max_items)
+
+    def _take_owner(self, item):
+        with self._lock:
+            queue = self._owners.pop(id(item), None)
+        if not queue:
+            # the heartbeat found the item taken by another consumer
+            _logger.warning("The lease of the task %s was lost, ignoring its acknowledgement", item)
+        return queue
+
+    def heartbeat(self, item):
+        with self._lock:
+            queue = self._owners.get(id(item))
+        if queue and queue.heartbeat(item):
+            return True
+        # the item went without heartbeats and another consumer took it
+        with self._lock:
+            self._owners.pop(id(item), None)
+        return False
+
+    def resume_abandoned(self):
+        for queue in self.queues:
+            queue.resume_abandoned()
+        self._notify()
+
+    def ack(self, item):
+        queue = self._take_owner(item)
+        if queue:
+            queue.ack(item)
+
+    def ack_failed(self, item):
+        queue = self._take_owner(item)
+        if queue:
+            queue.ack_failed(item)
+
+    def nack(self, item):
+        queue = self._take_owner(item)
+        if queue:
+            queue.nack(item)
+            self._notify()
+
+
+_lock = threading.Lock()
+_lanes = {}
+
+
+def get_lane(name=DEFAULT_LANE):
+    """
+    The handle of the lane shared by all the threads of the process.
+    """
+    with _lock:
+        lane = _lanes.get(name)
+        if not lane:
+            lane = _lanes[name] = TasksLane(name)
+    return lane
+
+
+def get_lanes():
+    """
+    All the lanes, the default one first.
+    """
+    return [get_lane(DEFAULT_LANE)] + [get_lane(name) for name in sorted(get_lanes_settings())]
+
+
+def migrate_legacy_queue(batch_size=100):
+    """
+    Move the tasks of the queue used before the lanes to the queues of their
+    lane, otherwise they would stay QUEUED forever. The task type was not
+    queued, the tasks go to the queue with the highest priority.
+
+    Returns: the quantity of tasks moved.
+    """
+    legacy_queue = get_tasks_queue(get_queue_settings().get("location", QUEUE_LOCATION))
+    legacy_queue.resume_abandoned()
+    moved = 0
+    while True:
+        items = legacy_queue.get_batch(batch_size, timeout=0)
+        if not items:
+            break
+        for item in items:
+            # the item is acked once it's in its lane, a failure duplicates it
+            # instead of losing it
+            _, options = item
+            lane = get_lane(get_lane_name(options.get("crawler")))
+            lane.put(item, lane.priorities[0])
+            legacy_queue.ack(item)
+        moved += len(items)
+
+    if moved:
+        _logger.info("Moved %d tasks from the queue %s to their lanes", moved, legacy_queue.location)
+    return moved
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+import logging
+import threading
+import time
+from collections import deque
+
+from davinci_crawling.management.commands.utils.tasks_queue import QUEUE_LOCATION, TasksQueue
+
+_logger = logging.getLogger("davinci_crawling.queue")
+
+
+class MemoryTasksQueue(TasksQueue):
+    """
+    Queue in the memory of the process, the tasks are lost when the process
+    ends and it cannot be used in the processes execution mode. The tasks are
+    leased like in the SQLite queue. Used by the tests and the benchmarks.
+    """
+
+    multiprocess = False
+
+    def __init__(self, location=QUEUE_LOCATION, visibility_timeout=None):
+        super().__init__(location, visibility_timeout)
+        self._lock = threading.Lock()
+        self._ready = deque()
+        # id(item) -> (item, leased until)
+        self._unacked = {}
+        self.failed = []
+
+    def _put(self, item):
+        with self._lock:
+            self._ready.append(item)
+
+    def _pop(self, max_items):
+        items = []
+        with self._lock:
+            now = time.time()
+            # the items with an expired lease are delivered again first
+            for key, (item, leased_until) in list(self._unacked.items()):
+                if len(items) == max_items:
+                    break
+                if leased_until <= now:
+                    _logger.warning("The lease of the task %s expired, delivering it again", item)
+                    self._unacked[key] = (item, now + self.visibility_timeout)
+                    items.append(item)
+            while self._ready and len(items) < max_items:
+                item = self._ready.popleft()
+                self._unacked[id(item)] = (item, now + self.visibility_timeout)
+                items.append(item)
+        return items
+
+    def heartbeat(self, item):
+        with self._lock:
+            if id(item) not in self._unacked:
+                return False
+            self._unacked[id(item)] = (item, time.time() + self.visibility_timeout)
+            return True
+
+    def _ack(self, item):
+        with self._lock:
+            self._unacked.pop(id(item), None)
+
+    def _ack_failed(self, item):
+        with self._lock:
+            if id(item) in self._unacked:
+                del self._unacked[id(item)]
+                self.failed.append(item)
+
+    def _nack(self, item):
+        with self._lock:
+            if self._unacked.pop(id(item), None) is None:
+                return
+            # the item keeps its turn
+            self._ready.appendleft(item)
+        self._notify()
+
+    def qsize(self):
+        with self._lock:
+            return len(self._ready)
+
+    def unacked_count(self):
+        with self._lock:
+            return len(self._unacked)
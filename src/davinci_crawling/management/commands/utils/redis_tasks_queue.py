@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+"""
+Queue of tasks shared by the crawlers of several hosts, backed by a Redis
+stream and a consumer group.
+
+Every process is a consumer of the group, the messages read and not acked
+stay in the pending list of the consumer. The heartbeats of the consumer
+reset the idle time of its messages, the messages idle for longer than the
+visibility timeout (ex. the consumer died) are claimed by another consumer.
+"""
+import logging
+import os
+import pickle
+import socket
+import threading
+import time
+
+import redis
+from davinci_crawling.management.commands.utils.tasks_queue import (
+    DEFAULT_IDLE_TIMEOUT,
+    QUEUE_LOCATION,
+    TasksQueue,
+    get_queue_settings,
+)
+from django.conf import settings
+
+_logger = logging.getLogger("davinci_crawling.queue")
+
+KEY_PREFIX = "davinci_queue:"
+
+DEFAULT_GROUP = "davinci_crawlers"
+
+# Seconds between two checks of abandoned messages
+DEFAULT_CLAIM_INTERVAL = 60
+
+# Entries of the pending list read in every request of the claim
+PENDING_PAGE_SIZE = 100
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _next_message_id(message_id):
+    """
+    The smallest message id after the given one, the exclusive ranges of
+    XPENDING need Redis 6.2.
+    """
+    milliseconds, sequence = _decode(message_id).split("-")
+    return "{}-{}".format(milliseconds, int(sequence) + 1)
+
+
+class RedisTasksQueue(TasksQueue):
+    """
+    Queue of tasks in a Redis stream, read through a consumer group.
+    """
+
+    blocking_reads = True
+
+    def __init__(self, location=QUEUE_LOCATION, visibility_timeout=None):
+        super().__init__(location, visibility_timeout)
+        queue_settings = get_queue_settings()
+        self.stream = KEY_PREFIX + location
+        self.failed_stream = self.stream + ":failed"
+        self.group = queue_settings.get("group", DEFAULT_GROUP)
+        self.consumer = "{}-{}".format(socket.gethostname(), os.getpid())
+        self.claim_interval = queue_settings.get("claim-interval", DEFAULT_CLAIM_INTERVAL)
+
+        # the client is thread safe, every thread takes a connection from its
+        # pool
+        self.client = redis.Redis(
+            host=settings.REDIS_HOST_PRIMARY,
+            port=int(settings.REDIS_PORT_PRIMARY),
+            password=settings.REDIS_PASS_PRIMARY or None,
+        )
+
+        self._lock = threading.Lock()
+        # id(item) -> (message id, item)
+        self._unacked = {}
+        self._next_claim = 0
+
+        self._create_group()
+
+    def _create_group(self):
+        try:
+            self.client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            # the group was already created by another consumer
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def _put(self, item):
+        self.client.xadd(self.stream, {"item": pickle.dumps(item)})
+
+    def _to_items(self, messages):
+        items = []
+        with self._lock:
+            for message_id, fields in messages:
+                if not fields:
+                    # deleted while it was pending
+                    self.client.xack(self.stream, self.group, message_id)
+                    continue
+                item = pickle.loads(fields[b"item"])
+                self._unacked[id(item)] = (message_id, item)
+                items.append(item)
+        return items
+
+    def _claim_abandoned(self, max_items):
+        """
+        Take the messages that other consumers read and didn't ack nor
+        heartbeat in the last `visibility_timeout` seconds.
+        """
+        now = time.time()
+        if now < self._next_claim:
+            return []
+        self._next_claim = now + self.claim_interval
+
+        min_idle_time = int(self.visibility_timeout * 1000)
+        message_ids = self._find_abandoned(max_items, min_idle_time)
+        if not message_ids:
+            return []
+
+        messages = self.client.xclaim(self.stream, self.group, self.consumer, min_idle_time, message_ids)
+        if messages:
+            _logger.info("Claimed %d abandoned tasks", len(messages))
+            # there could be more
+            self._next_claim = 0
+        return self._to_items(messages)
+
+    def _find_abandoned(self, max_items, min_idle_time):
+        """
+        Page through the pending list of the group until `max_items` messages
+        idle for `min_idle_time` are found, the live (heartbeated) messages
+        can be in front of the abandoned ones.
+        """
+        message_ids = []
+        start = "-"
+        while len(message_ids) < max_items:
+            pending = self.client.xpending_range(self.stream, self.group, start, "+", PENDING_PAGE_SIZE)
+            message_ids.extend(
+                message["message_id"] for message in pending if message["time_since_delivered"] >= min_idle_time
+            )
+            if len(pending) < PENDING_PAGE_SIZE:
+                break
+            start = _next_message_id(pending[-1]["message_id"])
+        return message_ids[:max_items]
+
+    def _read(self, max_items, block=None):
+        items = self._claim_abandoned(max_items)
+        if items:
+            return items
+
+        response = self.client.xreadgroup(self.group, self.consumer, {self.stream: ">"}, count=max_items, block=block)
+        return self._to_items(response[0][1]) if response else []
+
+    def _pop(self, max_items):
+        return self._read(max_items)
+
+    def _get_batch(self, max_items, timeout=DEFAULT_IDLE_TIMEOUT):
+        # the read blocks in the server, it's woken up by the puts of all the
+        # hosts (block=0 means forever in redis)
+        return self._read(max_items, block=int(timeout * 1000) or None)
+
+    @classmethod
+    def get_batch_any(cls, queues, max_items=1, timeout=DEFAULT_IDLE_TIMEOUT):
+        """
+        Get up to `max_items` items of the queues, the items of the first
+        queues go first. All the streams are read with a single XREADGROUP
+        that blocks in the server until any of them has items.
+        Args:
+            queues: the queues in the order of priority.
+            max_items: the maximum quantity of items to get.
+            timeout: the maximum seconds to wait for an item.
+
+        Returns: a list of (queue, item), empty if the timeout expired.
+        """
+        for queue in queues:
+            items = queue._claim_abandoned(max_items)
+            if items:
+                return [(queue, item) for item in items]
+
+        queues_by_stream = {queue.stream: queue for queue in queues}
+        first = queues[0]
+        response = first.client.xreadgroup(
+            first.group,
+            first.consumer,
+            {queue.stream: ">" for queue in queues},
+            count=max_items,
+            block=int(timeout * 1000) or None,
+        )
+
+        batch = []
+        for stream, messages in sorted(response or [], key=lambda r: queues.index(queues_by_stream[_decode(r[0])])):
+            queue = queues_by_stream[_decode(stream)]
+            batch.extend((queue, item) for item in queue._to_items(messages))
+
+        # the count of the read is per stream
+        for queue, item in batch[max_items:]:
+            queue.nack(item)
+        return batch[:max_items]
+
+    def heartbeat(self, item):
+        with self._lock:
+            message_id, _ = self._unacked.get(id(item), (None, None))
+        if not message_id:
+            return False
+
+        pending = self.client.xpending_range(self.stream, self.group, message_id, message_id, 1, self.consumer)
+        if not pending:
+            # another consumer claimed it after the visibility timeout
+            self._take(item)
+            return False
+
+        # claiming our own message resets its idle time
+        self.client.xclaim(self.stream, self.group, self.consumer, 0, [message_id], justid=True)
+        return True
+
+    def _take(self, item):
+        with self._lock:
+            message_id, _ = self._unacked.pop(id(item), (None, None))
+        return message_id
+
+    def _ack(self, item):
+        message_id = self._take(item)
+        if message_id:
+            pipe = self.client.pipeline()
+            pipe.xack(self.stream, self.group, message_id)
+            pipe.xdel(self.stream, message_id)
+            pipe.execute()
+
+    def _ack_failed(self, item):
+        message_id = self._take(item)
+        if message_id:
+            pipe = self.client.pipeline()
+            pipe.xadd(self.failed_stream, {"item": pickle.dumps(item)})
+            pipe.xack(self.stream, self.group, message_id)
+            pipe.xdel(self.stream, message_id)
+            pipe.execute()
+
+    def _nack(self, item):
+        """
+        The message is added again at the end of the stream, the pending
+        messages cannot be given back to the group.
+        """
+        message_id = self._take(item)
+        if message_id:
+            pipe = self.client.pipeline()
+            pipe.xadd(self.stream, {"item": pickle.dumps(item)})
+            pipe.xack(self.stream, self.group, message_id)
+            pipe.xdel(self.stream, message_id)
+            pipe.execute()
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+"""
+Write-behind buffer for the status transitions of the tasks.
+
+The consumers change the status of every task at least twice (IN_PROGRESS and
+FINISHED). Instead of writing every transition as soon as it happens, the
+transitions are coalesced per task and flushed in unlogged batches, grouped
+by partition, when the buffer reaches a size or a time threshold.
+"""
+import logging
+import threading
+
+from davinci_crawling.task.models import STATUS_FAULTY, STATUS_FINISHED, Task, TaskTimeSeries, append_task_event
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    from dse.cqlengine.query import BatchQuery, BatchType
+except ImportError:
+    from cassandra.cqlengine.query import BatchQuery, BatchType
+
+_logger = logging.getLogger("davinci_crawling.queue")
+
+# Flush when we have this quantity of tasks with pending transitions
+DEFAULT_MAX_SIZE = 100
+
+# Flush at least every X seconds
+DEFAULT_MAX_DELAY = 1
+
+# Maximum quantity of statements sent on each batch
+DEFAULT_BATCH_SIZE = 50
+
+# Maximum quantity of tasks whose primary key we keep in memory to avoid
+# reading the task again on every transition
+DEFAULT_KEYS_CACHE_SIZE = 10000
+
+
+def _get_buffer_settings():
+    if hasattr(settings, "DAVINCI_CONF") and "status-buffer" in settings.DAVINCI_CONF.get("architecture-params", {}):
+        return settings.DAVINCI_CONF["architecture-params"]["status-buffer"]
+    return {}
+
+
+class _TaskKeys(object):
+    """
+    The fields of a task that we need to write a transition without reading
+    the task again.
+    """
+
+    __slots__ = ("task_id", "created_at", "kind", "type", "logging_task", "times_performed")
+
+    def __init__(self, task):
+        self.task_id = task.task_id
+        self.created_at = task.created_at
+        self.kind = task.kind
+        self.type = task.type
+        self.logging_task = task.logging_task
+        self.times_performed = task.times_performed or 0
+
+
+class _PendingTransition(object):
+    """
+    The transitions of a task that are waiting to be written, only the last
+    status is written on the task, but all the more_info are kept.
+    """
+
+    __slots__ = ("task_id", "status", "more_info", "times_performed")
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.status = None
+        self.times_performed = None
+        # list of (source, details) to append to the task events
+        self.more_info = []
+
+    def merge(self, newer):
+        """
+        Add the transitions registered after this one, their status wins and
+        their more info goes after ours.
+        """
+        if newer.status is not None:
+            self.status = newer.status
+        if newer.times_performed is not None:
+            self.times_performed = newer.times_performed
+        self.more_info.extend(newer.more_info)
+
+
+class TaskStatusBuffer(object):
+    """
+    Coalesces the status transitions per task and writes them in unlogged
+    batches grouped by partition.
+
+    The buffer is thread safe and is meant to be shared by all the consumer
+    threads of a process. Call `start` to flush periodically in background and
+    `stop` to flush synchronously what is pending on shutdown.
+    """
+
+    def __init__(self, max_size=None, max_delay=None, batch_size=None, keys_cache_size=DEFAULT_KEYS_CACHE_SIZE):
+        """
+        Args:
+            max_size: quantity of tasks with pending transitions that forces a
+            flush.
+            max_delay: maximum seconds that a transition waits to be written.
+            batch_size: maximum quantity of statements per batch.
+            keys_cache_size: quantity of task keys kept in memory.
+        """
+        buffer_settings = _get_buffer_settings()
+        self.max_size = max_size or buffer_settings.get("max-size", DEFAULT_MAX_SIZE)
+        self.max_delay = max_delay or buffer_settings.get("max-delay", DEFAULT_MAX_DELAY)
+        self.batch_size = batch_size or buffer_settings.get("batch-size", DEFAULT_BATCH_SIZE)
+        self.keys_cache_size = keys_cache_size
+
+        self._pending = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = None
+
+    def start(self):
+        """
+        Start the background thread that flushes the buffer every `max_delay`
+        seconds.
+        """
+        self._stopped.clear()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        """
+        Stop the background thread and flush synchronously all the pending
+        transitions.
+        """
+        self._stopped.set()
+        if self._flusher:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.max_delay):
+            try:
+                self.flush()
+            except Exception:
+                _logger.exception("Error while flushing the task status buffer")
+
+    def _remember_keys(self, task):
+        if len(self._keys) >= self.keys_cache_size:
+            # drop the oldest half, tasks are only updated while they are
+            # being crawled, old keys will not be used again.
+            for task_id in list(self._keys)[: self.keys_cache_size // 2]:
+                del self._keys[task_id]
+        self._keys[task.task_id] = _TaskKeys(task)
+
+    def add(self, task, status, source=None, more_info=None):
+        """
+        Register a status transition of a task. The transition will be
+        written on the next flush.
+        Args:
+            task: the task that should be updated, can be either a django
+            model or a UUID for the task.
+            status: the status that we want to put the task on.
+            source: from where the update task status was called.
+            more_info: more info about the status that is being reported.
+        """
+        should_flush = False
+        with self._lock:
+            if isinstance(task, Task):
+                self._remember_keys(task)
+                task_id = task.task_id
+            else:
+                task_id = task
+
+            pending = self._pending.get(task_id)
+            if not pending:
+                pending = self._pending[task_id] = _PendingTransition(task_id)
+            pending.status = status
+            if more_info:
+                pending.more_info.append((source, more_info))
+            if status in (STATUS_FINISHED, STATUS_FAULTY) and task_id in self._keys:
+                # the next run of the task (ex. in another process that
+                # has the keys cached) counts its attempts from the start
+                self._keys[task_id].times_performed = 0
+
+            should_flush = len(self._pending) >= self.max_size
+
+        if should_flush:
+            try:
+                self.flush()
+            except Exception:
+                # the transitions stay in the buffer for the next flush, the
+                # error is not an error of the task that is being reported
+                _logger.exception("Error while flushing the task status buffer")
+
+    def add_attempt(self, task):
+        """
+        Count a new attempt to perform a task, the counter is written in the
+        `times_performed` of the task on the next flush.
+        Args:
+            task: the task that is going to be performed, can be either a
+            django model or a UUID for the task.
+
+        Returns: the number of the attempt, starting by 1.
+        """
+        if isinstance(task, Task):
+            with self._lock:
+                self._remember_keys(task)
+            task_id = task.task_id
+        else:
+            task_id = task
+            if task_id not in self._keys:
+                self._load_missing_tasks([task_id])
+
+        with self._lock:
+            keys = self._keys.get(task_id)
+            if not keys:
+                return 1
+            keys.times_performed += 1
+
+            pending = self._pending.get(task_id)
+            if not pending:
+                pending = self._pending[task_id] = _PendingTransition(task_id)
+            pending.times_performed = keys.times_performed
+            return keys.times_performed
+
+    def reset_attempts(self, task):
+        """
+        Start again the count of attempts of a task that is queued for a new
+        run, the counter is written on the next flush.
+        Args:
+            task: the task that is going to be queued.
+        """
+        with self._lock:
+            self._remember_keys(task)
+            keys = self._keys[task.task_id]
+            if not keys.times_performed:
+                return
+            keys.times_performed = 0
+
+            pending = self._pending.get(task.task_id)
+            if not pending:
+                pending = self._pending[task.task_id] = _PendingTransition(task.task_id)
+            pending.times_performed = 0
+
+    def flush(self):
+        """
+        Write all the pending transitions.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+
+            if not pending:
+                return
+
+            try:
+                self._load_missing_tasks(pending)
+                with self._lock:
+                    transitions = [
+                        (self._keys[task_id], transition)
+                        for task_id, transition in pending.items()
+                        if task_id in self._keys
+                    ]
+                write_task_transitions(transitions, batch_size=self.batch_size)
+            except Exception:
+                # give the transitions back to the buffer to retry them on the
+                # next flush, merged with the ones that arrived meanwhile.
+                with self._lock:
+                    for task_id, transition in pending.items():
+                        newer = self._pending.get(task_id)
+                        if newer:
+                            transition.merge(newer)
+                        self._pending[task_id] = transition
+                raise
+
+    def _load_missing_tasks(self, pending):
+        """
+        Read in a single query all the tasks that we don't know the primary
+        key.
+        """
+        to_read = [task_id for task_id in pending if task_id not in self._keys]
+        if not to_read:
+            return
+
+        for task in Task.objects.filter(task_id__in=to_read).all():
+            with self._lock:
+                self._remember_keys(task)
+
+        for task_id in to_read:
+            if task_id not in self._keys:
+                _logger.error("Not found task %s, discarding its status transition", task_id)
+
+
+def write_task_transitions(transitions, batch_size=DEFAULT_BATCH_SIZE, batch_type=BatchType.Unlogged):
+    """
+    Write the status of a group of tasks and their time series rows. The
+    statements are grouped by partition: the update of a task goes with its
+    events (both in the partition of the task), and the time series rows
+    share the same bucket and go together in batches of `batch_size`
+    statements.
+    Args:
+        transitions: a list of (_TaskKeys, _PendingTransition) tuples.
+        batch_size: the maximum quantity of time series rows per batch.
+        batch_type: the type of batch to use.
+    """
+    now = timezone.now()
+    for keys, transition in transitions:
+        batch = BatchQuery(batch_type=batch_type, consistency=Task._cassandra_consistency_level_write)
+        values = {"updated_at": keys.created_at if keys.logging_task else now}
+        if transition.status is not None:
+            values["status"] = transition.status
+        if transition.times_performed is not None:
+            values["times_performed"] = transition.times_performed
+        Task.objects.filter(task_id=keys.task_id, created_at=keys.created_at).batch(batch).update(**values)
+        for source, details in transition.more_info:
+            append_task_event(keys.task_id, source, details, batch=batch)
+        batch.execute()
+
+    with_status = [(keys, transition) for keys, transition in transitions if transition.status is not None]
+    for start in range(0, len(with_status), batch_size):
+        batch = BatchQuery(batch_type=batch_type, consistency=Task._cassandra_consistency_level_write)
+        for keys, transition in with_status[start : start + batch_size]:
+            TaskTimeSeries(task_id=keys.task_id, type=keys.type, kind=keys.kind, status=transition.status).batch(
+                batch
+            ).save()
+        batch.execute()
+
+    _logger.debug("Written the status of %d tasks", len(transitions))
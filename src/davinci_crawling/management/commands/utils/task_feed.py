@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+"""
+Incremental feed of the tasks that are waiting to be crawled.
+
+Instead of scanning the whole `davinci_task_2` table looking for tasks with
+the CREATED status, the feed reads the `davinci_task_ts` minute buckets
+written since the last poll. The position of the feed (high-water mark) is
+persisted as a checkpoint so it survives restarts.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from davinci_crawling.io import get_checkpoint_data, put_checkpoint_data
+from davinci_crawling.task.models import Task, TaskTimeSeries, STATUS_CREATED
+from django.utils import timezone
+
+_logger = logging.getLogger("davinci_crawling.commands")
+
+BUCKET_FORMAT = "%y%m%d%H%M"
+
+TASK_FEED_CTL_SOURCE = "davinci_crawling"
+TASK_FEED_CTL_KEY = "task_feed"
+HIGH_WATER_MARK_CTL_FIELD = "high_water_mark"
+
+# How far back we re-read on every poll to tolerate clock skew between the
+# hosts that write the tasks, the tasks re-read are discarded because they
+# are not in the CREATED status anymore.
+DEFAULT_OVERLAP_SECONDS = 60
+
+# If the feed has been stopped for longer than this a full scan of the task
+# table is cheaper than walking all the minute buckets.
+DEFAULT_MAX_CATCH_UP_MINUTES = 24 * 60
+
+
+class TaskFeed(object):
+    """
+    Reads the tasks created since the last poll from the TaskTimeSeries
+    minute buckets.
+
+    The first poll (no high-water mark persisted yet) and any poll after a
+    long stop fall back to a full scan of the CREATED tasks to pick up the
+    backlog.
+    """
+
+    def __init__(
+        self,
+        overlap_seconds=DEFAULT_OVERLAP_SECONDS,
+        max_catch_up_minutes=DEFAULT_MAX_CATCH_UP_MINUTES,
+        ctl_key=TASK_FEED_CTL_KEY,
+    ):
+        """
+        Args:
+            overlap_seconds: seconds before the high-water mark that are
+            re-read on every poll.
+            max_catch_up_minutes: maximum quantity of minute buckets to walk
+            before falling back to a full scan.
+            ctl_key: the key of the checkpoint used to persist the feed
+            position.
+        """
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.max_catch_up_minutes = max_catch_up_minutes
+        self.ctl_key = ctl_key
+        self.high_water_mark = self._load_high_water_mark()
+        self._pending_high_water_mark = None
+
+    def _load_high_water_mark(self):
+        checkpoint_data = get_checkpoint_data(TASK_FEED_CTL_SOURCE, self.ctl_key, default={})
+        high_water_mark = checkpoint_data.get(HIGH_WATER_MARK_CTL_FIELD)
+        if not high_water_mark:
+            return None
+
+        return timezone.make_aware(datetime.strptime(high_water_mark, "%Y-%m-%dT%H:%M:%S.%f"), timezone.utc)
+
+    def _save_high_water_mark(self, high_water_mark):
+        self.high_water_mark = high_water_mark
+        put_checkpoint_data(
+            TASK_FEED_CTL_SOURCE,
+            self.ctl_key,
+            {HIGH_WATER_MARK_CTL_FIELD: high_water_mark.strftime("%Y-%m-%dT%H:%M:%S.%f")},
+        )
+
+    @staticmethod
+    def _full_scan():
+        _logger.debug("Scanning all the tasks with status CREATED")
+        return list(Task.objects.filter(status=STATUS_CREATED).all())
+
+    @staticmethod
+    def _buckets(since, until):
+        """
+        All the minute buckets between `since` and `until` (both included).
+        """
+        current = since.replace(second=0, microsecond=0)
+        while current <= until:
+            yield datetime.strftime(current, BUCKET_FORMAT)
+            current += timedelta(minutes=1)
+
+    def _read_buckets(self, since, until):
+        task_ids = []
+        seen = set()
+        for bucket in self._buckets(since, until):
+            for task_ts in TaskTimeSeries.objects.filter(bucket=bucket, ts__gte=since).all():
+                if task_ts.status != STATUS_CREATED or task_ts.task_id in seen:
+                    continue
+                seen.add(task_ts.task_id)
+                task_ids.append(task_ts.task_id)
+
+        tasks = []
+        for task_id in task_ids:
+            # the task could have been queued already by a previous poll (or
+            # another poller), only the ones that are still CREATED are new.
+            task = Task.objects.filter(task_id=task_id).first()
+            if task and task.status == STATUS_CREATED:
+                tasks.append(task)
+
+        return tasks
+
+    def poll(self):
+        """
+        Get the new tasks with the CREATED status since the last poll. The
+        high-water mark is only advanced when `commit` is called, after the
+        tasks have been queued.
+
+        Returns: a list of Task objects.
+        """
+        now = timezone.now()
+
+        if not self.high_water_mark:
+            _logger.info("No high-water mark found for the task feed, doing a full scan")
+            tasks = self._full_scan()
+        else:
+            since = self.high_water_mark - self.overlap
+            if now - since > timedelta(minutes=self.max_catch_up_minutes):
+                _logger.info("Task feed stopped since %s, doing a full scan", self.high_water_mark)
+                tasks = self._full_scan()
+            else:
+                tasks = self._read_buckets(since, now)
+
+        self._pending_high_water_mark = now
+
+        return tasks
+
+    def commit(self):
+        """
+        Persist the position reached by the last poll.
+        """
+        if self._pending_high_water_mark:
+            self._save_high_water_mark(self._pending_high_water_mark)
+            self._pending_high_water_mark = None
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+"""
+The queue between the tasks poller and the crawl consumers.
+
+The queue implementation is pluggable, it's configured in the "queue"
+section of the architecture-params:
+
+- SQLiteTasksQueue: a persistent queue in a local SQLite file (default), it
+  can be shared by the processes of one host.
+- MemoryTasksQueue: a queue in the memory of the process, for tests and
+  benchmarks.
+- RedisTasksQueue: a Redis stream with a consumer group, it can be shared by
+  the crawlers of several hosts.
+
+All the threads of a process share a single handle of the queue. The
+consumers block on a condition that is notified every time a task is put,
+instead of polling the queue.
+
+The tasks taken from the queue are leased to their consumer for
+`visibility-timeout` seconds, the consumer should extend the lease
+(`heartbeat`) while it's working on the task. The tasks with an expired lease
+(ex. their consumer died or hung) are delivered again: the SQLite queue
+stores the lease with the task, the Redis queue uses the idle time of the
+pending messages.
+"""
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+from davinci_crawling.utils import get_class_from_name
+from django.conf import settings
+from persistqueue import SQLiteAckQueue
+from persistqueue.exceptions import Empty
+
+_logger = logging.getLogger("davinci_crawling.queue")
+
+QUEUE_LOCATION = "tasks_queue"
+
+DEFAULT_QUEUE_IMPLEMENTATION = "davinci_crawling.management.commands.utils.tasks_queue.SQLiteTasksQueue"
+
+# The file of the SQLiteTasksQueue in its location, and the file of the
+# persist-queue SQLiteAckQueue used by the previous versions
+SQLITE_FILE_NAME = "tasks.db"
+PERSIST_QUEUE_FILE_NAME = "data.db"
+
+# The status of the items of the SQLiteTasksQueue, the acked items are
+# deleted
+_SQLITE_READY = 1
+_SQLITE_LEASED = 2
+_SQLITE_FAILED = 3
+
+# Maximum seconds that an idle consumer waits before looking at the queue
+# again, the tasks put by other processes are not notified.
+DEFAULT_IDLE_TIMEOUT = 1
+
+# Seconds that a task taken from the queue can go without a heartbeat before
+# it's delivered to another consumer
+DEFAULT_VISIBILITY_TIMEOUT = 600
+
+
+def get_queue_settings():
+    if hasattr(settings, "DAVINCI_CONF") and "queue" in settings.DAVINCI_CONF.get("architecture-params", {}):
+        return settings.DAVINCI_CONF["architecture-params"]["queue"]
+    return {}
+
+
+class TasksQueue(ABC):
+    """
+    Thread safe queue of tasks with acknowledgements, the items taken from
+    the queue should be acked (processed), acked as failed or nacked (given
+    back to the queue).
+
+    The items are identified by the object returned by `get_batch`, the same
+    object should be used to ack it.
+    """
+
+    # True if the queue can be shared by several processes
+    multiprocess = True
+
+    # True if the reads block in the server and are woken up by the puts of
+    # all the processes, the lanes read all their queues with `get_batch_any`
+    blocking_reads = False
+
+    def __init__(self, location=QUEUE_LOCATION, visibility_timeout=None):
+        """
+        Args:
+            location: the location of the queue (file, key, ...).
+            visibility_timeout: seconds that a task can go without a
+            heartbeat (see `heartbeat`).
+        """
+        self.location = location
+        self.visibility_timeout = visibility_timeout or get_queue_settings().get(
+            "visibility-timeout", DEFAULT_VISIBILITY_TIMEOUT
+        )
+        self._condition = threading.Condition()
+
+    def put(self, item):
+        self._put(item)
+        self._notify()
+
+    def _notify(self):
+        with self._condition:
+            self._condition.notify()
+
+    def get_batch(self, max_items=1, timeout=DEFAULT_IDLE_TIMEOUT):
+        """
+        Get up to `max_items` items, blocking until there is at least one.
+        Args:
+            max_items: the maximum quantity of items to get.
+            timeout: the maximum seconds to wait for an item.
+
+        Returns: a list with the items, empty if the timeout expired.
+        """
+        return self._get_batch(max_items, timeout)
+
+    def _get_batch(self, max_items, timeout):
+        items = self._pop(max_items)
+        if items or not timeout:
+            return items
+
+        with self._condition:
+            # a put could have happened between the pop and the wait
+            items = self._pop(max_items)
+            if not items:
+                self._condition.wait(timeout)
+
+        return items or self._pop(max_items)
+
+    @abstractmethod
+    def heartbeat(self, item):
+        """
+        Extend the lease of an item.
+
+        Returns: False if the lease was lost, the item could be delivered to
+        another consumer.
+        """
+        pass
+
+    def resume_abandoned(self):
+        """
+        Give back to the queue the items leased to the consumers of the
+        previous run, called by the crawl process when it starts.
+        """
+        pass
+
+    def ack(self, item):
+        self._ack(item)
+
+    def ack_failed(self, item):
+        self._ack_failed(item)
+
+    def nack(self, item):
+        self._nack(item)
+
+    @abstractmethod
+    def _put(self, item):
+        pass
+
+    @abstractmethod
+    def _pop(self, max_items):
+        """
+        Get up to `max_items` items without blocking.
+        """
+        pass
+
+    @abstractmethod
+    def _ack(self, item):
+        pass
+
+    @abstractmethod
+    def _ack_failed(self, item):
+        pass
+
+    @abstractmethod
+    def _nack(self, item):
+        pass
+
+
+class SQLiteTasksQueue(TasksQueue):
+    """
+    Persistent queue in a SQLite file, it can be shared by the processes of a
+    host. Every item taken is leased until `visibility_timeout` seconds after
+    its last heartbeat, the token and the expiration of the lease are stored
+    with the item, and the items with an expired lease (ex. their consumer
+    died or hung) are delivered again.
+    """
+
+    def __init__(self, location=QUEUE_LOCATION, visibility_timeout=None):
+        super().__init__(location, visibility_timeout)
+        os.makedirs(location, exist_ok=True)
+        self.path = os.path.join(location, SQLITE_FILE_NAME)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # id(item) -> (row id, lease token)
+        self._unacked = {}
+
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, data BLOB NOT NULL,"
+            " status INTEGER NOT NULL, lease_token TEXT, leased_until REAL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id)")
+        self._import_persist_queue()
+
+    def _connection(self):
+        # the connections cannot be shared by the threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        return connection
+
+    def _import_persist_queue(self):
+        """
+        Move the items of the queue written by the previous versions (a
+        SQLiteAckQueue of persist-queue in the same location).
+        """
+        if not os.path.exists(os.path.join(self.location, PERSIST_QUEUE_FILE_NAME)):
+            return
+        legacy_queue = SQLiteAckQueue(self.location, multithreading=True, auto_resume=True)
+        imported = 0
+        while True:
+            try:
+                item = legacy_queue.get(block=False)
+            except Empty:
+                break
+            self._put(item)
+            legacy_queue.ack(item)
+            imported += 1
+        if imported:
+            _logger.info("Imported %d tasks of the queue %s", imported, self.location)
+
+    def _put(self, item):
+        self._connection().execute(
+            "INSERT INTO tasks (data, status) VALUES (?, ?)", (pickle.dumps(item), _SQLITE_READY)
+        )
+
+    def _pop(self, max_items):
+        now = time.time()
+        lease_token = uuid.uuid4().hex
+        connection = self._connection()
+        # the items are taken in a write transaction, two processes cannot
+        # take the same item
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute(
+                "SELECT id, data, status FROM tasks WHERE status = ? OR (status = ? AND leased_until <= ?)"
+                " ORDER BY id LIMIT ?",
+                (_SQLITE_READY, _SQLITE_LEASED, now, max_items),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE tasks SET status = ?, lease_token = ?, leased_until = ? WHERE id = ?",
+                [(_SQLITE_LEASED, lease_token, now + self.visibility_timeout, row_id) for row_id, _, _ in rows],
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        items = []
+        with self._lock:
+            for row_id, data, status in rows:
+                item = pickle.loads(data)
+                if status == _SQLITE_LEASED:
+                    _logger.warning("The lease of the task %s expired, delivering it again", item)
+                self._unacked[id(item)] = (row_id, lease_token)
+                items.append(item)
+        return items
+
+    def _update_leased(self, item, statement, parameters=(), keep=False):
+        """
+        Execute a statement on the row of an item, only if the item is still
+        leased with the token of its delivery.
+
+        Returns: False if the lease was lost (it expired and another consumer
+        took the item).
+        """
+        with self._lock:
+            if keep:
+                row_id, lease_token = self._unacked.get(id(item), (None, None))
+            else:
+                row_id, lease_token = self._unacked.pop(id(item), (None, None))
+        if row_id is None:
+            return False
+        cursor = self._connection().execute(
+            statement + " WHERE id = ? AND status = ? AND lease_token = ?",
+            tuple(parameters) + (row_id, _SQLITE_LEASED, lease_token),
+        )
+        if not cursor.rowcount:
+            with self._lock:
+                self._unacked.pop(id(item), None)
+            return False
+        return True
+
+    def heartbeat(self, item):
+        return self._update_leased(
+            item, "UPDATE tasks SET leased_until = ?", (time.time() + self.visibility_timeout,), keep=True
+        )
+
+    def _ack(self, item):
+        self._update_leased(item, "DELETE FROM tasks")
+
+    def _ack_failed(self, item):
+        self._update_leased(item, "UPDATE tasks SET status = ?", (_SQLITE_FAILED,))
+
+    def _nack(self, item):
+        # the item keeps its turn
+        if self._update_leased(item, "UPDATE tasks SET status = ?, lease_token = NULL", (_SQLITE_READY,)):
+            self._notify()
+
+    def resume_abandoned(self):
+        # the consumer processes of the host are started by this process, the
+        # items leased to the processes of the previous run are abandoned
+        self._connection().execute(
+            "UPDATE tasks SET status = ?, lease_token = NULL WHERE status = ?", (_SQLITE_READY, _SQLITE_LEASED)
+        )
+        self._notify()
+
+
+_lock = threading.Lock()
+_tasks_queues = {}
+_queue_clazz = None
+
+
+def get_queue_clazz():
+    global _queue_clazz
+    if not _queue_clazz:
+        _queue_clazz = get_class_from_name(get_queue_settings().get("implementation", DEFAULT_QUEUE_IMPLEMENTATION))
+    return _queue_clazz
+
+
+def get_tasks_queue(location=None):
+    """
+    The handle of the queue shared by all the threads of the process.
+    Args:
+        location: the location of the queue, by default the "location" of
+        the queue settings or `QUEUE_LOCATION`.
+    """
+    location = location or get_queue_settings().get("location", QUEUE_LOCATION)
+    with _lock:
+        tasks_queue = _tasks_queues.get(location)
+        if not tasks_queue:
+            tasks_queue = _tasks_queues[location] = get_queue_clazz()(location)
+    return tasks_queue
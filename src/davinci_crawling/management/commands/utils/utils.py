@@ -6,22 +6,12 @@ Some utils used by the davinci_crawling commands.
 from davinci_crawling.utils import CrawlersRegistry
 from davinci_crawling.task.models import (
     Task,
-    TaskMoreInfo,
     update_davinci_task_model_batch,
 )
-from django.utils import timezone
 
 cached_crawlers = {}
 
 
-def append_more_info(task, source, more_info):
-    if not task.more_info:
-        return [TaskMoreInfo(**{"source": source, "created_at": timezone.now(), "details": more_info})]
-
-    task.more_info.append(TaskMoreInfo(**{"source": source, "created_at": timezone.now(), "details": more_info}))
-    return task.more_info
-
-
 def update_task_status(task, status, source=None, more_info=None):
     """
     Get a task td to change the status on the DB.
@@ -40,15 +30,10 @@ def update_task_status(task, status, source=None, more_info=None):
         raise Exception("Not found task")
 
     task.status = status
-    if more_info:
-        # TODO: find a better way to deal with this frozen update on collection
-        tmp_more_info = task.more_info
-        task.more_info = None
-        task.save()
-        task.more_info = tmp_more_info
-        task.more_info = append_more_info(task, source, more_info)
+    # the more info is appended to the task events on the same batch
+    events = [(source, more_info)] if more_info else None
 
-    task = update_davinci_task_model_batch(task)
+    task = update_davinci_task_model_batch(task, events=events)
 
     return task
 
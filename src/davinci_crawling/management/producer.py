@@ -15,3 +15,11 @@ class Producer(metaclass=ABCMeta):
     @abc.abstractmethod
     def add_crawl_params(self, param, options):
         raise NotImplementedError()
+
+    def add_crawl_params_bulk(self, params, options):
+        """
+        Add several crawl params at once, the producers that can write them
+        together should override this method.
+        """
+        for param in params:
+            self.add_crawl_params(param, options)
@@ -6,7 +6,10 @@ import requests
 import logging
 import cgi
 import os
-import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 
 from time import sleep
 
@@ -15,7 +18,9 @@ from requests.exceptions import RequestException
 from bs4 import BeautifulSoup
 
 from davinci_crawling.exceptions import DownloadException
-from davinci_crawling.io import copy_file
+from davinci_crawling.storage.storage import TeeWriter, get_storage
+from django.conf import settings
+from requests.adapters import HTTPAdapter
 
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.support.wait import WebDriverWait
@@ -49,6 +54,156 @@ HTTP_INTERNAL_SERVER_ERROR = 500
 
 HTTP_INTERNAL_ERROR = 999
 
+# Sessions (one per proxy) kept alive
+DEFAULT_MAX_SESSIONS = 50
+# Connections kept alive per host on every session
+DEFAULT_MAX_CONNECTIONS_PER_PROXY = 10
+# Seconds that a session can be idle before being closed
+DEFAULT_SESSION_IDLE_TIMEOUT = 300
+
+
+def _get_sessions_settings():
+    if hasattr(settings, "DAVINCI_CONF") and "http-sessions" in settings.DAVINCI_CONF.get("architecture-params", {}):
+        return settings.DAVINCI_CONF["architecture-params"]["http-sessions"]
+    return {}
+
+
+class SessionPool(object):
+    """
+    Bounded LRU pool of `requests.Session` keyed by the proxy endpoint. The
+    sessions keep the connections (and the CONNECT tunnels to the proxy)
+    alive between requests.
+    """
+
+    def __init__(self, max_sessions=None, max_connections_per_proxy=None, idle_timeout=None):
+        """
+        Args:
+            max_sessions: maximum quantity of sessions (proxies) in the pool,
+            the least recently used session is closed when we reach it.
+            max_connections_per_proxy: connections kept alive per host on
+            every session.
+            idle_timeout: seconds that a session can be unused before being
+            closed.
+        """
+        sessions_settings = _get_sessions_settings()
+        self.max_sessions = max_sessions or sessions_settings.get("max-sessions", DEFAULT_MAX_SESSIONS)
+        self.max_connections_per_proxy = max_connections_per_proxy or sessions_settings.get(
+            "max-connections-per-proxy", DEFAULT_MAX_CONNECTIONS_PER_PROXY
+        )
+        self.idle_timeout = idle_timeout or sessions_settings.get("idle-timeout", DEFAULT_SESSION_IDLE_TIMEOUT)
+
+        # proxy endpoint -> [session, last time used, quantity of users],
+        # from the least to the most recently used
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_key(proxy_address):
+        if not proxy_address:
+            return None
+        return proxy_address.get("https", proxy_address.get("http"))
+
+    def _new_session(self, proxy_address):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.max_connections_per_proxy, pool_maxsize=self.max_connections_per_proxy
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.verify = False
+        if proxy_address:
+            session.proxies.update(proxy_address)
+        return session
+
+    def _evict(self, now):
+        """
+        Close the sessions idle for more than `idle_timeout` and the least
+        recently used ones while there are more than `max_sessions`. The
+        sessions in use are never closed.
+        """
+        exceeding = len(self._sessions) - self.max_sessions
+        for key, (session, last_used, users) in list(self._sessions.items()):
+            if users:
+                continue
+            if exceeding <= 0 and now - last_used < self.idle_timeout:
+                break
+            del self._sessions[key]
+            session.close()
+            exceeding -= 1
+
+    def _acquire(self, proxy_address):
+        key = self._get_key(proxy_address)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry:
+                self._sessions.move_to_end(key)
+            else:
+                entry = self._sessions[key] = [self._new_session(proxy_address), now, 0]
+            entry[1] = now
+            entry[2] += 1
+            self._evict(now)
+            return key, entry[0]
+
+    def _release(self, key):
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry:
+                entry[1] = time.monotonic()
+                entry[2] -= 1
+                self._sessions.move_to_end(key)
+
+    @contextmanager
+    def session(self, proxy_address):
+        """
+        Use the session of the proxy address, the session is not closed by
+        the pool while it's in use (ex. while a response is streamed).
+        Args:
+            proxy_address: the proxies dict returned by `get_proxy_address`.
+
+        Returns: a context manager with the requests.Session
+        """
+        key, session = self._acquire(proxy_address)
+        try:
+            yield session
+        finally:
+            self._release(key)
+
+    def request(self, proxy_address, method, *args, **kwargs):
+        """
+        Send a request (not streamed) with the session of the proxy address.
+        Args:
+            proxy_address: the proxies dict returned by `get_proxy_address`.
+            method: the name of the method of the session (get, post, ...).
+
+        Returns: the requests.Response
+        """
+        with self.session(proxy_address) as session:
+            return getattr(session, method)(*args, **kwargs)
+
+    def get_session(self, proxy_address):
+        """
+        Get the session to use with the proxy address. The pool doesn't know
+        when the session stops being used, use `session` or `request` to
+        keep it open while it's used.
+        Args:
+            proxy_address: the proxies dict returned by `get_proxy_address`.
+
+        Returns: a requests.Session
+        """
+        key, session = self._acquire(proxy_address)
+        self._release(key)
+        return session
+
+    def close(self):
+        with self._lock:
+            for session, _, _ in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+session_pool = SessionPool()
+
 
 class Page(object):
     def __init__(self, status, body, response=None):
@@ -58,12 +213,27 @@ class Page(object):
 
 
 class File(object):
-    def __init__(self, status, file, filename, response=None):
+    def __init__(self, status, file, filename, response=None, cache_file=None, checksum=None):
 
         self.status = status
         self.file = file
         self.filename = filename
         self.response = response
+        # the URI of the copy in the permanent storage, if any
+        self.cache_file = cache_file
+        # the hex MD5 of the content
+        self.checksum = checksum
+
+
+def get_download_destinations(options, filename):
+    """
+    The URIs where a downloaded file is written: the `base_path` of the
+    options and, if they have one, the `cache_path`.
+    """
+    dest_file = "{0}/{1}".format(options.get("base_path", "."), filename)
+    cache_path = options.get("cache_path", None)
+    cache_file = "{0}/{1}".format(cache_path, filename) if cache_path else None
+    return dest_file, cache_file
 
 
 def delete_json(url, timeout=None):
@@ -82,7 +252,9 @@ def delete_json(url, timeout=None):
 
         proxy_address = get_proxy_address()
 
-        return requests.delete(
+        return session_pool.request(
+            proxy_address,
+            "delete",
             url=url,
             headers={**APPLICATION_JSON, **USER_AGENT},
             timeout=(timeout, timeout),
@@ -118,7 +290,15 @@ def get_json(url, timeout=None, custom_header=None, use_proxy=True):
 
         proxy_address = get_proxy_address() if use_proxy else {}
 
-        return requests.get(url=url, headers=header, timeout=(timeout, timeout), verify=False, proxies=proxy_address)
+        return session_pool.request(
+            proxy_address,
+            "get",
+            url=url,
+            headers=header,
+            timeout=(timeout, timeout),
+            verify=False,
+            proxies=proxy_address,
+        )
     except RequestException as ex:
         logger.exception("Unable to send the POST. Cause: %s" % ex)
         raise ex
@@ -141,8 +321,15 @@ def post_json(url, json_obj, timeout=None, use_proxy=True, custom_header=None):
         if custom_header:
             header.update(custom_header)
 
-        return requests.post(
-            url=url, data=json_body, headers=header, timeout=(timeout, timeout), verify=False, proxies=proxy_address,
+        return session_pool.request(
+            proxy_address,
+            "post",
+            url=url,
+            data=json_body,
+            headers=header,
+            timeout=(timeout, timeout),
+            verify=False,
+            proxies=proxy_address,
         )
     except RequestException as ex:
         logger.exception("Unable to send the POST. Cause: %s" % ex)
@@ -160,7 +347,9 @@ def post_form(url, json_obj, timeout=None):
 
         proxy_address = get_proxy_address()
 
-        return requests.post(
+        return session_pool.request(
+            proxy_address,
+            "post",
             url=url,
             data=json_obj,
             headers={**APPLICATION_FORM, **USER_AGENT},
@@ -179,7 +368,9 @@ def fetch_page(url, timeout):
     """
     logger.info("Fetching page for %s" % url)
     proxy_address = get_proxy_address()
-    return requests.get(url, headers=USER_AGENT, timeout=(timeout, timeout), verify=False, proxies=proxy_address)
+    return session_pool.request(
+        proxy_address, "get", url, headers=USER_AGENT, timeout=(timeout, timeout), verify=False, proxies=proxy_address
+    )
 
 
 def parse_json(s):
@@ -275,11 +466,21 @@ def __content_error(status):
 
 
 def fetch_file(url, options):
-    with tempfile.TemporaryDirectory() as temp_path:
-        logger.info("Download from [%s] and store into [%s]" % (url, temp_path))
-        try:
-            proxy_address = get_proxy_address()
-            response = requests.get(url, stream=True, timeout=(1800, 1800), verify=False, proxies=proxy_address)
+    """
+    Download a file into the `base_path` folder of the options and, if the
+    options have a `cache_path`, into that folder too (ex. the permanent
+    storage in GCS). The body of the response is streamed to all the
+    destinations in a single pass, without temporary files, and the
+    destinations only get the file if the whole download succeeds.
+
+    Returns: a `File` with the path of the file (its URI if the `base_path`
+    is not local), the URI of the cached copy and the MD5 of the content.
+    """
+    try:
+        proxy_address = get_proxy_address()
+        # the session is in use until the whole body is read
+        with session_pool.session(proxy_address) as session:
+            response = session.get(url, stream=True, timeout=(1800, 1800), verify=False, proxies=proxy_address)
 
             params = cgi.parse_header(response.headers.get("Content-Disposition", ""))[-1]
             if "filename" in params:
@@ -288,25 +489,26 @@ def fetch_file(url, options):
                 filename = url.rpartition("/")[2]
 
             filename = os.path.basename(filename)
-            abs_path = os.path.join(temp_path, filename)
 
             status = response.status_code
             response = response if status == HTTP_OK else __content_error(status)
 
-            with open(abs_path, "wb") as f:
+            dest_file, cache_file = get_download_destinations(options, filename)
+            logger.info(
+                "Download from [%s] and store into [%s]" % (url, ", ".join(filter(None, [dest_file, cache_file])))
+            )
+
+            with TeeWriter(filter(None, [dest_file, cache_file]), options) as f:
                 for chunk in response.iter_content(chunk_size=1024 * 1024):
                     if chunk:
                         f.write(chunk)
 
-            base_path = options.get("base_path", ".")
+        dest_file = get_storage(dest_file, options).local_path(dest_file) or dest_file
 
-            dest_file = "{0}/{1}".format(base_path, filename)
-            dest_file = copy_file(options, abs_path, dest_file)
-
-            return File(status, dest_file, filename, response)
-        except Exception as ex:
-            logger.exception("Failed to download %s" % url)
-            raise DownloadException(url) from ex
+        return File(status, dest_file, filename, response, cache_file=cache_file, checksum=f.checksum)
+    except Exception as ex:
+        logger.exception("Failed to download %s" % url)
+        raise DownloadException(url) from ex
 
 
 def get_proxy_address():
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) 2019 BuildGroup Data Services Inc.
-import copy
 import logging
 import random
 import time
@@ -182,4 +181,5 @@ class ProxyMesh(Proxy):
 
         proxy = random.choice(proxies[0:quality_proxy_quantities])
         _logger.debug("Using %s proxy", proxy["http"])
-        return copy.deepcopy(proxy)
+        # the proxy dict only has strings, a shallow copy is enough
+        return dict(proxy)
@@ -144,6 +144,8 @@ class Common(Configuration):
                 "chromium_bin_file": CHROMIUM_BIN_FILE,
                 "io_gs_project": "centering-badge-212119",
             },
+            # add a "lane" to run the tasks of a crawler in their own queues
+            # and workers, ex. "lane": {"workers_num": 2}
             "bovespa": {"companies_listing_update_elapsetime": 30, "companies_files_update_elapsetime": 30},
         },
         "architecture-params": {
@@ -158,6 +160,24 @@ class Common(Configuration):
                 "proxies-availability-checker": {"elapse-time-between-checks": 60},
             },
             "parallelism": {"multiproc": {"default_num_workers": 10}},
+            # the queue between the tasks poller and the consumers, the
+            # RedisTasksQueue can be shared by the crawlers of several hosts
+            "queue": {
+                "implementation": "davinci_crawling.management.commands.utils.tasks_queue." "SQLiteTasksQueue",
+                "location": "tasks_queue",
+                # seconds that a task is leased to a consumer without a
+                # heartbeat, after that it's delivered again
+                "visibility-timeout": 600,
+            },
+            "chrome-profile": {
+                # the images and fonts are not needed by the crawlers that
+                # only read the html, but some pages need them to render
+                "disable-images": False,
+                "disable-fonts": False,
+                "disable-extensions": True,
+                # ex. ["*google-analytics.com*", "*doubleclick.net*"]
+                "blocked-urls": [],
+            },
         },
     }
 
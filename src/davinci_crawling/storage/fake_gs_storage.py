@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+import os
+import tempfile
+
+from davinci_crawling.storage.fs_storage import TEMP_SUFFIX, FileSystemStorage
+from davinci_crawling.storage.storage import get_storage_settings, split_uri
+
+
+class FakeGSStorage(FileSystemStorage):
+    """
+    Stand-in of Google Cloud Storage in a local directory, the blob
+    gs://<bucket>/<path> is the file <fake-gs-root>/<bucket>/<path>. It
+    behaves as an object store: there are no folders and the listings return
+    all the blobs under the prefix.
+    """
+
+    scheme = "gs"
+
+    def __init__(self, options=None):
+        super().__init__(options)
+        self.root = get_storage_settings().get("fake-gs-root", os.path.join(tempfile.gettempdir(), "fake_gs"))
+
+    def _path(self, uri):
+        return os.path.join(self.root, split_uri(uri)[1])
+
+    def _uri(self, path):
+        return "gs://{}".format(os.path.relpath(path, self.root))
+
+    def list(self, uri):
+        bucket_name, _, prefix = split_uri(uri)[1].partition("/")
+        bucket_path = os.path.join(self.root, bucket_name)
+        uris = []
+        for dir_path, _, file_names in os.walk(bucket_path):
+            for file_name in file_names:
+                if file_name.endswith(TEMP_SUFFIX):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                if os.path.relpath(path, bucket_path).startswith(prefix):
+                    uris.append(self._uri(path))
+        return sorted(uris)
+
+    def exists(self, uri):
+        return os.path.isfile(self._path(uri))
+
+    def delete(self, uri, whole_bucket=False):
+        if not split_uri(uri)[1].partition("/")[2].strip("/") and not whole_bucket:
+            raise Exception("Refusing to delete all the blobs of the bucket [{}]".format(uri))
+        if os.path.isdir(self._path(uri)) or os.path.isfile(self._path(uri)):
+            super().delete(uri)
+
+    def makedirs(self, uri):
+        pass
+
+    def local_path(self, uri):
+        # the blobs are not local files for the callers
+        return None
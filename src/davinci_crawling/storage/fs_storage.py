@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+import os
+import pathlib
+import shutil
+import uuid
+
+from davinci_crawling.storage.storage import StorageBackend, split_uri
+
+# Suffix of the files being written, a killed process can leave them behind
+TEMP_SUFFIX = ".part"
+
+
+class _AtomicFileWriter(object):
+    """
+    File written with a temporary name that is renamed to its final name when
+    it's closed, the readers never see a partial file.
+    """
+
+    def __init__(self, path, mode):
+        self.path = path
+        self._temp_path = "{}.{}{}".format(path, uuid.uuid4().hex, TEMP_SUFFIX)
+        self._file = open(self._temp_path, mode)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def close(self, commit=True):
+        if self._file.closed:
+            return
+        self._file.close()
+        if commit:
+            os.replace(self._temp_path, self.path)
+        else:
+            os.unlink(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # nothing is written if the writing failed
+        self.close(commit=exc_type is None)
+
+
+class FileSystemStorage(StorageBackend):
+    """
+    The local file system, the URIs are fs://<path> or plain paths.
+    """
+
+    scheme = "fs"
+
+    def _path(self, uri):
+        return split_uri(uri)[1]
+
+    def _uri(self, path):
+        # the listings return plain paths, like os.listdir
+        return path
+
+    def open(self, uri, mode="rb"):
+        path = self._path(uri)
+        if "r" not in mode:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            return _AtomicFileWriter(path, mode)
+        return open(path, mode)
+
+    def list(self, uri):
+        path = self._path(uri)
+        # the partial files of the unfinished writes are not listed
+        return [
+            self._uri(os.path.join(path, the_file))
+            for the_file in os.listdir(path)
+            if not the_file.endswith(TEMP_SUFFIX)
+        ]
+
+    def exists(self, uri):
+        return pathlib.Path(self._path(uri)).exists()
+
+    def delete(self, uri):
+        path = self._path(uri)
+        if os.path.isfile(path):
+            try:
+                os.unlink(path)
+            except Exception:
+                raise Exception("Unable to delete the file [{0}]. Clean version: [{1}]".format(uri, path))
+            return
+
+        for the_file in os.listdir(path):
+            file_path = os.path.join(path, the_file)
+            try:
+                if os.path.isfile(file_path):
+                    os.unlink(file_path)
+                else:
+                    shutil.rmtree(file_path)
+            except Exception:
+                raise Exception("Unable to delete the files in folder [{0}]. Clean version: [{1}]".format(uri, path))
+
+    def makedirs(self, uri):
+        os.makedirs(self._path(uri), exist_ok=True)
+
+    def copy(self, source_uri, dest_uri):
+        self.put_file(self._path(source_uri), dest_uri)
+
+    def put_file(self, local_path, uri, chunk_size=None):
+        path = self._path(uri)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(local_path, path)
+
+    def get_file(self, uri, local_path):
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        shutil.copyfile(self._path(uri), local_path)
+
+    def local_path(self, uri):
+        return self._path(uri)
@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+import base64
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+from google.api_core.exceptions import GoogleAPIError, NotFound
+from google.cloud import storage
+import requests
+from requests.exceptions import RequestException
+
+from davinci_crawling.storage.storage import StorageBackend, get_storage_settings
+
+BUCKET_NAME_RE = r"gs:\/\/(\w+)\/?.*$"
+BUCKET_PATH_RE = r"gs:\/\/\w+\/?(.*)$"
+
+GS_URI_RE = re.compile(r"^gs://([^/]+)/?(.*)$")
+
+# Maximum size of a file read or written in memory, the bigger files are
+# spooled to a temporary file
+SPOOL_MAX_SIZE = 32 * 1024 * 1024
+
+# Size of the chunks of the streamed uploads, it should be a multiple of
+# 256 KB. It can be changed with the "gs-upload-chunk-size" of the storage
+# settings.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Seconds to wait for the answer to a chunk of an upload
+UPLOAD_TIMEOUT = 120
+
+# The files bigger than a part are transferred in parts by several threads,
+# they can be changed with the "gs-part-size" and "gs-concurrency" of the
+# storage settings.
+PART_SIZE = 32 * 1024 * 1024
+CONCURRENCY = 8
+
+# The parts of the uploads in progress are temporary blobs under this prefix
+# of the bucket, out of the folders of the crawlers
+PARTS_PREFIX = "_davinci_parts"
+
+# Maximum quantity of blobs composed by a request
+MAX_COMPOSE_SOURCES = 32
+
+_logger = logging.getLogger("davinci_crawling")
+
+# The GCS clients and buckets are shared by all the threads of the process,
+# every client keeps its authorized HTTP session (and its connections) alive.
+_gs_lock = threading.Lock()
+# project -> storage.Client
+_gs_clients = {}
+# (project, bucket name) -> storage.Bucket
+_gs_buckets = {}
+
+
+def _with_retries(function, description, retries, retry_wait):
+    """
+    Call the function until it doesn't fail or the retries are exhausted,
+    the missing blobs are not retried.
+    """
+    while True:
+        try:
+            return function()
+        except NotFound:
+            raise
+        except (GoogleAPIError, RequestException):
+            if retries <= 0:
+                raise
+            _logger.exception("Error %s." % description)
+            _logger.warning(f"Trying {retries} times more in {retry_wait} seconds.")
+            retries -= 1
+            sleep(retry_wait)
+
+
+def get_gs_bucket_name(options):
+    cache_dir = options.get("cache_dir", None)
+    try:
+        return re.match(BUCKET_NAME_RE, cache_dir)[1]
+    except TypeError:
+        msg = "Unable to get the bucket name " "from the cache_dir OPTION: {}".format(cache_dir)
+        _logger.exception(msg)
+        raise Exception(msg)
+
+
+def get_gs_path(path):
+    try:
+        return re.match(BUCKET_PATH_RE, path)[1]
+    except TypeError:
+        msg = "Unable to get the path from the GSPath: {}".format(path)
+        _logger.exception(msg)
+        raise Exception(msg)
+
+
+def get_gs_client(options):
+    """
+    The client of the project of the options, created the first time it's
+    requested and reused by all the threads of the process.
+    """
+    io_gs_project = options.get("io_gs_project", None)
+    storage_client = _gs_clients.get(io_gs_project)
+    if storage_client is None:
+        with _gs_lock:
+            storage_client = _gs_clients.get(io_gs_project)
+            if storage_client is None:
+                if io_gs_project:
+                    storage_client = storage.Client(project=io_gs_project)
+                else:
+                    storage_client = storage.Client()
+                _gs_clients[io_gs_project] = storage_client
+
+    return storage_client
+
+
+def get_gs_bucket(options, bucket_name=None, create=False):
+    """
+    The bucket handle, its metadata is only requested the first time it's
+    used in the process.
+    Args:
+        options: the options of the crawler (project).
+        bucket_name: the name of the bucket, by default the bucket of the
+        cache_dir option.
+        create: create the bucket if it doesn't exist.
+    """
+    bucket_name = bucket_name or get_gs_bucket_name(options)
+    key = (options.get("io_gs_project", None), bucket_name)
+    bucket = _gs_buckets.get(key)
+    if bucket is None:
+        storage_client = get_gs_client(options)
+        with _gs_lock:
+            bucket = _gs_buckets.get(key)
+            if bucket is None:
+                try:
+                    bucket = storage_client.get_bucket(bucket_name)
+                except GoogleAPIError:
+                    if not create:
+                        raise
+                    _logger.info("Bucket {} not found. Creating it...".format(bucket_name))
+                    bucket = storage_client.create_bucket(bucket_name)
+                    _logger.info("Bucket {} successfully created.".format(bucket_name))
+                _gs_buckets[key] = bucket
+
+    return bucket
+
+
+class _BlobWriter(object):
+    """
+    File object that streams its content to a blob with a resumable upload.
+    A chunk is sent every time `chunk_size` bytes are written and the last one
+    when the file is closed, so only a chunk is kept in memory. A chunk that
+    fails is resumed from the last byte received by GCS, and the MD5 of the
+    blob is checked against the content written.
+
+    The upload session is created by the client of the blob (with its
+    endpoint and project), the session URI authorizes the chunks sent to it.
+    """
+
+    def __init__(self, blob, chunk_size=UPLOAD_CHUNK_SIZE, retries=3, retry_wait=5):
+        self.blob = blob
+        self.closed = False
+        self._chunk_size = chunk_size
+        self._retries = retries
+        self._retry_wait = retry_wait
+        # the bytes written and not received by GCS yet, the first one is the
+        # byte `_uploaded` of the file
+        self._buffer = bytearray()
+        self._uploaded = 0
+        self._md5 = hashlib.md5()
+
+        self._session = requests.Session()
+        self._url = blob.create_resumable_upload_session(content_type="application/octet-stream")
+
+    def write(self, data):
+        self._buffer += data
+        self._md5.update(data)
+        while len(self._buffer) >= self._chunk_size:
+            self._transmit(self._chunk_size)
+        return len(data)
+
+    def _put(self, data, total):
+        """
+        Send the bytes after the ones received by GCS, without data it only
+        asks for the bytes received.
+        """
+        if data:
+            content_range = "bytes {}-{}/{}".format(self._uploaded, self._uploaded + len(data) - 1, total)
+        else:
+            content_range = "bytes */{}".format(total)
+        response = self._session.put(
+            self._url, data=bytes(data), headers={"Content-Range": content_range}, timeout=UPLOAD_TIMEOUT
+        )
+        if response.status_code == 308:
+            # incomplete, the range header has the bytes received (if any)
+            received = response.headers.get("Range", None)
+            uploaded = int(received.rsplit("-", 1)[1]) + 1 if received else 0
+            del self._buffer[: uploaded - self._uploaded]
+            self._uploaded = uploaded
+            return None
+        response.raise_for_status()
+        return response
+
+    def _transmit(self, size, final=False):
+        retries = self._retries
+        while True:
+            try:
+                total = self._uploaded + len(self._buffer) if final else "*"
+                return self._put(self._buffer[:size], total)
+            except RequestException:
+                if retries <= 0:
+                    raise
+                _logger.exception("Error uploading a chunk of [%s] to GS." % self.blob.name)
+                _logger.warning(f"Trying {retries} times more in {self._retry_wait} seconds.")
+                retries -= 1
+                sleep(self._retry_wait)
+                try:
+                    # ask GCS for the bytes it has
+                    self._put(b"", "*")
+                except RequestException:
+                    _logger.exception("Unable to get the status of the upload of [%s]." % self.blob.name)
+
+    def close(self, upload=True):
+        if self.closed:
+            return
+        self.closed = True
+        if not upload:
+            # GCS discards the incomplete uploads
+            return
+
+        # the last chunk completes the upload, the bytes not received by GCS
+        # are sent again while it makes progress
+        response = None
+        uploaded = None
+        while response is None:
+            if self._uploaded == uploaded:
+                raise IOError("The upload of the blob [{}] was not completed".format(self.blob.name))
+            uploaded = self._uploaded
+            response = self._transmit(len(self._buffer), final=True)
+        md5 = base64.b64encode(self._md5.digest()).decode("ascii")
+        remote_md5 = response.json().get("md5Hash", None)
+        if remote_md5 and remote_md5 != md5:
+            self.blob.delete()
+            raise IOError("The checksum of the blob [{}] doesn't match the content uploaded".format(self.blob.name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # nothing is uploaded if the writing failed
+        self.close(upload=exc_type is None)
+
+
+class _RangeWriter(object):
+    """
+    Writes a range of a local file, it remembers the position of the last
+    byte written so a failed range is resumed from there.
+    """
+
+    def __init__(self, path, start):
+        self.path = path
+        self.position = start
+        self._file = None
+
+    def write(self, data):
+        self._file.write(data)
+        self.position += len(data)
+        return len(data)
+
+    def __enter__(self):
+        self._file = open(self.path, "r+b")
+        self._file.seek(self.position)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._file.close()
+
+
+class GSStorage(StorageBackend):
+    """
+    Google Cloud Storage, the URIs are gs://<bucket>/<path>.
+    """
+
+    scheme = "gs"
+
+    def __init__(self, options=None):
+        super().__init__(options)
+        storage_settings = get_storage_settings()
+        self.part_size = storage_settings.get("gs-part-size", PART_SIZE)
+        self.concurrency = storage_settings.get("gs-concurrency", CONCURRENCY)
+
+    def _split(self, uri):
+        match = GS_URI_RE.match(uri)
+        if not match:
+            raise Exception("Unable to get the path from the GSPath: {}".format(uri))
+        return match[1], match[2]
+
+    def _bucket(self, uri, create=False):
+        bucket_name, path = self._split(uri)
+        return get_gs_bucket(self.options, bucket_name, create=create), path
+
+    def _blob(self, uri, chunk_size=None):
+        bucket, path = self._bucket(uri)
+        return bucket.blob(path, chunk_size=chunk_size)
+
+    def open(self, uri, mode="rb"):
+        if "r" not in mode:
+            bucket, path = self._bucket(uri)
+            chunk_size = get_storage_settings().get("gs-upload-chunk-size", UPLOAD_CHUNK_SIZE)
+            return _BlobWriter(bucket.blob(path), chunk_size=chunk_size)
+
+        f = tempfile.SpooledTemporaryFile(SPOOL_MAX_SIZE)
+        try:
+            self._blob(uri).download_to_file(f)
+        except NotFound:
+            f.close()
+            raise FileNotFoundError(uri)
+        f.seek(0)
+        return f
+
+    def list(self, uri):
+        bucket, path = self._bucket(uri)
+        return [f"gs://{bucket.name}/{blob.name}" for blob in bucket.list_blobs(prefix=path)]
+
+    def exists(self, uri):
+        return self._blob(uri).exists()
+
+    def delete(self, uri, whole_bucket=False):
+        """
+        Delete a blob, or all the blobs under a folder.
+        Args:
+            uri: the URI of the blob or the folder.
+            whole_bucket: allow to delete all the blobs of the bucket when the
+            URI has no path (ex. gs://bucket/), it's refused by default.
+        """
+        bucket, path = self._bucket(uri)
+        path = path.strip("/")
+        if not path and not whole_bucket:
+            raise Exception("Refusing to delete all the blobs of the bucket [{}]".format(uri))
+
+        blob = bucket.blob(path)
+        if path and blob.exists():
+            blob.delete()
+            return
+
+        prefix = path + "/" if path else ""
+        blobs = list(bucket.list_blobs(prefix=prefix))
+        if blobs:
+            bucket.delete_blobs(blobs)
+
+    def makedirs(self, uri):
+        # there are no folders, but the bucket should exist
+        self._bucket(uri, create=True)
+
+    def copy(self, source_uri, dest_uri):
+        # the copy is done by the server
+        source_bucket, source_path = self._bucket(source_uri)
+        dest_bucket, dest_path = self._bucket(dest_uri)
+        source_bucket.copy_blob(source_bucket.blob(source_path), dest_bucket, dest_path)
+
+    def put_file(self, local_path, uri, chunk_size=None, retries=3, retry_wait=5):
+        """
+        Upload a local file, the files bigger than a part are uploaded in
+        parallel parts that are composed into the blob.
+        Args:
+            local_path: the path of the local file.
+            uri: the URI of the blob.
+            chunk_size: the size of the chunks of the upload.
+            retries: the quantity of times that the upload (or every part) is
+            retried if it fails.
+            retry_wait: the seconds to wait between retries.
+
+        Returns: the path of the blob, the upload raises the error of the
+        file (or of a part) that fails after its retries.
+        """
+        blob = self._blob(uri, chunk_size=chunk_size)
+
+        _logger.debug("Upload file [%s] into [%s]" % (local_path, uri))
+
+        size = os.path.getsize(local_path)
+        if size > self.part_size:
+            self._put_parts(local_path, blob, size, retries, retry_wait)
+        else:
+            _with_retries(
+                lambda: blob.upload_from_filename(local_path),
+                "uploading the file [{}]".format(local_path),
+                retries,
+                retry_wait,
+            )
+        return blob.path
+
+    def _put_parts(self, local_path, blob, size, retries, retry_wait):
+        """
+        Parallel composite upload: the parts of the file are uploaded as
+        temporary blobs by `concurrency` threads, every part is retried on its
+        own, and then they are composed into the blob. The composite blobs
+        don't have MD5, only CRC32C.
+        """
+        bucket = blob.bucket
+        prefix = "{}/{}".format(PARTS_PREFIX, uuid.uuid4().hex)
+        offsets = range(0, size, self.part_size)
+        parts = [bucket.blob("{}/{:05d}".format(prefix, n)) for n in range(len(offsets))]
+
+        def put_part(part, offset):
+            def upload():
+                with open(local_path, "rb") as f:
+                    f.seek(offset)
+                    part.upload_from_file(f, size=min(self.part_size, size - offset))
+
+            _with_retries(upload, "uploading the part [{}] of [{}]".format(part.name, local_path), retries, retry_wait)
+
+        try:
+            with ThreadPoolExecutor(self.concurrency) as executor:
+                list(executor.map(put_part, parts, offsets))
+
+            # a request composes up to MAX_COMPOSE_SOURCES blobs, the big
+            # files are composed in levels
+            level = 0
+            while len(parts) > MAX_COMPOSE_SOURCES:
+                composed = []
+                for n in range(0, len(parts), MAX_COMPOSE_SOURCES):
+                    composed_blob = bucket.blob("{}/composed-{}-{:05d}".format(prefix, level, n))
+                    composed_blob.compose(parts[n : n + MAX_COMPOSE_SOURCES])
+                    composed.append(composed_blob)
+                parts = composed
+                level += 1
+
+            blob.compose(parts)
+        finally:
+            try:
+                bucket.delete_blobs(list(bucket.list_blobs(prefix=prefix + "/")))
+            except GoogleAPIError:
+                _logger.exception("Unable to delete the parts of the upload [%s]" % prefix)
+
+    def get_file(self, uri, local_path, retries=3, retry_wait=5):
+        """
+        Download a blob, the blobs bigger than a part are downloaded by
+        `concurrency` threads, every one downloading a range of the blob.
+        Args:
+            uri: the URI of the blob.
+            local_path: the path of the local file.
+            retries: the quantity of times that the download (or every range)
+            is tried if it fails.
+            retry_wait: the seconds to wait between retries.
+        """
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        bucket, path = self._bucket(uri)
+        try:
+            blob = bucket.get_blob(path)
+            if blob is None:
+                raise NotFound(uri)
+
+            if blob.size > self.part_size:
+                self._get_parts(blob, local_path, retries, retry_wait)
+            else:
+                _with_retries(
+                    lambda: blob.download_to_filename(local_path),
+                    "downloading [{}]".format(uri),
+                    retries,
+                    retry_wait,
+                )
+        except NotFound:
+            raise FileNotFoundError(uri)
+
+        _logger.debug("Blob {} downloaded to {}.".format(uri, local_path))
+
+    def _get_parts(self, blob, local_path, retries, retry_wait):
+        """
+        Parallel ranged download, the ranges are written in place into a
+        temporary file that takes the name of the local file at the end. A
+        range that fails is resumed from its last byte written.
+        """
+        size = blob.size
+        temp_path = "{}.{}.part".format(local_path, uuid.uuid4().hex)
+        with open(temp_path, "wb") as f:
+            f.truncate(size)
+
+        def get_part(start):
+            end = min(start + self.part_size, size) - 1
+            writer = _RangeWriter(temp_path, start)
+
+            def download():
+                if writer.position > end:
+                    return
+                with writer:
+                    blob.download_to_file(writer, start=writer.position, end=end)
+
+            description = "downloading the range {}-{} of [{}]".format(start, end, blob.name)
+            _with_retries(download, description, retries, retry_wait)
+
+        try:
+            with ThreadPoolExecutor(self.concurrency) as executor:
+                list(executor.map(get_part, range(0, size, self.part_size)))
+            os.replace(temp_path, local_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
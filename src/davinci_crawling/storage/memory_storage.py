@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+import io
+import threading
+
+from davinci_crawling.storage.storage import StorageBackend, split_uri
+
+
+class _MemoryWriter(io.BytesIO):
+    """
+    Buffer that stores its content in the storage when it's closed.
+    """
+
+    def __init__(self, storage, path):
+        super().__init__()
+        self._storage = storage
+        self._path = path
+
+    def close(self):
+        if not self.closed:
+            self._storage._store(self._path, self.getvalue())
+        super().close()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # nothing is stored if the writing failed
+            super().close()
+
+
+class MemoryStorage(StorageBackend):
+    """
+    Object store in the memory of the process, the URIs are mem://<path>.
+    All the instances share the same files, they are lost when the process
+    ends.
+    """
+
+    scheme = "mem"
+
+    _lock = threading.Lock()
+    # path -> content
+    _files = {}
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._files.clear()
+
+    @classmethod
+    def _store(cls, path, content):
+        with cls._lock:
+            cls._files[path] = content
+
+    @staticmethod
+    def _folder_prefix(path):
+        return path.rstrip("/") + "/"
+
+    def _under(self, path):
+        prefix = self._folder_prefix(path)
+        with self._lock:
+            return [file_path for file_path in self._files if file_path.startswith(prefix)]
+
+    def open(self, uri, mode="rb"):
+        path = split_uri(uri)[1]
+        if "r" not in mode:
+            return _MemoryWriter(self, path)
+
+        with self._lock:
+            if path not in self._files:
+                raise FileNotFoundError(uri)
+            return io.BytesIO(self._files[path])
+
+    def list(self, uri):
+        return ["mem://{}".format(path) for path in self._under(split_uri(uri)[1])]
+
+    def exists(self, uri):
+        path = split_uri(uri)[1]
+        with self._lock:
+            if path in self._files:
+                return True
+        return bool(self._under(path))
+
+    def delete(self, uri):
+        path = split_uri(uri)[1]
+        to_delete = [path] + self._under(path)
+        with self._lock:
+            for file_path in to_delete:
+                self._files.pop(file_path, None)
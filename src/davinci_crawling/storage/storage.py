@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+"""
+Storage backends used by `davinci_crawling.io`.
+
+The files are referenced by URIs, the scheme of the URI selects the backend:
+
+- fs:// the local file system (`FileSystemStorage`), also the paths
+  without scheme.
+- gs:// Google Cloud Storage (`GSStorage`).
+- mem:// the memory of the process (`MemoryStorage`), for tests and
+  benchmarks.
+
+The implementation of a scheme can be changed in the "storage"
+architecture-params, ex. to use a directory as a stand-in of GCS:
+
+    "storage": {
+        "backends": {"gs": "davinci_crawling.storage.fake_gs_storage.FakeGSStorage"},
+        "fake-gs-root": "/tmp/fake_gs",
+    }
+
+The files written to GCS are streamed with resumable uploads, the size of
+their chunks is the "gs-upload-chunk-size" (8 MB by default). The local
+files bigger than the "gs-part-size" (32 MB) are uploaded and downloaded in
+parts by "gs-concurrency" (8) threads.
+"""
+import abc
+import contextlib
+import hashlib
+import os
+import re
+import shutil
+import sys
+import threading
+from abc import ABCMeta
+
+from davinci_crawling.utils import get_class_from_name
+from django.conf import settings
+
+URI_RE = re.compile(r"^(\w+)://(.*)$")
+
+DEFAULT_BACKENDS = {
+    "fs": "davinci_crawling.storage.fs_storage.FileSystemStorage",
+    "gs": "davinci_crawling.storage.gs_storage.GSStorage",
+    "mem": "davinci_crawling.storage.memory_storage.MemoryStorage",
+}
+
+# Size of the chunks read and written when a file is streamed
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def get_storage_settings():
+    if hasattr(settings, "DAVINCI_CONF") and "storage" in settings.DAVINCI_CONF.get("architecture-params", {}):
+        return settings.DAVINCI_CONF["architecture-params"]["storage"]
+    return {}
+
+
+def split_uri(uri):
+    """
+    Returns: a tuple with the scheme and the path of the URI, the paths
+    without scheme are local files (fs).
+    """
+    match = URI_RE.match(uri)
+    if not match:
+        return "fs", uri
+    return match[1], match[2]
+
+
+class StorageBackend(metaclass=ABCMeta):
+    """
+    The operations over the files of a backend, the files and folders are
+    referenced by their URI.
+
+    The backends are stateless (all the state is shared by the process), a
+    new instance is created for every group of operations.
+    """
+
+    scheme = None
+
+    def __init__(self, options=None):
+        """
+        Args:
+            options: the options of the crawler (ex. the GCS project).
+        """
+        self.options = options or {}
+
+    @abc.abstractmethod
+    def open(self, uri, mode="rb"):
+        """
+        Open a file for streaming, the content written is only visible when
+        the file is closed.
+        Args:
+            uri: the URI of the file.
+            mode: "rb" or "wb".
+
+        Returns: a file object (context manager).
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def list(self, uri):
+        """
+        Returns: the URIs of the content of a folder, the object stores
+        return all the objects under the prefix.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def exists(self, uri):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def delete(self, uri):
+        """
+        Delete a file, or all the content of a folder.
+        """
+        raise NotImplementedError()
+
+    def makedirs(self, uri):
+        """
+        Make sure a folder exists, the object stores don't have folders.
+        """
+        pass
+
+    def read(self, uri):
+        with self.open(uri, "rb") as f:
+            return f.read()
+
+    def write(self, uri, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.open(uri, "wb") as f:
+            f.write(data)
+
+    def copy(self, source_uri, dest_uri):
+        """
+        Copy a file inside the backend.
+        """
+        with self.open(source_uri, "rb") as source, self.open(dest_uri, "wb") as dest:
+            shutil.copyfileobj(source, dest, COPY_CHUNK_SIZE)
+
+    def put_file(self, local_path, uri, chunk_size=None):
+        """
+        Copy a local file into the backend.
+        Args:
+            local_path: the path of the local file.
+            uri: the URI of the destination file.
+            chunk_size: the size of the chunks of the transfer, for the
+            backends that transfer the files in chunks.
+        """
+        with open(local_path, "rb") as source, self.open(uri, "wb") as dest:
+            shutil.copyfileobj(source, dest, COPY_CHUNK_SIZE)
+
+    def get_file(self, uri, local_path):
+        """
+        Copy a file of the backend into a local file.
+        """
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with self.open(uri, "rb") as source, open(local_path, "wb") as dest:
+            shutil.copyfileobj(source, dest, COPY_CHUNK_SIZE)
+
+    def local_path(self, uri):
+        """
+        Returns: the path of the file in the local file system, None if the
+        file is not local.
+        """
+        return None
+
+
+class TeeWriter(object):
+    """
+    File object that writes the same content into several files, of any
+    backends, in a single pass and computes the MD5 of the content on the
+    fly. If the writing fails none of the files is created.
+    """
+
+    def __init__(self, uris, options=None):
+        """
+        Args:
+            uris: the URIs of the files.
+            options: the options of the crawler.
+        """
+        self.uris = list(uris)
+        self.options = options
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._stack = contextlib.ExitStack()
+        self._files = []
+
+    @property
+    def checksum(self):
+        """
+        The hex MD5 of the content written.
+        """
+        return self._md5.hexdigest()
+
+    def write(self, data):
+        self._md5.update(data)
+        self.size += len(data)
+        for f in self._files:
+            f.write(data)
+        return len(data)
+
+    def __enter__(self):
+        self._stack.__enter__()
+        try:
+            for uri in self.uris:
+                self._files.append(self._stack.enter_context(get_storage(uri, self.options).open(uri, "wb")))
+        except BaseException:
+            # discard the files already opened
+            if not self._stack.__exit__(*sys.exc_info()):
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self._stack.__exit__(exc_type, exc_val, exc_tb)
+
+
+_lock = threading.Lock()
+# scheme -> class of the backend
+_backend_classes = {}
+
+
+def get_backend_class(scheme):
+    """
+    The class of the backend of a scheme, resolved the first time it's
+    requested.
+    """
+    clazz = _backend_classes.get(scheme)
+    if clazz is None:
+        with _lock:
+            clazz = _backend_classes.get(scheme)
+            if clazz is None:
+                backends = {**DEFAULT_BACKENDS, **get_storage_settings().get("backends", {})}
+                if scheme not in backends:
+                    raise ValueError("Unsupported storage backend: {}".format(scheme))
+                clazz = _backend_classes[scheme] = get_class_from_name(backends[scheme])
+    return clazz
+
+
+def get_storage(uri, options=None):
+    """
+    The backend of the file or folder of the URI.
+    Args:
+        uri: the URI of a file or folder.
+        options: the options of the crawler.
+    """
+    return get_backend_class(split_uri(uri)[0])(options)
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 BuildGroup Data Services Inc.
+import base64
+import hashlib
+import os
+import tempfile
+from unittest import mock
+
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+from davinci_crawling.storage.gs_storage import MAX_COMPOSE_SOURCES, GSStorage, _BlobWriter
+from requests.exceptions import RequestException
+
+
+class FakeBlob(object):
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = "/b/{}/o/{}".format(bucket.name, name)
+
+    @property
+    def size(self):
+        return len(self.bucket.blobs[self.name])
+
+    def create_resumable_upload_session(self, content_type=None):
+        return "https://storage.googleapis.com/upload/storage/v1/b/bucket/o?upload_id=1"
+
+    def exists(self):
+        return self.name in self.bucket.blobs
+
+    def delete(self):
+        self.bucket.blobs.pop(self.name, None)
+
+    def upload_from_file(self, f, size):
+        data = f.read(size)
+        for suffix, times in self.bucket.upload_failures.items():
+            if self.name.endswith(suffix) and times:
+                self.bucket.upload_failures[suffix] -= 1
+                raise RequestException("Connection reset")
+        self.bucket.blobs[self.name] = data
+
+    def upload_from_filename(self, filename):
+        with open(filename, "rb") as f:
+            self.upload_from_file(f, os.path.getsize(filename))
+
+    def compose(self, sources):
+        assert len(sources) <= MAX_COMPOSE_SOURCES
+        self.bucket.composes += 1
+        self.bucket.blobs[self.name] = b"".join(self.bucket.blobs[source.name] for source in sources)
+
+    def download_to_file(self, f, start, end):
+        data = self.bucket.blobs[self.name][start : end + 1]
+        if start in self.bucket.download_failures:
+            # the connection is lost in the middle of the range
+            self.bucket.download_failures.remove(start)
+            f.write(data[: len(data) // 2])
+            raise RequestException("Connection reset")
+        self.bucket.ranges.append((start, end))
+        f.write(data)
+
+
+class FakeBucket(object):
+    """
+    A bucket in memory. The uploads of the blobs with a name ending with a
+    key of `upload_failures` fail the given times, the downloads of the
+    ranges starting at a position of `download_failures` fail once.
+    """
+
+    name = "bucket"
+
+    def __init__(self):
+        self.blobs = {}
+        self.upload_failures = {}
+        self.download_failures = set()
+        self.composes = 0
+        self.ranges = []
+
+    def blob(self, name, chunk_size=None):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self.blobs else None
+
+    def list_blobs(self, prefix):
+        return [FakeBlob(self, name) for name in list(self.blobs) if name.startswith(prefix)]
+
+    def delete_blobs(self, blobs):
+        for blob in blobs:
+            del self.blobs[blob.name]
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None, content=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content or {}
+
+    def json(self):
+        return self.content
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeUploadSession(object):
+    """
+    A resumable upload session of GCS, the first `failures` chunks fail
+    after GCS received half of them.
+    """
+
+    def __init__(self):
+        self.received = bytearray()
+        self.failures = 0
+        self.completed = False
+
+    def put(self, url, data, headers, timeout):
+        byte_range, total = headers["Content-Range"][len("bytes ") :].split("/")
+        if byte_range != "*":
+            assert int(byte_range.split("-")[0]) == len(self.received)
+            if self.failures:
+                self.failures -= 1
+                self.received += data[: len(data) // 2]
+                raise RequestException("Connection reset")
+            self.received += data
+
+        if total != "*" and int(total) == len(self.received):
+            self.completed = True
+            md5 = base64.b64encode(hashlib.md5(self.received).digest()).decode("ascii")
+            return FakeResponse(200, content={"md5Hash": md5})
+        headers = {"Range": "bytes=0-{}".format(len(self.received) - 1)} if self.received else {}
+        return FakeResponse(308, headers)
+
+
+class TestGSStorage(CaravaggioBaseTest):
+    """
+    Test the streamed uploads and the transfers in parts of the Google Cloud
+    Storage backend with a bucket in memory.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pass
+
+    def setUp(self):
+        self.bucket = FakeBucket()
+        for patch in (
+            mock.patch("davinci_crawling.storage.gs_storage.get_gs_bucket", return_value=self.bucket),
+            mock.patch("davinci_crawling.storage.gs_storage.sleep"),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.storage = GSStorage()
+        self.storage.part_size = 10
+        self.storage.concurrency = 4
+
+        self.local_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.local_dir.cleanup)
+        self.content = os.urandom(1234)
+        self.local_file = os.path.join(self.local_dir.name, "file.bin")
+        with open(self.local_file, "wb") as f:
+            f.write(self.content)
+
+    def test_put_parts(self):
+        self.bucket.upload_failures["/00003"] = 1
+
+        path = self.storage.put_file(self.local_file, "gs://bucket/folder/file.bin")
+
+        self.assertEqual("/b/bucket/o/folder/file.bin", path)
+        self.assertEqual(self.content, self.bucket.blobs["folder/file.bin"])
+        # 124 parts, composed in 4 blobs and then in the final blob
+        self.assertEqual(5, self.bucket.composes)
+        # the temporary blobs are deleted
+        self.assertEqual(["folder/file.bin"], list(self.bucket.blobs))
+
+    def test_put_parts_failed(self):
+        self.bucket.upload_failures["/00003"] = 2
+
+        with self.assertRaises(RequestException):
+            self.storage.put_file(self.local_file, "gs://bucket/folder/file.bin", retries=1)
+
+        self.assertEqual({}, self.bucket.blobs)
+
+    def test_put_small_file(self):
+        self.storage.part_size = len(self.content)
+        self.bucket.upload_failures["folder/file.bin"] = 1
+
+        # the small files are retried like the parts
+        path = self.storage.put_file(self.local_file, "gs://bucket/folder/file.bin", retries=1)
+        self.assertEqual("/b/bucket/o/folder/file.bin", path)
+        self.assertEqual(self.content, self.bucket.blobs["folder/file.bin"])
+
+        self.bucket.upload_failures["folder/other.bin"] = 2
+        with self.assertRaises(RequestException):
+            self.storage.put_file(self.local_file, "gs://bucket/folder/other.bin", retries=1)
+
+    def test_get_parts(self):
+        self.bucket.blobs["folder/file.bin"] = self.content
+        self.bucket.download_failures.add(20)
+
+        local_file = os.path.join(self.local_dir.name, "out", "file.bin")
+        self.storage.get_file("gs://bucket/folder/file.bin", local_file)
+
+        with open(local_file, "rb") as f:
+            self.assertEqual(self.content, f.read())
+        # the failed range is resumed from its last byte written
+        self.assertIn((25, 29), self.bucket.ranges)
+        self.assertEqual(["file.bin"], os.listdir(os.path.dirname(local_file)))
+
+    def test_get_parts_failed(self):
+        self.bucket.blobs["folder/file.bin"] = self.content
+
+        local_file = os.path.join(self.local_dir.name, "out", "file.bin")
+        with mock.patch.object(FakeBlob, "download_to_file", side_effect=RequestException("Connection reset")):
+            with self.assertRaises(RequestException):
+                self.storage.get_file("gs://bucket/folder/file.bin", local_file, retries=1)
+
+        # the temporary file is deleted
+        self.assertEqual([], os.listdir(os.path.dirname(local_file)))
+
+    def test_delete(self):
+        self.bucket.blobs = {"folder/file.bin": b"1", "folder/other.bin": b"2", "file.bin": b"3"}
+
+        self.storage.delete("gs://bucket/folder/file.bin")
+        self.assertEqual(["folder/other.bin", "file.bin"], list(self.bucket.blobs))
+        self.storage.delete("gs://bucket/folder/")
+        self.assertEqual(["file.bin"], list(self.bucket.blobs))
+
+        # the whole bucket is only deleted on demand
+        for uri in ("gs://bucket", "gs://bucket/", "gs://bucket//"):
+            with self.assertRaises(Exception):
+                self.storage.delete(uri)
+        self.assertEqual(["file.bin"], list(self.bucket.blobs))
+        self.storage.delete("gs://bucket", whole_bucket=True)
+        self.assertEqual({}, self.bucket.blobs)
+
+    def _blob_writer(self):
+        upload_session = FakeUploadSession()
+        patch = mock.patch("davinci_crawling.storage.gs_storage.requests.Session", return_value=upload_session)
+        patch.start()
+        self.addCleanup(patch.stop)
+        return _BlobWriter(self.bucket.blob("folder/file.bin"), chunk_size=8), upload_session
+
+    def test_blob_writer(self):
+        writer, upload_session = self._blob_writer()
+        with writer:
+            writer.write(b"first chunk ")
+            self.assertEqual(b"first ch", upload_session.received)
+            # the second chunk is resumed from the last byte received
+            upload_session.failures = 1
+            writer.write(b"second chunk")
+
+        self.assertTrue(upload_session.completed)
+        self.assertEqual(b"first chunk second chunk", upload_session.received)
+
+    def test_blob_writer_failed(self):
+        writer, upload_session = self._blob_writer()
+        with self.assertRaises(IOError):
+            with writer:
+                writer.write(b"first chunk ")
+                raise IOError("Connection lost")
+
+        # the upload is not completed
+        self.assertFalse(upload_session.completed)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 BuildGroup Data Services Inc.
+import hashlib
+import io
+import os
+import tempfile
+import zipfile
+
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+from davinci_crawling.io import copy_file, delete_all, exists, extract_zip, iter_zip, listdir
+from davinci_crawling.storage.fake_gs_storage import FakeGSStorage
+from davinci_crawling.storage.memory_storage import MemoryStorage
+from davinci_crawling.storage.storage import TeeWriter, get_storage
+
+
+class TestStorage(CaravaggioBaseTest):
+    """
+    Test the local storage backends and the io functions on top of them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pass
+
+    def setUp(self):
+        MemoryStorage.clear()
+
+    def test_memory_storage(self):
+        storage = get_storage("mem://folder/file.txt")
+        self.assertIsInstance(storage, MemoryStorage)
+
+        storage.write("mem://folder/file.txt", "content")
+        storage.write("mem://folder/sub/other.txt", b"other")
+        storage.write("mem://folder2/file.txt", b"not listed")
+
+        self.assertEqual(b"content", storage.read("mem://folder/file.txt"))
+        self.assertEqual(
+            ["mem://folder/file.txt", "mem://folder/sub/other.txt"], sorted(storage.list("mem://folder/"))
+        )
+        self.assertTrue(storage.exists("mem://folder"))
+
+        storage.delete("mem://folder")
+        self.assertFalse(storage.exists("mem://folder/file.txt"))
+        self.assertTrue(storage.exists("mem://folder2/file.txt"))
+
+        with self.assertRaises(FileNotFoundError):
+            storage.read("mem://folder/file.txt")
+
+    def test_fake_gs_storage(self):
+        with tempfile.TemporaryDirectory() as root:
+            storage = FakeGSStorage()
+            storage.root = root
+
+            storage.write("gs://bucket/crawler/a.txt", b"a")
+            storage.write("gs://bucket/crawler/ctl/b.txt", b"b")
+            storage.copy("gs://bucket/crawler/a.txt", "gs://bucket/copy/a.txt")
+
+            self.assertEqual(
+                ["gs://bucket/crawler/a.txt", "gs://bucket/crawler/ctl/b.txt"], storage.list("gs://bucket/crawler")
+            )
+            self.assertEqual(b"a", storage.read("gs://bucket/copy/a.txt"))
+            self.assertIsNone(storage.local_path("gs://bucket/copy/a.txt"))
+
+            storage.delete("gs://bucket/crawler")
+            self.assertEqual([], storage.list("gs://bucket/crawler"))
+
+            # the whole bucket is only deleted on demand
+            with self.assertRaises(Exception):
+                storage.delete("gs://bucket/")
+            self.assertEqual(["gs://bucket/copy/a.txt"], storage.list("gs://bucket"))
+
+    def test_copy_and_extract(self):
+        content = io.BytesIO()
+        with zipfile.ZipFile(content, "w") as zip_file:
+            zip_file.writestr("file.xml", "<xml/>")
+            zip_file.writestr("other.txt", "other")
+
+        with tempfile.TemporaryDirectory() as local_dir:
+            zip_path = "{}/file.zip".format(local_dir)
+            with open(zip_path, "wb") as f:
+                f.write(content.getvalue())
+
+            # local file -> memory -> local file
+            copy_file({}, "fs://{}".format(zip_path), "mem://cache/file.zip")
+            self.assertTrue(exists({}, "mem://cache/file.zip"))
+            copy_path = copy_file({}, "mem://cache/file.zip", "fs://{}/copy/file.zip".format(local_dir))
+            self.assertEqual("{}/copy/file.zip".format(local_dir), copy_path)
+
+            files = extract_zip({}, "mem://cache/file.zip", "mem://working/")
+            self.assertEqual(["mem://working/file.xml", "mem://working/other.txt"], sorted(files))
+            self.assertEqual(sorted(files), sorted(listdir({}, "mem://working")))
+
+            files = extract_zip({}, "mem://cache/file.zip", "fs://{}/working".format(local_dir))
+            self.assertEqual(
+                ["{}/working/file.xml".format(local_dir), "{}/working/other.txt".format(local_dir)], sorted(files)
+            )
+
+            delete_all({}, "mem://working")
+            self.assertFalse(exists({}, "mem://working/file.xml"))
+
+    def test_iter_zip(self):
+        nested = io.BytesIO()
+        with zipfile.ZipFile(nested, "w") as zip_file:
+            zip_file.writestr("Documento.xml", "<nested/>")
+            zip_file.writestr("report.pdf", "pdf")
+
+        content = io.BytesIO()
+        with zipfile.ZipFile(content, "w") as zip_file:
+            zip_file.writestr("file.xml", "<xml/>")
+            zip_file.writestr("file.ITR", nested.getvalue())
+            zip_file.writestr("other.txt", "other")
+
+        get_storage("mem://cache/file.zip").write("mem://cache/file.zip", content.getvalue())
+
+        files = {
+            path: f.read()
+            for path, f in iter_zip(
+                {},
+                "mem://cache/file.zip",
+                select=lambda path: path.endswith(".xml"),
+                nested=lambda path: path.endswith(".ITR"),
+            )
+        }
+        self.assertEqual({"file.xml": b"<xml/>", "file.ITR/Documento.xml": b"<nested/>"}, files)
+
+        # the files are only extracted to disk when they are asked to
+        with tempfile.TemporaryDirectory() as local_dir:
+            files = extract_zip(
+                {}, "mem://cache/file.zip", "fs://{}".format(local_dir), select=lambda path: path.endswith(".txt")
+            )
+            self.assertEqual(["{}/other.txt".format(local_dir)], files)
+
+    def test_tee_writer(self):
+        with tempfile.TemporaryDirectory() as local_dir:
+            local_file = "fs://{}/tee/file.zip".format(local_dir)
+
+            with TeeWriter([local_file, "mem://cache/file.zip"]) as f:
+                f.write(b"first ")
+                f.write(b"second")
+
+            self.assertEqual(hashlib.md5(b"first second").hexdigest(), f.checksum)
+            self.assertEqual(12, f.size)
+            self.assertEqual(b"first second", get_storage(local_file).read(local_file))
+            self.assertEqual(b"first second", get_storage("mem://cache/file.zip").read("mem://cache/file.zip"))
+
+            # nothing is written if the writing fails
+            with self.assertRaises(IOError):
+                with TeeWriter(["fs://{}/tee/failed.zip".format(local_dir), "mem://cache/failed.zip"]) as f:
+                    f.write(b"partial")
+                    raise IOError("Connection lost")
+
+            self.assertEqual(["file.zip"], os.listdir("{}/tee".format(local_dir)))
+            self.assertFalse(exists({}, "mem://cache/failed.zip"))
+
+    def test_partial_files_not_listed(self):
+        with tempfile.TemporaryDirectory() as local_dir:
+            folder = "fs://{}/cache".format(local_dir)
+            storage = get_storage(folder)
+            with storage.open("{}/done.zip".format(folder), "wb") as f:
+                f.write(b"done")
+
+            # a process killed in the middle of a download
+            partial = storage.open("{}/partial.zip".format(folder), "wb")
+            partial.write(b"part")
+            partial.flush()
+
+            self.assertEqual(2, len(os.listdir("{}/cache".format(local_dir))))
+            self.assertEqual(["{}/cache/done.zip".format(local_dir)], listdir({}, folder))
+            partial.close(commit=False)
+
+    def test_fake_gs_partial_files_not_listed(self):
+        with tempfile.TemporaryDirectory() as local_dir:
+            storage = FakeGSStorage()
+            storage.root = local_dir
+            with storage.open("gs://bucket/cache/done.zip", "wb") as f:
+                f.write(b"done")
+            partial = storage.open("gs://bucket/cache/partial.zip", "wb")
+            partial.write(b"part")
+            partial.flush()
+
+            self.assertEqual(["gs://bucket/cache/done.zip"], storage.list("gs://bucket/cache"))
+            partial.close(commit=False)
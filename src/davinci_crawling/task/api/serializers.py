@@ -19,6 +19,10 @@ from caravaggio_rest_api import fields as dse_fields
 from davinci_crawling.task.models import Task, ON_DEMAND_TASK, STATUS_CREATED, TaskMoreInfo, create_davinci_task_batch
 from davinci_crawling.task.search_indexes import TaskIndex
 
+# Query param of the list and search views to include the events of the tasks
+# in their more info, ex. ?more_info=true
+MORE_INFO_PARAM = "more_info"
+
 
 class TaskMoreInfoSerializer(dse_serializers.UserTypeSerializer):
     source = serializers.CharField(required=False, allow_null=True)
@@ -64,6 +68,27 @@ class TaskSerializerV1(dse_serializers.CassandraModelSerializer, BaseCachedSeria
 
     changed_fields = fields.ListField(required=False, allow_null=True, child=serializers.CharField())
 
+    def _include_events(self):
+        """
+        The events of a task are read with a query per task, only the detail
+        view reads them unless the list asks for them with `MORE_INFO_PARAM`.
+        """
+        view = self.context.get("view", None)
+        if getattr(view, "action", None) == "retrieve":
+            return True
+        request = self.context.get("request", None)
+        query_params = getattr(request, "query_params", {})
+        return query_params.get(MORE_INFO_PARAM, "").lower() in ("1", "true", "yes")
+
+    def to_representation(self, instance, *args, **kwargs):
+        data = super().to_representation(instance, *args, **kwargs)
+        if isinstance(instance, Task) and self._include_events():
+            # the more info is stored on the TaskEvent table, we copy the data
+            # to not change the cached representation.
+            data = data.copy()
+            data["more_info"] = self.fields["more_info"].to_representation(instance.get_more_info())
+        return data
+
     def create(self, validated_data):
         request = self.context.get("request", None)
         if request:
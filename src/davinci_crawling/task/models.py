@@ -2,6 +2,7 @@
 # Copyright (c) 2019 BuildGroup Data Services Inc.
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from caravaggio_rest_api.haystack.query import CaravaggioSearchQuerySet
 from datetime import datetime, date
 
@@ -52,6 +53,11 @@ BATCH_TASK = 2
 
 ALL_TASK_TYPES = [ON_DEMAND_TASK, BATCH_TASK]
 
+DEFAULT_EVENTS_PAGE_SIZE = 100
+
+# Quantity of tasks written at the same time by `create_davinci_tasks_batch`
+DEFAULT_BULK_CONCURRENCY = 16
+
 
 class TaskMoreInfo(UserType):
     __type_name__ = "task_more_info"
@@ -126,6 +132,8 @@ class Task(CustomDjangoCassandraModel):
 
     type = columns.SmallInt(default=ON_DEMAND_TASK)
 
+    # Legacy storage of the more info, new entries are appended to the
+    # TaskEvent table, use `get_more_info` to read all of them.
     more_info = freeze_column(columns.List(value_type=UserDefinedType(TaskMoreInfo)))
 
     differences_from_last_version = columns.Text()
@@ -154,6 +162,60 @@ class Task(CustomDjangoCassandraModel):
                 "Invalid task status [{0}]. Valid status are: " "{1}.".format(self.status, ALL_STATUS)
             )
 
+    def add_more_info(self, source, details):
+        """
+        Append a new more info to the task. This is a single insert on the
+        TaskEvent table no matter how many entries the task already has.
+        Args:
+            source: from where the more info was created.
+            details: the details of the more info.
+
+        Returns: the TaskEvent created.
+        """
+        return append_task_event(self.task_id, source, details)
+
+    def get_events(self, limit=None, after=None):
+        """
+        Get a page of the events appended to the task, in the order they were
+        created.
+        Args:
+            limit: the maximum quantity of events to return.
+            after: the event_id of the last event of the previous page.
+
+        Returns: a list of TaskEvent.
+        """
+        events = TaskEvent.objects.filter(task_id=self.task_id)
+        if after:
+            events = events.filter(event_id__gt=after)
+        if limit:
+            events = events.limit(limit)
+        return list(events)
+
+    def iter_events(self, page_size=DEFAULT_EVENTS_PAGE_SIZE):
+        """
+        Iterate over all the events of the task reading them page by page.
+        """
+        after = None
+        while True:
+            events = self.get_events(limit=page_size, after=after)
+            for event in events:
+                yield event
+
+            if len(events) < page_size:
+                return
+            after = events[-1].event_id
+
+    def get_more_info(self):
+        """
+        All the more info of the task, the ones stored on the legacy
+        `more_info` column followed by the events.
+
+        Returns: a list of TaskMoreInfo.
+        """
+        more_info = list(self.more_info or [])
+        more_info.extend(event.to_more_info() for event in self.iter_events())
+        return more_info
+
 
 class TaskTimeSeries(CustomDjangoCassandraModel):
     """
@@ -178,6 +240,38 @@ class TaskTimeSeries(CustomDjangoCassandraModel):
         get_pk_field = "bucket"
 
 
+class TaskEvent(CustomDjangoCassandraModel):
+    """
+    Append-only log of the more info of a task (errors, maintenance notices,
+    execution times, ...).
+
+    Args:
+        task_id: the task that the event belongs to.
+        event_id: time based uuid that orders the events of the task.
+        source: from where the event was created.
+        created_at: when the event was created.
+        details: the details of the event.
+    """
+
+    __table_name__ = "davinci_task_event"
+
+    task_id = columns.UUID(partition_key=True)
+
+    event_id = columns.TimeUUID(primary_key=True, default=uuid.uuid1, clustering_order="ASC")
+
+    source = columns.Text()
+
+    created_at = columns.DateTime(default=timezone.now)
+
+    details = columns.Text()
+
+    class Meta:
+        get_pk_field = "task_id"
+
+    def to_more_info(self):
+        return TaskMoreInfo(source=self.source, created_at=self.created_at, details=self.details)
+
+
 # We need to set the new value for the changed_at field
 @receiver(pre_save, sender=Task)
 def pre_save_task(sender, instance=None, using=None, update_fields=None, **kwargs):
@@ -243,7 +337,29 @@ def pre_save_task_ts(sender, instance=None, using=None, update_fields=None, **kw
     instance.bucket = datetime.strftime(instance.ts, "%y%m%d%H%M")
 
 
-def create_davinci_task_batch(data: dict, task_instance: Task = None, task_ts_instance: TaskTimeSeries = None) -> Task:
+def append_task_event(task_id, source, details, batch=None) -> TaskEvent:
+    """
+    Append a new event to a task without reading it.
+    Args:
+        task_id: the id of the task.
+        source: from where the event was created.
+        details: the details of the event.
+        batch: if informed the insert is added to this batch instead of being
+        executed.
+
+    Returns: the TaskEvent created.
+    """
+    event = TaskEvent(task_id=task_id, source=source, details=details)
+    if batch:
+        event.batch(batch).save()
+    else:
+        event.save()
+    return event
+
+
+def create_davinci_task_batch(
+    data: dict, task_instance: Task = None, task_ts_instance: TaskTimeSeries = None, events: list = None
+) -> Task:
     if "task_id" not in data:
         data["task_id"] = uuid.uuid4()
 
@@ -256,11 +372,35 @@ def create_davinci_task_batch(data: dict, task_instance: Task = None, task_ts_in
     batch = BatchQuery(consistency=Task._cassandra_consistency_level_write)
     task_instance.batch(batch).save()
     task_ts_instance.batch(batch).save()
+    for source, details in events or []:
+        append_task_event(task_instance.task_id, source, details, batch=batch)
     batch.execute()
 
     return task_instance
 
 
+def create_davinci_tasks_batch(data_list: list, concurrency: int = DEFAULT_BULK_CONCURRENCY) -> list:
+    """
+    Create several tasks (and their time series rows). Every task is written
+    in its own small batch, like `create_davinci_task_batch`, and up to
+    `concurrency` tasks are written at the same time. A single batch for all
+    the tasks would span many partitions and exceed the batch size limits of
+    Cassandra.
+
+    Returns: the tasks created, in the same order than the data.
+    """
+    if not data_list:
+        return []
+
+    # pre_save_task changes the params and options in place, the tasks are
+    # saved at the same time and cannot share them
+    data_list = [
+        {key: dict(value) if isinstance(value, dict) else value for key, value in data.items()} for data in data_list
+    ]
+    with ThreadPoolExecutor(min(concurrency, len(data_list))) as executor:
+        return list(executor.map(create_davinci_task_batch, data_list))
+
+
 def update_davinci_task_batch(task: [Task, str], data: dict) -> Task:
     if not isinstance(task, Task):
         task = Task.objects.get(task_id=task)
@@ -283,7 +423,7 @@ def update_davinci_task_batch(task: [Task, str], data: dict) -> Task:
     return task
 
 
-def update_davinci_task_model_batch(task: Task) -> Task:
+def update_davinci_task_model_batch(task: Task, events: list = None) -> Task:
     if not isinstance(task, Task):
         raise Exception("Should use a Task object")
 
@@ -298,6 +438,8 @@ def update_davinci_task_model_batch(task: Task) -> Task:
     batch = BatchQuery(consistency=Task._cassandra_consistency_level_write)
     task.batch(batch).save()
     task_ts.batch(batch).save()
+    for source, details in events or []:
+        append_task_event(task.task_id, source, details, batch=batch)
     batch.execute()
 
     return task
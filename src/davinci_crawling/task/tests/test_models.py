@@ -3,13 +3,23 @@
 import json
 import logging
 import time
+from types import SimpleNamespace
 
 from caravaggio_rest_api.haystack.backends.utils import CaravaggioSearchPaginator
 from caravaggio_rest_api.utils import delete_all_records
-from davinci_crawling.task.models import Task, STATUS_CREATED, ON_DEMAND_TASK
+from davinci_crawling.task.api.serializers import MORE_INFO_PARAM, TaskSerializerV1
+from davinci_crawling.task.models import (
+    BATCH_TASK,
+    ON_DEMAND_TASK,
+    STATUS_CREATED,
+    Task,
+    TaskMoreInfo,
+    create_davinci_tasks_batch,
+)
 
 from caravaggio_rest_api.tests import CaravaggioBaseTest
 from django.conf import settings
+from django.utils import timezone
 
 CONTENTTYPE_JON = "application/json"
 
@@ -93,3 +103,73 @@ class ModelsTest(CaravaggioBaseTest):
             assert isinstance(task_options, dict)
             assert len(task_options) == len(options)
             assert task_options == options
+
+    def test_task_events(self):
+        task_data = {
+            "user": "user1",
+            "status": STATUS_CREATED,
+            "kind": "bovespa",
+            "options": {},
+            "params": {},
+            "type": ON_DEMAND_TASK,
+            "more_info": [TaskMoreInfo(source="legacy", created_at=timezone.now(), details="0")],
+        }
+        task = Task.create(**task_data)
+
+        for index in range(1, 6):
+            task.add_more_info("test", str(index))
+
+        first_page = task.get_events(limit=2)
+        assert [event.details for event in first_page] == ["1", "2"]
+
+        second_page = task.get_events(limit=2, after=first_page[-1].event_id)
+        assert [event.details for event in second_page] == ["3", "4"]
+
+        assert [event.details for event in task.iter_events(page_size=2)] == ["1", "2", "3", "4", "5"]
+
+        # the legacy more_info goes first
+        more_info = task.get_more_info()
+        assert [info.details for info in more_info] == ["0", "1", "2", "3", "4", "5"]
+        assert more_info[0].source == "legacy"
+
+    def test_serialized_events(self):
+        task_data = {
+            "user": "user1",
+            "status": STATUS_CREATED,
+            "kind": "bovespa",
+            "options": {},
+            "params": {},
+            "type": ON_DEMAND_TASK,
+            "more_info": [TaskMoreInfo(source="legacy", created_at=timezone.now(), details="0")],
+        }
+        task = Task.create(**task_data)
+        task.add_more_info("test", "1")
+
+        def more_info(action, query_params):
+            context = {"view": SimpleNamespace(action=action), "request": SimpleNamespace(query_params=query_params)}
+            return [info["details"] for info in TaskSerializerV1(task, context=context).data["more_info"]]
+
+        # the lists don't read the events of every task
+        assert more_info("list", {}) == ["0"]
+        assert more_info("list", {MORE_INFO_PARAM: "true"}) == ["0", "1"]
+        assert more_info("retrieve", {}) == ["0", "1"]
+
+    def test_create_tasks_batch(self):
+        # the options of the crawl command, shared by all the tasks
+        options = {"crawler": "bovespa", "from_date": timezone.now(), "to_date": None, "workers_num": 4}
+        data_list = [
+            {"user": "batchuser", "kind": "bovespa", "params": {"ccvm": ccvm}, "options": options, "type": BATCH_TASK}
+            for ccvm in range(50)
+        ]
+
+        tasks = create_davinci_tasks_batch(data_list, concurrency=8)
+
+        assert [json.loads(task.params)["ccvm"] for task in tasks] == list(range(50))
+        for task in tasks:
+            stored = Task.objects.get(task_id=task.task_id)
+            stored_options = json.loads(stored.options)
+            assert "to_date" not in stored_options
+            assert stored_options["workers_num"] == 4
+            assert stored_options["from_date"] == options["from_date"].strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        # the options of the caller are not changed
+        assert options["to_date"] is None
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 BuildGroup Data Services Inc.
+import asyncio
+import gc
+import hashlib
+from unittest import mock
+
+import httpx
+
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+from davinci_crawling import aionet
+from davinci_crawling.aionet import AsyncHttpEngine
+from davinci_crawling.storage.memory_storage import MemoryStorage
+from davinci_crawling.storage.storage import get_storage
+
+FILE_CONTENT = b"zip content" * 1000
+
+
+def _handler(request):
+    if request.url.path == "/file":
+        return httpx.Response(
+            200, content=FILE_CONTENT, headers={"Content-Disposition": 'attachment; filename="file.zip"'}
+        )
+    return httpx.Response(200, json={"path": request.url.path})
+
+
+class TestAioNet(CaravaggioBaseTest):
+    """
+    Test the async helpers against a mocked transport.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pass
+
+    def setUp(self):
+        MemoryStorage.clear()
+        self.engine = AsyncHttpEngine(transport=httpx.MockTransport(_handler))
+        patches = [
+            mock.patch.object(aionet, "engine", self.engine),
+            mock.patch.object(aionet, "get_proxy_address", return_value={}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_client_reuse(self):
+        async def get_clients():
+            first = self.engine.get_client()
+            response = await aionet.get_json("http://test/json", use_proxy=False)
+            return first, self.engine.get_client(), response.json()
+
+        first, second, body = asyncio.run(get_clients())
+        self.assertIs(first, second)
+        self.assertEqual({"path": "/json"}, body)
+
+        # every loop gets its own clients
+        other, _, _ = asyncio.run(get_clients())
+        self.assertIsNot(first, other)
+
+    def test_closed_loops(self):
+        async def get_client():
+            return self.engine.get_client()
+
+        for _ in range(3):
+            asyncio.run(get_client())
+        gc.collect()
+
+        # the clients of the closed loops are not kept
+        self.assertEqual(0, len(self.engine._clients))
+
+        async def get_and_close():
+            self.engine.get_client()
+            await self.engine.aclose()
+
+        asyncio.run(get_and_close())
+        self.assertEqual(0, len(self.engine._clients))
+
+    def test_fetch_json(self):
+        page = asyncio.run(aionet.fetch_json("http://test/json"))
+
+        self.assertEqual(200, page.status)
+        self.assertEqual({"path": "/json"}, page.body)
+
+    def test_fetch_file(self):
+        file = asyncio.run(
+            aionet.fetch_file("http://test/file", {"base_path": "mem://local", "cache_path": "mem://cache"})
+        )
+
+        self.assertEqual("file.zip", file.filename)
+        self.assertEqual("mem://local/file.zip", file.file)
+        self.assertEqual("mem://cache/file.zip", file.cache_file)
+        self.assertEqual(hashlib.md5(FILE_CONTENT).hexdigest(), file.checksum)
+        self.assertEqual(FILE_CONTENT, get_storage(file.file).read(file.file))
+        self.assertEqual(FILE_CONTENT, get_storage(file.cache_file).read(file.cache_file))
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) 2020 BuildGroup Data Services Inc.
 from caravaggio_rest_api.tests import CaravaggioBaseTest
+from davinci_crawling.crawler import get_chrome_options
 from davinci_crawling.example.bovespa.models import BovespaCompany
 from davinci_crawling.task.models import STATUS_CREATED, ON_DEMAND_TASK, Task
 from davinci_crawling.utils import CrawlersRegistry
@@ -33,6 +34,15 @@ class TestCrawl(CaravaggioBaseTest):
         for key, value in all_defaults.items():
             self.assertEquals(value, parser.get_default(key))
 
+    def test_chrome_options(self):
+        first_options = get_chrome_options("/chromium", "proxy1:3128")
+        second_options = get_chrome_options("/chromium", "proxy2:3128")
+
+        self.assertIsNot(first_options, second_options)
+        self.assertIn("--proxy-server=proxy1:3128", first_options.arguments)
+        self.assertNotIn("--proxy-server=proxy1:3128", second_options.arguments)
+        self.assertEqual(len(first_options.arguments), len(second_options.arguments))
+
     @staticmethod
     def _create_bovespa_company(ccvm, company_name, situation):
         data = {"ccvm": ccvm, "company_name": company_name, "situation": situation}
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 BuildGroup Data Services Inc.
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+from davinci_crawling.driver_pool import WebDriverPool
+
+
+class FakePhantomJSDriver(object):
+    """
+    A driver without the DevTools protocol.
+    """
+
+    def __init__(self, proxy_address):
+        self.proxy_address = proxy_address
+        self.quit_called = False
+
+    @property
+    def current_url(self):
+        if self.quit_called:
+            raise Exception("The browser is dead")
+        return "about:blank"
+
+    def get(self, url):
+        pass
+
+    def quit(self):
+        self.quit_called = True
+
+
+class FakeDriver(FakePhantomJSDriver):
+    def __init__(self, proxy_address):
+        super().__init__(proxy_address)
+        self.cdp_commands = []
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        self.cdp_commands.append((cmd, cmd_args))
+
+
+class TestWebDriverPool(CaravaggioBaseTest):
+    """
+    Test the pool of web drivers.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pass
+
+    def test_reuse(self):
+        pool = WebDriverPool(lambda proxy_address, **options: FakeDriver(proxy_address), max_size=2, max_uses=2)
+
+        driver = pool.checkout("proxy1")
+        pool.checkin(driver)
+        # the state of all the origins is cleared
+        self.assertEqual(
+            [
+                ("Network.clearBrowserCookies", {}),
+                ("Storage.clearDataForOrigin", {"origin": "*", "storageTypes": "all"}),
+            ],
+            driver.cdp_commands,
+        )
+
+        # same proxy, same driver
+        self.assertIs(driver, pool.checkout("proxy1"))
+        pool.checkin(driver)
+        # recycled after max_uses
+        self.assertTrue(driver.quit_called)
+
+        new_driver = pool.checkout("proxy1")
+        self.assertIsNot(driver, new_driver)
+
+        # the pool is full, the idle drivers of other proxies are evicted
+        other_driver = pool.checkout("proxy2")
+        pool.checkin(other_driver)
+        self.assertEqual("proxy3", pool.checkout("proxy3").proxy_address)
+        self.assertTrue(other_driver.quit_called)
+
+    def test_full_pool(self):
+        pool = WebDriverPool(
+            lambda proxy_address, **options: FakeDriver(proxy_address), max_size=1, checkout_timeout=0.1
+        )
+
+        pool.checkout("proxy1")
+        with self.assertRaises(TimeoutError):
+            pool.checkout("proxy1")
+
+    def test_dead_driver(self):
+        pool = WebDriverPool(lambda proxy_address, **options: FakeDriver(proxy_address), max_size=1)
+
+        driver = pool.checkout(None)
+        pool.checkin(driver)
+        driver.quit()
+
+        self.assertIsNot(driver, pool.checkout(None))
+
+    def test_checkout_any_proxy(self):
+        pool = WebDriverPool(lambda proxy_address, **options: FakeDriver(proxy_address), max_size=4)
+        proxies = iter(["proxy1", "proxy2", "proxy3"])
+
+        first = pool.checkout_any(lambda: next(proxies))
+        second = pool.checkout_any(lambda: next(proxies))
+        self.assertEqual(["proxy1", "proxy2"], [first.proxy_address, second.proxy_address])
+        pool.checkin(first)
+
+        # the idle driver is reused, no proxy is chosen
+        self.assertIs(first, pool.checkout_any(lambda: self.fail("A new driver was launched")))
+
+        # the drivers without proxy are only reused without proxy
+        no_proxy = pool.checkout(None)
+        pool.checkin(no_proxy)
+        self.assertEqual("proxy3", pool.checkout_any(lambda: next(proxies)).proxy_address)
+        self.assertIs(no_proxy, pool.checkout(None))
+
+    def test_recycle_without_devtools(self):
+        pool = WebDriverPool(lambda proxy_address, **options: FakePhantomJSDriver(proxy_address), max_size=1)
+
+        driver = pool.checkout(None)
+        pool.checkin(driver)
+
+        # the session cannot be cleared, the driver is not reused
+        self.assertTrue(driver.quit_called)
+        self.assertIsNot(driver, pool.checkout(None))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 BuildGroup Data Services Inc.
+from unittest import mock
+
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+from davinci_crawling.net import SessionPool
+
+
+def _proxy(n):
+    return {"https": "http://proxy-{}:8080".format(n)}
+
+
+class TestSessionPool(CaravaggioBaseTest):
+    """
+    Test the eviction of the sessions of the pool.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pass
+
+    def setUp(self):
+        self.now = 0
+        patch = mock.patch("davinci_crawling.net.time.monotonic", side_effect=lambda: self.now)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        self.pool = SessionPool(max_sessions=2, idle_timeout=10)
+        self.pool._new_session = lambda proxy_address: mock.MagicMock()
+
+    def test_lru_eviction(self):
+        first = self.pool.get_session(_proxy(1))
+        second = self.pool.get_session(_proxy(2))
+        # the first one is the most recently used now
+        self.assertIs(first, self.pool.get_session(_proxy(1)))
+
+        self.pool.get_session(_proxy(3))
+
+        second.close.assert_called_once()
+        first.close.assert_not_called()
+        self.assertIs(first, self.pool.get_session(_proxy(1)))
+
+    def test_idle_eviction(self):
+        first = self.pool.get_session(_proxy(1))
+        self.now = 5
+        second = self.pool.get_session(_proxy(2))
+
+        self.now = 12
+        self.pool.get_session(_proxy(2))
+
+        first.close.assert_called_once()
+        second.close.assert_not_called()
+
+    def test_busy_sessions_are_not_evicted(self):
+        with self.pool.session(_proxy(1)) as busy:
+            # a long download, the session is idle for the pool
+            self.now = 100
+            self.pool.get_session(_proxy(2))
+            self.pool.get_session(_proxy(3))
+            busy.close.assert_not_called()
+
+            # the session is still shared while it's in use
+            self.assertIs(busy, self.pool.get_session(_proxy(1)))
+
+        # the idle time counts from the end of the use
+        self.now = 105
+        self.pool.get_session(_proxy(4))
+        busy.close.assert_not_called()
+
+        self.now = 120
+        self.pool.get_session(_proxy(5))
+        busy.close.assert_called_once()
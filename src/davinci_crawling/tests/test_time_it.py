@@ -76,7 +76,7 @@ class TestTimeIt(CaravaggioBaseTest):
 
         task = Task.objects.get(task_id=task.task_id)
         # 10 execution_times + the existent more_info
-        self.assertEquals(len(task.more_info), 11)
+        self.assertEquals(len(task.get_more_info()), 11)
 
     def test_time_it_many_times(self):
         @TimeIt()
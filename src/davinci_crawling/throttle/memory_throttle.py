@@ -3,14 +3,14 @@
 
 # https://quentin.pradet.me/blog/how-do-you-rate-limit-calls-with-aiohttp.html
 import logging
+import threading
 import time
-from multiprocessing import Manager
 
 from davinci_crawling.throttle.throttle import ThrottleManager
 
-manager = Manager()
-lock = manager.Lock()
-_throttle_info = manager.dict()
+lock = threading.Lock()
+# key -> [tokens, updated_at]
+_throttle_info = {}
 
 _logger = logging.getLogger("davinci_crawling")
 
@@ -24,40 +24,31 @@ class MemoryThrottle(ThrottleManager):
         @throttle(minutes=1, rate=10, max_tokens=10)
         def my_fun():
             pass
+
+    The tokens are shared by all the threads of the process. When there are
+    no tokens available the thread sleeps exactly the time needed to generate
+    the next one.
     """
 
     def wait_for_token(self, key):
-        lock.acquire()
-        self._check_info(key)
-        while _throttle_info[key]["tokens"] <= 1:
-            self._add_new_tokens(key)
-            lock.release()
-            _logger.debug("Function {} being throttle".format(key))
-            time.sleep(5)
-            lock.acquire()
-
-        _throttle_info[key] = {
-            "tokens": _throttle_info[key]["tokens"] - 1,
-            "updated_at": _throttle_info[key]["updated_at"],
-        }
-        _logger.debug("Tokens info. {0} -> {1}".format(key, _throttle_info[key]))
-        lock.release()
+        throttle_times = 0
+        while True:
+            with lock:
+                info = self._check_info(key)
+                info[0], info[1], wait = self._take_token(info[0], info[1], time.monotonic())
+
+            if not wait:
+                _logger.debug("Tokens info. {0} -> {1}".format(key, info[0]))
+                return throttle_times
+
+            throttle_times += 1
+            _logger.debug("Function {} being throttle for {:.3f} seconds".format(key, wait))
+            time.sleep(wait)
 
     def _check_info(self, key):
-        _logger.debug("Checking tokens info for {0}".format(key))
         info = _throttle_info.get(key, None)
         if not info:
             _logger.debug("Initialize tokens for {0}".format(key))
-            info = {"tokens": self.max_tokens, "updated_at": time.monotonic()}
+            info = [self.max_tokens, time.monotonic()]
             _throttle_info[key] = info
-
-    def _add_new_tokens(self, key):
-        now = time.monotonic()
-        time_since_update = (now - _throttle_info[key]["updated_at"]) / self.throttle_period.seconds
-        new_tokens = int(time_since_update * self.rate)
-        if new_tokens > 1:
-            _throttle_info[key] = {
-                "tokens": min(_throttle_info[key]["tokens"] + new_tokens, self.max_tokens),
-                "updated_at": now,
-            }
-            _logger.debug("New Tokens info. {0} -> {1}".format(key, _throttle_info[key]))
+        return info
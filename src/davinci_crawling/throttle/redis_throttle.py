@@ -3,45 +3,119 @@
 
 # https://quentin.pradet.me/blog/how-do-you-rate-limit-calls-with-aiohttp.html
 import logging
+import threading
 import time
-from multiprocessing import Manager
 
+import redis
 from davinci_crawling.throttle.throttle import ThrottleManager
 from django.conf import settings
-from pylimit import PyRateLimit
-
-manager = Manager()
-lock = manager.Lock()
-_throttle_info = manager.dict()
 
 _logger = logging.getLogger("davinci_crawling")
 
+# Token bucket executed atomically in the redis server, it refills the bucket
+# using the server clock (the same for all the crawlers), tries to take the
+# requested tokens and returns the seconds to wait until they are available.
+#   KEYS[1]: the key of the bucket
+#   ARGV[1]: tokens generated per second
+#   ARGV[2]: maximum quantity of tokens
+#   ARGV[3]: tokens requested
+TOKEN_BUCKET_SCRIPT = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+
+local rate = tonumber(ARGV[1])
+local max_tokens = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(state[1])
+local updated_at = tonumber(state[2])
+if tokens == nil then
+    tokens = max_tokens
+    updated_at = now
+end
+
+tokens = math.min(max_tokens, tokens + math.max(0, now - updated_at) * rate)
+
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+
+redis.call("HMSET", KEYS[1], "tokens", tokens, "updated_at", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(max_tokens / rate) + 1)
+
+-- the numbers are truncated to integers in the reply
+return tostring(wait)
+"""
+
+KEY_PREFIX = "davinci_throttle:"
+
+_lock = threading.Lock()
+_connection_pool = None
+_token_bucket_script = None
+
+
+def get_token_bucket_script():
+    """
+    The registered script, all the throttles of the process share the same
+    connection pool.
+    """
+    global _connection_pool, _token_bucket_script
+    with _lock:
+        if not _token_bucket_script:
+            _connection_pool = redis.ConnectionPool(
+                host=settings.REDIS_HOST_PRIMARY,
+                port=int(settings.REDIS_PORT_PRIMARY),
+                password=settings.REDIS_PASS_PRIMARY or None,
+            )
+            client = redis.Redis(connection_pool=_connection_pool)
+            _token_bucket_script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    return _token_bucket_script
+
 
 class RedisThrottle(ThrottleManager):
     """
     Use redis as throttle implementation, this method will check on redis if
     we can proceed with the throttle, this way the throttle will be distributed
-    instead of single machine as MemoryThrottle
+    instead of single machine as MemoryThrottle.
+
+    Every attempt is a single round-trip that runs the token bucket atomically
+    in the server and returns the exact time to wait for the next token.
     """
 
     def __init__(self, crawler_name, seconds=1, minutes=0, hours=0, rate=10, max_tokens=10):
         super().__init__(crawler_name, seconds, minutes, hours, rate, max_tokens)
 
-        PyRateLimit.init(
-            redis_host=settings.REDIS_HOST_PRIMARY,
-            redis_port=settings.REDIS_PORT_PRIMARY,
-            redis_password=settings.REDIS_PASS_PRIMARY,
-        )
+        self.tokens_per_second = self.rate / self.throttle_period.total_seconds()
+        self.script = get_token_bucket_script()
 
-    def wait_for_token(self, key):
-        pylimit = PyRateLimit(int(self.throttle_period.total_seconds()), self.rate)
+    def wait_for_token(self, key, tokens=1):
+        """
+        Block until the tokens are available.
+        Args:
+            key: the key of the bucket.
+            tokens: the quantity of tokens to acquire at once, used by the
+            functions that do several calls in batch.
+
+        Returns: the quantity of times that we had to wait.
+        """
+        if tokens > self.max_tokens:
+            raise ValueError("Unable to acquire {0} tokens, the maximum is {1}".format(tokens, self.max_tokens))
 
         throttle_times = 0
-        current_time = int(round(time.time() * 1000000))
+        while True:
+            wait = float(self.script(keys=[KEY_PREFIX + key], args=[self.tokens_per_second, self.max_tokens, tokens]))
+            if not wait:
+                return throttle_times
 
-        while not pylimit.attempt(key, timestamp=current_time):
             throttle_times += 1
-            _logger.debug("Function {} being throttle".format(key))
-            time.sleep(5)
-
-        return throttle_times
+            _logger.debug("Function {} being throttle for {:.3f} seconds".format(key, wait))
+            time.sleep(wait)
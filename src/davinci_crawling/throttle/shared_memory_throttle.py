@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+import fcntl
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from davinci_crawling.throttle.throttle import ThrottleManager
+from django.conf import settings
+
+_logger = logging.getLogger("davinci_crawling")
+
+# /dev/shm is a memory backed filesystem, the state of the buckets never
+# touches the disk
+DEFAULT_SHARED_MEMORY_DIR = "/dev/shm/davinci_throttle" if os.path.isdir("/dev/shm") else None
+
+# tokens and updated_at
+_STATE_FORMAT = "dd"
+_STATE_SIZE = struct.calcsize(_STATE_FORMAT)
+
+lock = threading.Lock()
+_files = {}
+
+
+def get_shared_memory_dir():
+    if (
+        hasattr(settings, "DAVINCI_CONF")
+        and "throttle" in settings.DAVINCI_CONF["architecture-params"]
+        and "shared-memory-dir" in settings.DAVINCI_CONF["architecture-params"]["throttle"]
+    ):
+        return settings.DAVINCI_CONF["architecture-params"]["throttle"]["shared-memory-dir"]
+
+    return DEFAULT_SHARED_MEMORY_DIR or os.path.join(tempfile.gettempdir(), "davinci_throttle")
+
+
+class SharedMemoryThrottle(ThrottleManager):
+    """
+    Same token bucket than MemoryThrottle but the tokens are shared by all
+    the processes of the machine. The state of every bucket lives in a small
+    file of a memory backed folder and it's updated under an exclusive file
+    lock, so it can be used by multi-process workers.
+    """
+
+    def __init__(self, crawler_name, seconds=1, minutes=0, hours=0, rate=10, max_tokens=10):
+        super().__init__(crawler_name, seconds, minutes, hours, rate, max_tokens)
+        self.shared_memory_dir = get_shared_memory_dir()
+        os.makedirs(self.shared_memory_dir, exist_ok=True)
+
+    def _get_file(self, key):
+        # the file locks are shared with the forked children through the
+        # inherited descriptors, every process needs to open its own ones
+        file_key = (os.getpid(), key)
+        fd = _files.get(file_key)
+        if fd is None:
+            file_name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+            fd = os.open(os.path.join(self.shared_memory_dir, file_name), os.O_RDWR | os.O_CREAT, 0o600)
+            _files[file_key] = fd
+        return fd
+
+    def wait_for_token(self, key):
+        throttle_times = 0
+        while True:
+            # the thread lock protects from the other threads of the process,
+            # the file lock from the other processes
+            with lock:
+                fd = self._get_file(key)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    data = os.pread(fd, _STATE_SIZE, 0)
+                    # time.time because the monotonic clock is not guaranteed
+                    # to be shared between processes
+                    now = time.time()
+                    if len(data) < _STATE_SIZE:
+                        _logger.debug("Initialize tokens for {0}".format(key))
+                        tokens, updated_at = self.max_tokens, now
+                    else:
+                        tokens, updated_at = struct.unpack(_STATE_FORMAT, data)
+
+                    tokens, updated_at, wait = self._take_token(tokens, updated_at, now)
+                    os.pwrite(fd, struct.pack(_STATE_FORMAT, tokens, updated_at), 0)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+            if not wait:
+                return throttle_times
+
+            throttle_times += 1
+            _logger.debug("Function {} being throttle for {:.3f} seconds".format(key, wait))
+            time.sleep(wait)
@@ -19,19 +19,27 @@ class TestRedisThrottle(CaravaggioBaseTest):
 
     def test_throttle(self):
         """
-        Test two throttle
+        Test the throttle of a single client, once the bucket is empty every
+        call waits exactly for the next token
         """
         throttle = RedisThrottle("test", seconds=10, rate=10, max_tokens=10)
-        quantity = 0
-        for x in range(40):
-            times_throttled = throttle.wait_for_token("test")
-            # only the 10th will be throttled
-            if quantity == 10:
-                self.assertTrue(2 <= times_throttled <= 3)
-                quantity = 0
-            else:
+        for x in range(15):
+            times_throttled = throttle.wait_for_token("test_throttle")
+            if x < 10:
                 self.assertEqual(0, times_throttled)
-                quantity += 1
+            else:
+                self.assertEqual(1, times_throttled)
+
+    def test_batch_throttle(self):
+        """
+        Test the acquisition of several tokens at once
+        """
+        throttle = RedisThrottle("test", seconds=10, rate=10, max_tokens=10)
+        self.assertEqual(0, throttle.wait_for_token("test_batch_throttle", tokens=10))
+        self.assertEqual(1, throttle.wait_for_token("test_batch_throttle", tokens=2))
+
+        with self.assertRaises(ValueError):
+            throttle.wait_for_token("test_batch_throttle", tokens=11)
 
     def test_thread_throttle(self):
         def do_thread(results):
@@ -39,7 +47,7 @@ class TestRedisThrottle(CaravaggioBaseTest):
 
             times_throttled = 0
             for x in range(10):
-                _times_throttled = throttle.wait_for_token("test")
+                _times_throttled = throttle.wait_for_token("test_thread_throttle")
                 times_throttled += _times_throttled
 
             results.append(times_throttled)
@@ -54,6 +62,6 @@ class TestRedisThrottle(CaravaggioBaseTest):
         t1.join()
         t2.join()
 
-        self.assertTrue(results)
-        for result in results:
-            self.assertTrue(result > 0)
+        self.assertEqual(2, len(results))
+        # the bucket only has 10 tokens for the 20 calls
+        self.assertTrue(sum(results) >= 10)
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) 2020 BuildGroup Data Services Inc.
 import logging
+import multiprocessing
 import time
 
 from caravaggio_rest_api.tests import CaravaggioBaseTest
+from davinci_crawling.throttle.memory_throttle import MemoryThrottle
+from davinci_crawling.throttle.redis_throttle import RedisThrottle
+from davinci_crawling.throttle.shared_memory_throttle import SharedMemoryThrottle
 from davinci_crawling.throttle.throttle import Throttle
 from django.conf import settings
 
@@ -24,13 +28,15 @@ class TestThrottle(CaravaggioBaseTest):
 
         suffixes = ["from Brazil", "from USA"]
         start = time.time()
-        for index in range(50):
+        # 25 calls per suffix use the initial tokens, the other 25 should be
+        # throttled at exactly 2.5 calls per second
+        for index in range(100):
             suffix = suffixes[index % 2]
             throttle_method("Mr.", suffix=suffix, print_name="John%d" % index)
         end = time.time()
         total = end - start
 
-        self.assertTrue(10 < total < 20)
+        self.assertTrue(9.5 < total < 11)
 
     def test_method_with_args(self):
         @Throttle(crawler_name="test_args", seconds=10, max_tokens=25, rate=25, throttle_suffix_field="suffix")
@@ -39,10 +45,42 @@ class TestThrottle(CaravaggioBaseTest):
 
         suffixes = ["from Brazil", "from USA"]
         start = time.time()
-        for index in range(50):
+        for index in range(100):
             suffix = suffixes[index % 2]
             throttle_method("Mr.", suffix, "John%d" % index)
         end = time.time()
         total = end - start
 
-        self.assertTrue(10 < total < 20)
+        self.assertTrue(9.5 < total < 11)
+
+    def test_shared_memory_throttle(self):
+        def do_process(key):
+            throttle = SharedMemoryThrottle("test_shared", seconds=1, rate=10, max_tokens=10)
+            for _ in range(15):
+                throttle.wait_for_token(key)
+
+        key = "test_shared_%f" % time.time()
+        processes = [multiprocessing.Process(target=do_process, args=(key,)) for _ in range(2)]
+
+        start = time.time()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        total = time.time() - start
+
+        # 30 tokens: the 10 initial ones and 20 more at 10 per second
+        self.assertTrue(1.9 < total < 3)
+
+    def test_share_between_processes(self):
+        manager_clazz = Throttle.manager_clazz
+        self.addCleanup(setattr, Throttle, "manager_clazz", manager_clazz)
+
+        Throttle.manager_clazz = MemoryThrottle
+        Throttle.share_between_processes()
+        self.assertIs(SharedMemoryThrottle, Throttle.get_manager_clazz())
+
+        # the implementations already shared are kept
+        Throttle.manager_clazz = RedisThrottle
+        Throttle.share_between_processes()
+        self.assertIs(RedisThrottle, Throttle.get_manager_clazz())
@@ -12,6 +12,10 @@ from django.conf import settings
 
 DEFAULT_THROTTLE_MANAGER = "davinci_crawling.throttle.memory_throttle.MemoryThrottle"
 
+# The throttle used instead of the MemoryThrottle when the tokens should be
+# shared by several processes
+SHARED_THROTTLE_MANAGER = "davinci_crawling.throttle.shared_memory_throttle.SharedMemoryThrottle"
+
 
 class Throttle(object):
     """
@@ -50,6 +54,18 @@ class Throttle(object):
 
         return cls.manager_clazz
 
+    @classmethod
+    def share_between_processes(cls):
+        """
+        Make the tokens of the throttles shared by all the processes of the
+        machine (ex. the consumer processes of the crawl command). The
+        MemoryThrottle, whose tokens are local to the process, is replaced by
+        the SharedMemoryThrottle, the other implementations are already
+        shared.
+        """
+        if cls.get_manager_clazz() is get_class_from_name(DEFAULT_THROTTLE_MANAGER):
+            cls.manager_clazz = get_class_from_name(SHARED_THROTTLE_MANAGER)
+
     def get_throttle_manager(self):
         if not self.manager:
             manager_clazz = self.get_manager_clazz()
@@ -96,3 +112,25 @@ class ThrottleManager(ABC):
     @abstractmethod
     def wait_for_token(self, key):
         raise NotImplementedError
+
+    def _take_token(self, tokens, updated_at, now):
+        """
+        Token bucket step, refill the bucket with the tokens generated since
+        the last update and try to take one of them.
+        Args:
+            tokens: the tokens available on the last update.
+            updated_at: the time (seconds) of the last update.
+            now: the current time (seconds).
+
+        Returns: a tuple with the new quantity of tokens, the new update time
+        and the seconds to wait until the next token is available (0 if we
+        got the token).
+        """
+        tokens_per_second = self.rate / self.throttle_period.total_seconds()
+        elapsed = max(now - updated_at, 0)
+        tokens = min(tokens + elapsed * tokens_per_second, self.max_tokens)
+
+        if tokens >= 1:
+            return tokens - 1, now, 0
+
+        return tokens, now, (1 - tokens) / tokens_per_second
@@ -134,23 +134,22 @@ class TimeIt:
 
     @staticmethod
     def write_times_to_more_info(davinci_task_id, executions_times):
-        from davinci_crawling.task.models import TaskMoreInfo, Task
+        from davinci_crawling.task.models import Task, TaskEvent
 
-        davinci_task = Task.objects.get(task_id=davinci_task_id)
+        try:
+            from dse.cqlengine.query import BatchQuery, BatchType
+        except ImportError:
+            from cassandra.cqlengine.query import BatchQuery, BatchType
 
-        if not davinci_task.more_info:
-            more_info = []
-        else:
-            more_info = davinci_task.more_info
+        if isinstance(davinci_task_id, Task):
+            davinci_task_id = davinci_task_id.task_id
 
+        # all the events share the task partition, so an unlogged batch is
+        # a single write no matter how many times we have
+        batch = BatchQuery(batch_type=BatchType.Unlogged, consistency=TaskEvent._cassandra_consistency_level_write)
         for execution_time in executions_times:
-            more_info.append(TaskMoreInfo(**execution_time))
-
-        # TODO: find a better way to deal with this frozen update on collection
-        davinci_task.more_info = None
-        davinci_task.save()
-        davinci_task.more_info = more_info
-        davinci_task.save()
+            TaskEvent(task_id=davinci_task_id, **execution_time).batch(batch).save()
+        batch.execute()
 
     def __call__(self, fn):
         @wraps(fn)